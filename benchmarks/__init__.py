@@ -0,0 +1,16 @@
+"""Benchmarks of ProteusISC's compiler, bit types, drivers and simulators.
+
+Run them with (from the project directory):
+
+    python -m benchmarks [-k PATTERN] [--quick] [--compare OLD.json]
+
+Every bench_*.py module holds benchmark classes in the style of asv:
+each class has params (a list of value lists) and param_names, and is
+instantiated and set up (setup(*params)) again before every sample.
+Methods named time_* are timed. Methods named track_* return a number
+that is recorded as is (for example a simulated time from a
+LatencyHandle), in the unit named by the method's unit attribute.
+
+The results are written as JSON (by default to
+benchmarks/results/<commit>.json) so runs can be compared across commits.
+"""
@@ -0,0 +1,203 @@
+"""Run the benchmarks and store the results as JSON.
+
+Usage: python -m benchmarks [-k PATTERN] [--quick] [--repeat N]
+                            [-o OUTPUT] [--compare OLD.json]
+
+Every benchmark runs in its own process with each set of params, so
+caches do not carry over between benchmarks, and a benchmark running
+out of memory only fails itself.
+"""
+import argparse
+import datetime
+import fnmatch
+import importlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import warnings
+
+_file_version = 1
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+#Slow benchmarks are not repeated once a sample takes this long.
+max_sample_time = 10
+
+def find_benchmarks():
+    """Yield (name, class, method name) of every benchmark, sorted by name."""
+    for fname in sorted(os.listdir(here)):
+        if not (fname.startswith('bench_') and fname.endswith('.py')):
+            continue
+        modname = fname[:-3]
+        mod = importlib.import_module('benchmarks.'+modname)
+        for clsname, cls in sorted(vars(mod).items()):
+            if not isinstance(cls, type) or clsname.startswith('_') or\
+               cls.__module__ != mod.__name__:
+                continue
+            for attr in sorted(vars(cls)):
+                if attr.startswith(('time_', 'track_')):
+                    yield "%s.%s.%s"%(modname, clsname, attr), cls, attr
+
+def param_sets(cls, quick=False):
+    """Yield every combination of a benchmark class's params as a dict."""
+    names = getattr(cls, 'param_names', [])
+    params = getattr(cls, 'params', [])
+    if quick:
+        params = [values[:1] for values in params]
+    for values in itertools.product(*params):
+        yield dict(zip(names, values))
+
+def run_one(cls, attr, params, repeat):
+    """Take samples of one benchmark with one set of params.
+
+    Returns:
+        A list of seconds (time_ benchmarks) or tracked values.
+    """
+    samples = []
+    args = list(params.values())
+    for _ in range(repeat):
+        bench = cls()
+        if hasattr(bench, 'setup'):
+            bench.setup(*args)
+        try:
+            method = getattr(bench, attr)
+            start = time.perf_counter()
+            res = method(*args)
+            elapsed = time.perf_counter()-start
+        finally:
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*args)
+        samples.append(res if attr.startswith('track_') else elapsed)
+        if elapsed > max_sample_time:
+            break
+    return samples
+
+def _run_worker(name, params, repeat):
+    """Run one benchmark in a new process.
+
+    Returns:
+        The list of samples.
+
+    Raises:
+        RuntimeError: The benchmark failed.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-m', 'benchmarks', '--worker', name,
+         json.dumps(params), str(repeat)],
+        cwd=os.path.dirname(here), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    if proc.returncode:
+        err = proc.stderr.decode(errors='replace').strip().splitlines()
+        raise RuntimeError(err[-1] if err else
+                           "exit code %s"%proc.returncode)
+    return json.loads(proc.stdout.decode())
+
+def _worker(name, params, repeat):
+    for benchname, cls, attr in find_benchmarks():
+        if benchname == name:
+            print(json.dumps(run_one(cls, attr, json.loads(params),
+                                     int(repeat))))
+            return
+    raise ValueError("No benchmark named %s"%name)
+
+def _key(name, params):
+    return "%s(%s)"%(name, ", ".join("%s=%s"%item
+                                     for item in params.items()))
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(pattern=None, *, quick=False, repeat=3, out=sys.stdout):
+    """Run the benchmarks with names matching pattern (fnmatch style).
+
+    Returns:
+        A dict of the results, ready to be stored as JSON.
+    """
+    results = {}
+    for name, cls, attr in find_benchmarks():
+        if pattern and not fnmatch.fnmatch(name, pattern) and\
+           pattern not in name:
+            continue
+        unit = getattr(getattr(cls, attr), 'unit', 'seconds')
+        for params in param_sets(cls, quick):
+            key = _key(name, params)
+            try:
+                samples = _run_worker(name, params, repeat)
+            except RuntimeError as e:
+                results[key] = {'unit': unit, 'error': str(e)}
+                print("%-80s FAILED: %s"%(key, e), file=out)
+                continue
+            ordered = sorted(samples)
+            results[key] = {
+                'unit': unit,
+                'samples': samples,
+                'best': ordered[0],
+                'median': ordered[len(ordered)//2],
+            }
+            print("%-80s %12.6f %s"%(key, ordered[0], unit), file=out)
+    return {
+        '_file_version': _file_version,
+        'commit': _commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+def compare(old, new, out=sys.stdout):
+    """Print the ratio of the best results of two runs."""
+    for key in sorted(new['results']):
+        if 'best' not in new['results'][key] or\
+           'best' not in old['results'].get(key, {}):
+            continue
+        before = old['results'][key]['best']
+        after = new['results'][key]['best']
+        ratio = after/before if before else float('inf')
+        print("%-80s %8.2fx"%(key, ratio), file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Run the ProteusISC benchmarks.")
+    parser.add_argument('-k', dest='pattern',
+                        help="Only run benchmarks with names matching this.")
+    parser.add_argument('--quick', action='store_true',
+                        help="Only run the first value of every param.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Samples to take of every benchmark.")
+    parser.add_argument('-o', dest='output',
+                        help="File to store the results in. Defaults to "
+                        "benchmarks/results/<commit>.json.")
+    parser.add_argument('--compare', metavar='OLD',
+                        help="Results file to compare this run to.")
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore')
+    if args.worker:
+        _worker(*args.worker)
+        return
+    res = run(args.pattern, quick=args.quick, repeat=args.repeat)
+
+    output = args.output or os.path.join(
+        here, 'results', "%s.json"%(res['commit'] or 'unknown'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(res, f, indent=4, sort_keys=True)
+    print("Results written to", output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), res)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from proteusisc.bittypes import CompositeBitarray, ConstantBitarray,\
+    NoCareBitarray
+from proteusisc.contracts import ARBITRARY
+
+from .common import random_bits
+
+def _parts(count):
+    parts = []
+    for i in range(count):
+        if i%3 == 0:
+            parts.append(random_bits(32, seed=i))
+        elif i%3 == 1:
+            parts.append(ConstantBitarray(bool(i&2), 32))
+        else:
+            parts.append(NoCareBitarray(32))
+    return parts
+
+def _composite(parts):
+    comp = CompositeBitarray(parts[0])
+    for part in parts[1:]:
+        comp = comp + part
+    return comp
+
+class Composite(object):
+    """Build, split and prepare CompositeBitarrays of 32 bit parts."""
+    params = [[16, 256, 4096]]
+    param_names = ['parts']
+
+    def setup(self, parts):
+        self.parts = _parts(parts)
+        self.comp = _composite(_parts(parts))
+
+    def time_concat(self, parts):
+        _composite(self.parts)
+
+    def time_split(self, parts):
+        right = self.comp
+        while right is not None and len(right) > 32:
+            _, right = right.split(32)
+
+    def time_prepare(self, parts):
+        self.comp.prepare(primef=ARBITRARY, reqef=ARBITRARY)
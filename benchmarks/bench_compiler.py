@@ -0,0 +1,13 @@
+from .common import make_chain, queue_dr_reads
+
+class Compile(object):
+    """Compile queues of DR reads without executing them."""
+    params = [[1000, 10000, 100000], [1, 3, 8]]
+    param_names = ['prims', 'devices']
+
+    def setup(self, prims, devices):
+        self.chain, _ = make_chain(devices)
+        queue_dr_reads(self.chain, prims)
+
+    def time_compile(self, prims, devices):
+        self.chain._command_queue._compile()
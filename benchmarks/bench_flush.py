@@ -0,0 +1,27 @@
+from .common import make_chain, queue_dr_reads
+
+class Flush(object):
+    """Compile and run queues of DR reads on the fake controllers.
+
+    The fake controllers are wrapped in LatencyHandles, so besides the
+    real time of a flush, the time it would take on a real controller
+    is tracked.
+    """
+    params = [['digilent', 'xpcu1'], [1, 3, 8], [100, 1000]]
+    param_names = ['controller', 'devices', 'prims']
+
+    def setup(self, controller, devices, prims):
+        self.chain, self.handle = make_chain(devices, controller, tck=True)
+        self.chain.jtag_enable()
+        queue_dr_reads(self.chain, prims)
+
+    def teardown(self, controller, devices, prims):
+        self.chain.jtag_disable()
+
+    def time_flush(self, controller, devices, prims):
+        self.chain.flush()
+
+    def track_simulated_flush(self, controller, devices, prims):
+        self.chain.flush()
+        return self.handle.flush_times[-1]
+    track_simulated_flush.unit = "seconds"
@@ -0,0 +1,31 @@
+from proteusisc.drivers.digilentdriver import interleave_tms_tdi
+from proteusisc.drivers.xilinxPC1driver import _xpcu1utils
+
+from .common import random_bits
+
+class XPCU1Payload(object):
+    """Build the bulk payload of an XPCU1 GPIO transfer."""
+    params = [[1024, 65536, 1048576]]
+    param_names = ['bits']
+
+    def setup(self, bits):
+        self.tms = random_bits(bits, seed=1)
+        self.tdi = random_bits(bits, seed=2)
+        self.tdo = random_bits(bits, seed=3)
+
+    def time_calc_xfer_payload(self, bits):
+        _xpcu1utils.calc_xfer_payload(bits, self.tms.byteiter(),
+                                      self.tdi.byteiter(),
+                                      self.tdo.byteiter())
+
+class DigilentInterleave(object):
+    """Interleave TMS and TDI bits for a Digilent WRITE_TMS_TDI."""
+    params = [[1024, 65536, 1048576]]
+    param_names = ['bits']
+
+    def setup(self, bits):
+        self.tms = random_bits(bits, seed=1)
+        self.tdi = random_bits(bits, seed=2)
+
+    def time_interleave(self, bits):
+        interleave_tms_tdi(self.tms, self.tdi)
@@ -0,0 +1,25 @@
+from proteusisc.promise import TDOPromise, TDOPromiseCollection
+
+from .common import random_bits
+
+class _Chain(object):
+    def flush(self, until=None):
+        pass
+
+class Fulfil(object):
+    """Fulfil a collection of 32 bit promises, each split in two."""
+    params = [[64, 1024, 16384]]
+    param_names = ['promises']
+
+    def setup(self, promises):
+        chain = _Chain()
+        self.collection = TDOPromiseCollection(chain)
+        for i in range(promises):
+            promise = TDOPromise(chain, 0, 32)
+            left, right = promise.split(31)
+            self.collection.add(left, i*32)
+            self.collection.add(right, i*32+31)
+        self.bits = random_bits(promises*32)
+
+    def time_fulfil(self, promises):
+        self.collection._fulfill(self.bits)
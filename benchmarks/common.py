@@ -0,0 +1,52 @@
+import random
+
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.test_utils import FakeDevHandle, FakeXPCU1Handle,\
+    FakeUSBDev, MockPhysicalJTAGDevice, VirtualClock, LatencyHandle
+
+handles = {
+    'digilent': FakeDevHandle,
+    'xpcu1': FakeXPCU1Handle,
+}
+
+def random_bits(count, seed=0):
+    """Get a reproducible bitarray of random bits."""
+    rand = random.Random(seed)
+    bits = bitarray()
+    bits.frombytes(bytes(rand.getrandbits(8)
+                         for _ in range((count+7)//8)))
+    return bits[:count]
+
+def make_chain(devices, controller='digilent', **timing):
+    """Build an initialized chain of mock devices on a fake controller.
+
+    Args:
+        devices: The number of devices in the chain.
+        controller: The name of the fake controller to use (see handles).
+        **timing: Arguments for the LatencyHandle the fake controller is wrapped in.
+
+    Returns:
+        A (JTAGScanChain, LatencyHandle) tuple.
+    """
+    devs = [MockPhysicalJTAGDevice(name="D%s"%i, status=bitarray('11111100'))
+            for i in range(devices)]
+    handle = LatencyHandle(handles[controller](*devs), VirtualClock(),
+                           **timing)
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(handle)))
+    chain.init_chain()
+    handle.watch(chain)
+    return chain, handle
+
+def queue_dr_reads(chain, count):
+    """Queue about count DR reads, spread over every device of chain.
+
+    Returns:
+        The promises of the reads.
+    """
+    promises = []
+    for _ in range(max(1, count//len(chain._devices))):
+        for dev in chain._devices:
+            promises.append(dev.rw_dev_dr(regname="DEVICE_ID", read=True))
+    return promises
@@ -874,13 +874,13 @@ class CompositeBitarray(collections.Sequence):
             if isinstance(elem.value, bitarray):
                 if testBitarrayFalse:
                     if not elem.value.any():
-                        elem.value = ConstantBitarray(False,
+                        elem._value = ConstantBitarray(False,
                                                       len(elem.value))
                     else:
                         raise Exception("bitarray in data contains a 1")
                 if testBitarrayTrue:
                     if elem.value.all():
-                        elem.value = ConstantBitarray(True,
+                        elem._value = ConstantBitarray(True,
                                                       len(elem.value))
                     else:
                         raise Exception("bitarray in data contains a 0")
@@ -971,7 +971,8 @@ class CompositeBitarray(collections.Sequence):
         for b in it:
             tmp |= bool(b)<<offset
             offset -= 1
-        data[-1] = tmp
+        if offset != 7:
+            data[-1] = tmp
         return data
         #tmpba = bitarray(self)
         #return tmpba.tobytes()
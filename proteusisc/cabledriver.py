@@ -32,15 +32,17 @@ class CableDriver(object):
 
     """
 
-    def __init__(self, dev):
+    def __init__(self, dev, *, context=None):
         """
         Initialize general controller driver values with defaults.
 
         Args:
             dev (usb1.USBDevice) - Device entry the driver will control.
+            context (usb1.USBContext) - The context dev was listed from. Required for asynchronous transfers.
         """
 
         self._dev = dev
+        self._usbcontext = context
         self._dev_handle = None
         self._scanchain = None
         self._jtagon = False
@@ -73,6 +75,15 @@ class CableDriver(object):
             self._dev_handle.close()
             self._dev_handle = None
 
+    def _lv1_primitive_usable(self, prim):
+        """Check if a Level1Primitive class can be used in the controller's current mode.
+
+        The compiler only picks from usable primitives. Override if
+        the controller has modes some of its primitives can not run
+        in.
+        """
+        return True
+
     def jtag_enable(self):
         pass #Oerride if necessary
 
@@ -0,0 +1,206 @@
+"""Fit the Level1Primitive cost model to a real controller.
+
+Level1Primitive scores are built from a handful of class constants
+(_COST_PRIM, _COST_READ_MSG, ...) that are educated guesses. The
+real price of a primitive depends on the controller, its firmware,
+the USB bus and the host. Calibration runs a few timed transfers of
+each Level1Primitive of a controller, fits a latency and a per bit
+cost to them, and gives the scan chain primitive classes using the
+measured numbers (in nanoseconds) instead of the guesses.
+
+Every calibration transfer holds TMS high, which parks the TAP in
+Test-Logic-Reset. Nothing is shifted into any device.
+
+Results are stored per controller (driver and serial number) so the
+measurement only has to be done once.
+"""
+import json
+import os
+from time import perf_counter
+
+from .contracts import ONE, NOCARE
+
+base_calib_dir = os.path.join(os.path.expanduser("~"),
+                              '.config', 'proteusisc', 'calibration')
+
+CALIBRATION_SIZES = (8, 64, 512)
+CALIBRATION_REPEAT = 3
+
+_file_version = 1
+
+def _fit_line(points):
+    """Least squares fit of (x, y) points to y = a + b*x.
+
+    Returns:
+        A tuple of the intercept a and slope b.
+    """
+    n = len(points)
+    sx = sum(x for x, _ in points)
+    sy = sum(y for _, y in points)
+    sxx = sum(x*x for x, _ in points)
+    sxy = sum(x*y for x, y in points)
+    denom = n*sxx - sx*sx
+    if not denom:
+        return sy/n, 0
+    b = (n*sxy - sx*sy)/denom
+    return (sy - b*sx)/n, b
+
+def _time_prim(chain, primcls, count, read, clock, repeat):
+    reqef = (ONE, NOCARE, ONE if read else NOCARE)
+    best = None
+    for _ in range(repeat):
+        prim = primcls(count=count, tms=True, tdo=True if read else None,
+                       reqef=reqef, _chain=chain)
+        start = clock()
+        prim.execute(chain._controller)
+        elapsed = clock()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _measure_prim(chain, primcls, clock, sizes, repeat):
+    """Time primcls and fit its costs.
+
+    Returns:
+        A dict of integer nanosecond costs for the primitive, or None
+        if the primitive can not hold TMS high (and can not be
+        measured safely).
+    """
+    tmsef, _, tdoef = primcls.get_effect()
+    if not tmsef.satisfies(ONE):
+        return None
+    #Prims that always read can not be timed without reading.
+    alwaysreads = tdoef.single and tdoef.value
+    canread = tdoef.satisfies(ONE)
+
+    maxbits = primcls._max_chunk_bits((ONE, NOCARE, ONE))
+    counts = sorted({min(size, maxbits) for size in sizes})
+    a0, b0 = _fit_line([(count, _time_prim(chain, primcls, count, False,
+                                           clock, repeat))
+                        for count in counts])
+    costs = {'prim': a0, 'clock_bit': b0, 'read_msg': 0, 'read_bit': 0}
+    if canread and not alwaysreads:
+        a1, b1 = _fit_line([(count, _time_prim(chain, primcls, count,
+                                               True, clock, repeat))
+                            for count in counts])
+        costs['read_msg'] = a1-a0
+        costs['read_bit'] = b1-b0
+    return {k: max(int(round(v*1e9)), 0) for k, v in costs.items()}
+
+def measure_lv1_costs(chain, *, clock=None, sizes=CALIBRATION_SIZES,
+                      repeat=CALIBRATION_REPEAT):
+    """Time every Level1Primitive of the chain's controller.
+
+    JTAG must be enabled on the controller. The TAP is left in
+    Test-Logic-Reset.
+
+    Args:
+        chain: The JTAGScanChain whose controller is measured.
+        clock: A callable returning the current time in seconds. Defaults to time.perf_counter.
+        sizes: The bit counts each primitive is timed with.
+        repeat: How many times each transfer is timed (the fastest is used).
+
+    Returns:
+        A dict mapping primitive class names to their cost dicts (see
+        apply_lv1_costs), or None for primitives that could not be
+        measured or that the controller can not use in its current
+        mode.
+    """
+    clock = clock or perf_counter
+    usable = chain._controller._lv1_primitive_usable
+    return {prim.__name__: _measure_prim(chain, prim, clock,
+                                         sizes, repeat)
+                           if usable(prim) else None
+            for prim in chain._lv1_base_primitives}
+
+def _calibrated_prim(primcls, costs):
+    return type(primcls.__name__, (primcls,), {
+        '__module__': primcls.__module__,
+        '__doc__': primcls.__doc__,
+        '_calibrated_from': primcls,
+        '_COST_PRIM': costs['prim'],
+        '_COST_READ_MSG': costs['read_msg'],
+        '_COST_READ_BIT_GROUP': costs['read_bit'],
+        '_BIT_READ_GROUP_SIZE': 1,
+        #Clocking the payload out is measured in _COST_CLOCK_BIT.
+        '_COST_PAYLOAD_BIT_GROUP': 0,
+        '_BIT_PAYLOAD_GROUP_SIZE': 1,
+        '_COST_CLOCK_BIT': costs['clock_bit'],
+    })
+
+def _scaled_prim(primcls, scale):
+    return type(primcls.__name__, (primcls,), {
+        '__module__': primcls.__module__,
+        '__doc__': primcls.__doc__,
+        '_calibrated_from': primcls,
+        '_COST_PRIM': int(primcls._COST_PRIM*scale),
+        '_COST_READ_MSG': int(primcls._COST_READ_MSG*scale),
+        '_COST_READ_BIT_GROUP': int(primcls._COST_READ_BIT_GROUP*scale),
+        '_COST_PAYLOAD_BIT_GROUP':
+            int(primcls._COST_PAYLOAD_BIT_GROUP*scale),
+        '_COST_CLOCK_BIT': int(primcls._COST_CLOCK_BIT*scale),
+    })
+
+def apply_lv1_costs(chain, costs):
+    """Make the chain use measured costs for its Level1Primitives.
+
+    Each Level1Primitive class is replaced (on this chain only) with
+    a subclass whose cost constants hold the measured values.
+    Primitives that could not be measured keep their default costs,
+    scaled to nanoseconds by how far the measured primitives were off.
+
+    Args:
+        chain: The JTAGScanChain to update.
+        costs: A dict from primitive class names to dicts with integer 'prim', 'read_msg', 'read_bit', and 'clock_bit' costs (or None).
+    """
+    ratios = sorted(costs[prim.__name__]['prim']/prim._COST_PRIM
+                    for prim in chain._lv1_base_primitives
+                    if costs.get(prim.__name__) and prim._COST_PRIM)
+    scale = ratios[len(ratios)//2] if ratios else 1
+
+    newprims = []
+    for prim in chain._lv1_base_primitives:
+        primcosts = costs.get(prim.__name__)
+        newprim = _calibrated_prim(prim, primcosts) if primcosts else \
+                  _scaled_prim(prim, scale)
+        newprims.append(newprim)
+        chain._replace_chain_primitive(newprim)
+    chain._lv1_chain_primitives = newprims
+    chain._fitted_lv1_prim_cache.clear()
+
+def _calibration_path(controller):
+    serial = getattr(controller, 'serialNumber', None)
+    if not serial:
+        return None
+    return os.path.join(base_calib_dir, "%s_%s.json"%
+                        (type(controller).__name__, serial))
+
+def load_lv1_costs(controller):
+    """Get the stored costs for a controller, or None if there are none."""
+    path = _calibration_path(controller)
+    if not path:
+        return None
+    try:
+        with open(path, 'r') as f:
+            dat = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if dat.get('_file_version', -1) != _file_version:
+        return None
+    costs = dat.get('primitives', {})
+    if any(prim.__name__ not in costs for prim in controller._primitives
+           if getattr(prim, '_layer', None) == 1):
+        return None
+    return costs
+
+def save_lv1_costs(controller, costs):
+    """Store the costs measured for a controller."""
+    path = _calibration_path(controller)
+    if not path:
+        return
+    os.makedirs(base_calib_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'_file_version': _file_version,
+                   'driver': type(controller).__name__,
+                   'serial': controller.serialNumber,
+                   'primitives': costs}, f, indent=4, sort_keys=True)
@@ -0,0 +1,114 @@
+"""Remember the devices found on a controller's scan chain.
+
+Fixtures are usually connected to the same chain every time, so the
+IDCODEs, IR lengths and descriptors found by JTAGScanChain.init_chain
+are stored per controller (driver and serial number). On the next
+init_chain, one scan reading back every IDCODE is compared to the
+stored chain. If it matches, the stored devices are used without
+discovering the chain or resolving any descriptor. If not, the chain
+is discovered as usual and the stored topology replaced.
+"""
+import hashlib
+import json
+import os
+import struct
+
+from .bittypes import bitarray
+from .jtagDeviceDescription import JTAGDeviceDescription
+
+base_topology_dir = os.path.join(os.path.expanduser("~"),
+                                 '.config', 'proteusisc', 'topology')
+
+_file_version = 1
+
+def _topology_path(controller):
+    serial = getattr(controller, 'serialNumber', None)
+    if not serial:
+        return None
+    return os.path.join(base_topology_dir, "%s_%s.json"%
+                        (type(controller).__name__, serial))
+
+def load_topology(controller):
+    """Get the stored chain of a controller.
+
+    Returns:
+        A list of (IDCODE, JTAGDeviceDescription or None) tuples in
+        chain order, or None if nothing usable is stored.
+    """
+    path = _topology_path(controller)
+    if not path:
+        return None
+    try:
+        with open(path, 'r') as f:
+            dat = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if dat.get('_file_version', -1) != _file_version:
+        return None
+
+    devices = []
+    for entry in dat.get('devices', []):
+        descr = None
+        if entry.get('descriptor'):
+            descr = JTAGDeviceDescription._load(entry['descriptor'])
+            if descr is None or descr._ir_length != entry['ir_length']:
+                return None
+        devices.append((entry['idcode'], descr))
+    return devices or None
+
+def save_topology(controller, devices):
+    """Store the chain of a controller.
+
+    Args:
+        controller: The CableDriver of the chain.
+        devices: The JTAGDevices of the chain in chain order.
+    """
+    path = _topology_path(controller)
+    if not path:
+        return
+    entries = []
+    for dev in devices:
+        descr = dev._desc
+        entries.append({
+            'idcode': dev._id,
+            'ir_length': descr._ir_length if descr else None,
+            'descriptor': descr._dump() if descr else None,
+        })
+    os.makedirs(base_topology_dir, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'_file_version': _file_version,
+                   'driver': type(controller).__name__,
+                   'serial': controller.serialNumber,
+                   'devices': entries}, f, indent=4, sort_keys=True)
+
+def expected_idcode_scan(idcodes):
+    """Build the bits an IDCODE scan of a chain should read.
+
+    The scan shifts 1s in after a TAP reset, and reads one 32 bit
+    IDCODE per device followed by 32 of the shifted in 1s.
+
+    Args:
+        idcodes: The integer IDCODEs of the chain in chain order.
+
+    Returns:
+        A bitarray in the order it would be read (right most bit first).
+    """
+    bits = bitarray('1'*32)
+    for idcode in idcodes:
+        bits += bitarray(bin(idcode)[2:].zfill(32))
+    return bits
+
+def topology_hash(devices):
+    """Identify a chain by the devices on it.
+
+    Args:
+        devices: The JTAGDevices of the chain in chain order.
+
+    Returns:
+        A 32 byte sha256 digest of every device's IDCODE and IR length.
+    """
+    h = hashlib.sha256()
+    for dev in devices:
+        h.update(struct.pack('<IH', dev._id or 0,
+                             dev._desc._ir_length if dev._desc else 0))
+    return h.digest()
@@ -4,7 +4,10 @@ from time import time
 from .jtagStateMachine import JTAGStateMachine
 from .frame import FrameSequence
 from .errors import ProteusISCError
-from .primitive import DeviceTarget, ExpandRequiresTAP, Executable
+from .primitive import DeviceTarget, ExpandRequiresTAP, Executable,\
+    Level1Primitive
+from .primitive_defaults import RWDR, RWIR, RWReg, RWDevIR, TransitionTAP,\
+    instruction_named
 
 
 class CommandQueue(collections.MutableSequence):
@@ -33,12 +36,20 @@ class CommandQueue(collections.MutableSequence):
         self.queue = []
         self._fsm = JTAGStateMachine()
         self._chain = chain
+        self.flush_listeners = []
+        #The instruction each device is known to hold after the last
+        #flush, by device index.
+        self._loaded_instructions = {}
+        #While compiling, the instruction each device holds at the
+        #point being expanded (None if unknown).
+        self._ir_shadow = None
 
     def reset(self):
         #TODO Double check if this is best way
         if self._fsm:
             self._fsm.reset()
         self.queue = []
+        self._loaded_instructions = {}
 
     def snapshot(self):
         return [p.snapshot() for p in self.queue]#pragma: no cover
@@ -175,6 +186,13 @@ class CommandQueue(collections.MutableSequence):
 
         ###################### POST INGESTION ######################
         ################ Flatten out LV3 Primitives ################
+        shadow = self._ir_shadow
+        if not any((f._layer == 3 for f in ingested_chain)):
+            #Nothing to expand, but the instructions loaded still
+            #have to be followed.
+            sm = JTAGStateMachine(self._chain._sm.state)
+            for f in ingested_chain:
+                self._track_instructions(f, sm)
         while(any((f._layer == 3 for f in ingested_chain))):
             ################# COMBINE COMPATIBLE PRIMS #################
             ingested_chain = _merge_prims(ingested_chain)
@@ -185,11 +203,13 @@ class CommandQueue(collections.MutableSequence):
 
             ################ TRANSLATION TO LOWER LAYER ################
             sm = JTAGStateMachine(self._chain._sm.state)
+            self._ir_shadow = list(shadow)
             expanded_prims = FrameSequence(self._chain)
             for f in ingested_chain:
                 if f._layer == 3:
                     expanded_prims += f.expand_macro(sm)
                 else:
+                    self._track_instructions(f, sm)
                     expanded_prims.append(f)
             expanded_prims.finalize()
             ingested_chain = expanded_prims
@@ -249,6 +269,9 @@ class CommandQueue(collections.MutableSequence):
         self._fsm = None
         if len(self) == 0:
             return "No commands in Queue."
+        loaded = {} if dryrun else self._loaded_instructions
+        self._ir_shadow = [loaded.get(i) for i in
+                           range(len(self._chain._devices))]
 
         ###################### INITIAL PRIMS! ######################
 
@@ -267,6 +290,9 @@ class CommandQueue(collections.MutableSequence):
                 debug=debug, stages=stages, stagenames=stagenames
             )
         else:
+            sm = JTAGStateMachine(self._chain._sm.state)
+            for prim in self:
+                self._track_instructions([prim], sm)
             flattened_prims = self
 
         ######### Flatten out remaining macros Primitives #########
@@ -311,12 +337,21 @@ class CommandQueue(collections.MutableSequence):
             stages.append([[p.snapshot() for p in flattened_prims]])
             stagenames.append("Final LV2 merge")
 
+        flattened_prims = _collapse_transitions(flattened_prims,
+                                                self._chain._sm.state)
+
+        if debug:#pragma: no cover
+            stages.append([[p.snapshot() for p in flattened_prims]])
+            stagenames.append("Collapsing TAP transitions")
+
         ################### EXPAND TO LV1 PRIMS ####################
         sm = JTAGStateMachine(self._chain._sm.state)
         expanded_prims = []
         for p in flattened_prims:
             tmp = p.expand(self._chain, sm)
-            if tmp:
+            #An empty expansion (like a transition to the current
+            #state) needs no primitives at all.
+            if tmp is not None:
                 expanded_prims += tmp
             else:
                 expanded_prims.append(p)
@@ -351,43 +386,281 @@ class CommandQueue(collections.MutableSequence):
 
         if not dryrun:
             self.queue = flattened_prims
+        return flattened_prims
+
 
+    def flush(self, until=None, *, count=None):
+        """Force the queue of Primitives to compile, execute on the Controller, and fulfill promises with the data returned.
 
-    def flush(self):
-        """Force the queue of Primitives to compile, execute on the Controller, and fulfill promises with the data returned."""
+        Every object in flush_listeners has its flush_started and
+        flush_finished methods called with the queue around a flush
+        of a non empty queue. flush_finished is called even if the
+        flush raises. If it raises, the Primitives that were being run
+        are dropped, and any left queued by until or count stay
+        queued.
+
+        Args:
+            until: A TDOPromise. If given, only the Primitives up to the one the promise reads from are run, plus any after it needed to finish a register scan it leaves open or likely aligned with it (see _cut_after). The rest stay queued. The whole queue is run if no queued Primitive owns the promise.
+            count: If given, only the first count Primitives are run. It should be a safe cut point (see last_cut_point).
+        """
         self.stages = []
         self.stagenames = []
 
+        if until is not None and self.queue:
+            count = self._cut_after(until)
+        rest = []
+        if count is not None:
+            self.queue, rest = self.queue[:count], self.queue[count:]
         if not self.queue:
+            self.queue = rest
             return
 
-        if self.print_statistics:#pragma: no cover
-            print("LEN OF QUENE", len(self))
-            t = time()
+        for listener in self.flush_listeners:
+            listener.flush_started(self)
 
-        if self._chain._collect_compiler_artifacts:
-            self._compile(debug=True, stages=self.stages,
-                          stagenames=self.stagenames)
+        #Listeners are told the flush finished even if it failed, so
+        #they do not keep the state of a flush that never ends.
+        try:
+            if self.print_statistics:#pragma: no cover
+                print("LEN OF QUENE", len(self))
+                t = time()
+
+            if self._chain._collect_compiler_artifacts:
+                self._compile(debug=True, stages=self.stages,
+                              stagenames=self.stagenames)
+            else:
+                self._compile()
+
+            if self.debug:
+                print("ABOUT TO EXEC", self.queue)#pragma: no cover
+
+            if self.print_statistics:#pragma: no cover
+                print("COMPILE TIME", time()-t)
+                print("TOTAL BITS OF ALL PRIMS", sum(
+                    (p.count for p in self.queue if hasattr(p, 'count'))))
+                t = time()
+
+            shadow, self._ir_shadow = self._ir_shadow, None
+            self._loaded_instructions = {}
+            self._chain._controller._execute_primitives(self.queue)
+            self._loaded_instructions = {i: name for i, name in
+                                         enumerate(shadow) if name}
+
+            if self.print_statistics:
+                print("EXECUTE TIME", time()-t)#pragma: no cover
+
+            self.queue = rest
+            self._chain._sm.state = self._fsm.state
+        except BaseException:
+            self.queue = rest
+            raise
+        finally:
+            for listener in self.flush_listeners:
+                listener.flush_finished(self)
+
+    def _track_instructions(self, prims, sm):
+        """Follow the TAP state and the instructions loaded through Primitives that are not expanded yet.
+
+        The instructions are kept in _ir_shadow, so run_instruction
+        can skip loading an instruction every device already holds.
+
+        Args:
+            prims: A filled Frame, or a list of one device agnostic Primitive.
+            sm: A JTAGStateMachine in the TAP state before prims.
+        """
+        prim = prims[0]
+        before = sm.state
+        if not isinstance(prim, DeviceTarget):
+            prim.apply_tap_effect(sm)
+        shadow = self._ir_shadow
+        if isinstance(prim, RWDevIR):
+            shadow[:] = [instruction_named(p.dev, p.data) for p in prims]
+        elif before.startswith('_PRE') or sm.state == 'TLR' or \
+             isinstance(prim, (RWIR, RWReg, Level1Primitive)):
+            shadow[:] = [None]*len(shadow)
+
+    def _cut_after(self, promise):
+        """Find how many Primitives from the front of the queue must run to fulfill promise.
+
+        The cut is made right after the Primitive that owns promise,
+        and not while a Primitive leaves the TAP in the middle of a
+        register scan (like an rw_dr without its last bit). If the
+        owner is a device specific Primitive, the device specific
+        Primitives after it that would be aligned into its frame or
+        an earlier one (see _compile_device_specific_prims) run with
+        it; the rest of their run stays queued.
+        """
+        while promise._parent is not None:
+            promise = promise._parent
+        for i, p in enumerate(self.queue):
+            promises = getattr(p, '_promise', None)
+            if not isinstance(promises, list):
+                promises = [promises]
+            if any(other is promise for other in promises):
+                break
         else:
-            self._compile()
+            return len(self.queue)
+
+        cut = self._frame_end(i)
+        while cut < len(self.queue) and \
+              not self._can_cut(cut, keep_aligned=False):
+            cut += 1
+        return cut
+
+    def _frame_end(self, index):
+        """Find the end of the frame the queued Primitive at index is likely aligned into.
+
+        Device specific Primitives of one layer staged together are
+        aligned by device. The nth Primitive of each device usually
+        ends up in the same frame, so the run is extended over the
+        Primitives of devices that have not yet had as many
+        Primitives in the run as the device of the one at index.
+
+        Returns:
+            The number of Primitives from the front of the queue up to the end of the frame.
+        """
+        queue = self.queue
+        prim = queue[index]
+        if not isinstance(prim, DeviceTarget):
+            return index+1
+
+        def in_run(p):
+            return isinstance(p, DeviceTarget) and \
+                type(p)._layer == type(prim)._layer
+
+        start = index
+        while start and in_run(queue[start-1]):
+            start -= 1
+        counts = {}
+        for p in queue[start:index+1]:
+            counts[p._device_index] = counts.get(p._device_index, 0)+1
+        frame = counts[prim._device_index]
+
+        end = index+1
+        while end < len(queue) and in_run(queue[end]):
+            k = queue[end]._device_index
+            counts[k] = counts.get(k, 0)+1
+            if counts[k] > frame:
+                break
+            end += 1
+        return end
 
-        if self.debug:
-            print("ABOUT TO EXEC", self.queue)#pragma: no cover
+    def last_cut_point(self, start=1, *, keep_aligned=True):
+        """Find the most Primitives from the front of the queue that can run without the rest, whatever is staged next.
 
-        if self.print_statistics:#pragma: no cover
-            print("COMPILE TIME", time()-t)
-            print("TOTAL BITS OF ALL PRIMS", sum(
-                (p.count for p in self.queue if hasattr(p, 'count'))))
-            t = time()
+        Unlike a cut made to fulfill a promise, the whole queue is only
+        a cut point if its last Primitive can not be joined by
+        Primitives staged later (see _can_cut).
 
-        self._chain._controller._execute_primitives(self.queue)
+        Args:
+            start: The smallest count to consider. Counts below it are assumed to have been checked already.
+            keep_aligned: A boolean for if runs of device specific Primitives that would be aligned with each other must not be cut. Cutting them is safe, but the parts are not aligned with each other.
 
-        if self.print_statistics:
-            print("EXECUTE TIME", time()-t)#pragma: no cover
+        Returns:
+            The number of Primitives to run, or 0 if there is no safe cut point.
+        """
+        end = len(self.queue)
+        if end and ((keep_aligned and
+                     isinstance(self.queue[-1], DeviceTarget)) or
+                    _leaves_scan_open(self.queue[-1])):
+            end -= 1
+        for cut in range(end, max(start, 1)-1, -1):
+            if self._can_cut(cut, keep_aligned=keep_aligned):
+                return cut
+        return 0
+
+    def _can_cut(self, cut, *, keep_aligned=True):
+        """Check if the first cut Primitives can be compiled without the rest of the queue.
+
+        A cut is never made while a Primitive leaves the TAP in the
+        middle of a register scan. If keep_aligned is True, it is not
+        made between device specific Primitives of one layer either,
+        since they are aligned with each other when compiled.
+        """
+        prev = self.queue[cut-1]
+        if _leaves_scan_open(prev):
+            return False
+        if cut == len(self.queue) or not keep_aligned:
+            return True
+        p = self.queue[cut]
+        return not (isinstance(prev, DeviceTarget) and
+                    isinstance(p, DeviceTarget) and
+                    type(prev)._layer == type(p)._layer)
+
+    def export(self, writer):
+        """Compile the queue without executing it, and pass the executable primitives to writer.
+
+        The queue is emptied and the chain's TAP state advanced as if
+        it had been flushed, but no promises are fulfilled.
 
+        Args:
+            writer: An object with a write_prims method taking a list of executable Primitives (like an svfWriter.SVFWriter).
+        """
+        if not self.queue:
+            return
+        writer.write_prims(self._compile(dryrun=True))
         self.queue = []
+        #Nothing ran, so what the devices hold is not known.
+        self._ir_shadow = None
+        self._loaded_instructions = {}
         self._chain._sm.state = self._fsm.state
 
+_scan_states = {'CAPTUREDR', 'SHIFTDR', 'EXIT1DR', 'EXIT2DR',
+                'CAPTUREIR', 'SHIFTIR', 'EXIT1IR', 'EXIT2IR'}
+
+def _leaves_scan_open(prim):
+    """Check if a staged Primitive can leave the TAP inside a register scan."""
+    if isinstance(prim, RWReg):
+        return True
+    if isinstance(prim, (RWDR, RWIR)):
+        return not prim.lastbit
+    return isinstance(prim, TransitionTAP) and prim.state in _scan_states
+
+def _collapse_transitions(prims, state):
+    """Replace runs of TransitionTAPs with one transition to the run's last state, where the TAP takes the same path either way.
+
+    Expanding RWIR and RWDR leaves transitions like UPDATEIR followed
+    by SHIFTDR. Going straight to SHIFTDR passes through UPDATEIR
+    anyway, so one transition (and one set of TMS bits) does the
+    same. Runs whose direct path would skip a state (like TLR) are
+    kept.
+
+    Args:
+        prims: A list of expanded device agnostic Level 2 Primitives.
+        state: The TAP state before prims.
+
+    Returns:
+        A list of Primitives.
+    """
+    sm = JTAGStateMachine(state)
+    res = []
+    start = None
+    for p in prims:
+        prev = res[-1] if res else None
+        if isinstance(p, TransitionTAP) and \
+           isinstance(prev, TransitionTAP) and not prev.loop and \
+           start is not None and not start.startswith('_PRE'):
+            first = JTAGStateMachine(start)
+            path = first.calc_transition_to_state(prev.state)
+            first.state = prev.state
+            path = first.calc_transition_to_state(p.state) + path
+            if path == JTAGStateMachine(start)\
+               .calc_transition_to_state(p.state):
+                res[-1] = TransitionTAP(p.state, loop=p.loop,
+                                        _chain=p._chain)
+                p.apply_tap_effect(sm)
+                continue
+
+        start = sm.state
+        if isinstance(p, ExpandRequiresTAP):
+            p.apply_tap_effect(sm)
+        elif isinstance(p, Level1Primitive):
+            #Unknown effect on the TAP. Stop collapsing until the
+            #state is known again.
+            sm = JTAGStateMachine()
+        res.append(p)
+    return res
+
 def _merge_prims(prims, *, debug=False, stagenames=None, stages=None):
     """Helper method to greedily combine Frames (of Primitives) or Primitives based on the rules defined in the Primitive's class.
 
@@ -407,6 +680,8 @@ def _merge_prims(prims, *, debug=False, stagenames=None, stages=None):
         merged_prims = FrameSequence(prims._chain)
     else:
         merged_prims = []
+    if not prims:
+        return merged_prims
     working_prim = prims[0]
     i = 1
     logging_tmp = []
@@ -0,0 +1,597 @@
+"""Save compiled primitive streams, and run them later without compiling.
+
+Compiling a large program can take much longer than running it. A
+CompiledProgram holds the executable Level 1 primitives of a compiled
+queue in a compact binary form (a "JTAG object file"). It can be saved,
+loaded again (memory mapped, so only what runs is read), and run
+straight through the controller's driver functions, skipping the
+compiler entirely.
+
+    >>> chain.rw_ir(data=bitarray('00000001'))
+    >>> chain.rw_dr(bitcount=32, read=True)
+    >>> chain.compile_program().save("idcode.jobj")
+    ...
+    >>> program = CompiledProgram.load("idcode.jobj")
+    >>> idcode, = program.run(chain)
+
+A program only runs on a chain with the same devices (see
+chainTopology.topology_hash) and a controller with the same Level 1
+primitives it was compiled for.
+
+File layout (little endian): a header (8 byte magic, version byte,
+32 byte topology hash, start and end TAP state indexes, class count,
+op count, read count and extent count), the Level 1 primitive class
+names (a length byte and the name each), the op table, the read table,
+the extent table, and finally the payload the op table points into.
+
+Each op is a class index (0xFFFF for a host sleep), how each of TMS,
+TDI and TDO is encoded, the bit count, and a payload offset for each
+of TMS, TDI and TDO. A signal is encoded as a single bool, a constant
+run, the raw bytes of the bits, or run length encoded. Each read is
+the index of its first extent and its extent count, and each extent
+is the op it is read from and the start and length of its bits in the
+data that op returns.
+"""
+import mmap
+import random
+import struct
+from time import monotonic, sleep
+
+from .bittypes import bitarray, ConstantBitarray
+from .chainTopology import topology_hash
+from .errors import CompiledProgramError, PollTimeoutError
+from .jtagStateMachine import JTAGStateMachine
+from .primitive import Level1Primitive
+from .primitive_defaults import HostSleep
+
+_MAGIC = b'PISCJOBJ'
+_file_version = 1
+_HEADER = struct.Struct('<8sB32sBBHIII')
+_OP = struct.Struct('<HBBBQQQQ')
+_READ = struct.Struct('<II')
+_EXTENT = struct.Struct('<IQQ')
+_RUN = struct.Struct('<Q')
+_SLEEP = struct.Struct('<d')
+
+_HOST_SLEEP = 0xFFFF
+SCALAR, CONSTANT, RAW, RLE = range(4)
+
+def _encode(value, count, payload):
+    """Add a prepared primitive argument to payload.
+
+    Returns:
+        An (encoding, payload offset) tuple.
+    """
+    if isinstance(value, (bool, int)):
+        return SCALAR|(bool(value)<<4), 0
+    if isinstance(value, ConstantBitarray):
+        return CONSTANT|(value._val<<4), 0
+    offset = len(payload)
+    raw = value.tobytes()
+    bits = bitarray()
+    bits.frombytes(bytes(raw))
+    del bits[count:]
+    changes = (bits[1:]^bits[:-1]).search(bitarray('1')) if count > 1 \
+              else []
+    if 8*(len(changes)+2) >= len(raw):
+        payload += raw
+        return RAW, offset
+    payload += _RUN.pack(len(changes)+1)
+    start = 0
+    for change in changes:
+        payload += _RUN.pack(change+1-start)
+        start = change+1
+    payload += _RUN.pack(count-start)
+    return RLE|(bits[0]<<4), offset
+
+def _as_bitarray(value, count):
+    """Turn a decoded signal into a bitarray that can be changed."""
+    if isinstance(value, bitarray):
+        return value
+    return _filled_bitarray(
+        value if isinstance(value, bool) else value._val, count)
+
+def _filled_bitarray(value, count):
+    bits = bitarray(count)
+    bits.setall(value)
+    return bits
+
+def _patch(tdi, count, patches, data):
+    """Overwrite TDI bits of a decoded op with data (see CompiledProgram.run)."""
+    for start, name, datastart, length in patches:
+        bits = data[name][datastart:datastart+length]
+        if start is None:
+            if bits.any() and not bits.all():
+                raise CompiledProgramError(
+                    "Bits %s to %s of %s are sent as one constant TDI "
+                    "value, and must all be the same"%
+                    (datastart, datastart+length-1, name))
+            value = bits[0]
+            tdi = value if isinstance(tdi, bool) else \
+                  ConstantBitarray(value, count)
+            continue
+        if not isinstance(tdi, bitarray):
+            tdi = _as_bitarray(tdi, count)
+        tdi[start:start+length] = bits
+    return tdi
+
+def _decode(buf, base, encoding, offset, count):
+    kind, value = encoding&0xF, bool(encoding>>4)
+    if kind == SCALAR:
+        return value
+    if kind == CONSTANT:
+        return ConstantBitarray(value, count)
+    offset += base
+    if kind == RAW:
+        bits = bitarray()
+        bits.frombytes(bytes(buf[offset:offset+(count+7)//8]))
+        del bits[count:]
+        return bits
+    runcount, = _RUN.unpack_from(buf, offset)
+    bits = bitarray()
+    for i in range(runcount):
+        length, = _RUN.unpack_from(buf, offset+_RUN.size*(i+1))
+        run = bitarray(length)
+        run.setall(value)
+        bits += run
+        value = not value
+    return bits
+
+class _ProgramBuilder(object):
+    """Collects the compiled primitives of a queue (see CommandQueue.export)."""
+    def __init__(self):
+        self.classes = []
+        self.ops = []
+        self.payload = bytearray()
+        self.leaves = {}
+
+    def write_prims(self, prims):
+        for prim in prims:
+            if isinstance(prim, HostSleep):
+                self.ops.append(_OP.pack(_HOST_SLEEP, 0, 0, 0, 0,
+                                         len(self.payload), 0, 0))
+                self.payload += _SLEEP.pack(prim.delay/1000)
+                continue
+            if not isinstance(prim, Level1Primitive):
+                raise CompiledProgramError(
+                    "%s can not be stored in a program"%prim)
+            cls = type(prim)
+            if cls not in self.classes:
+                self.classes.append(cls)
+            prim.prepare_args()
+            fields = [_encode(value, prim.count, self.payload)
+                      for value in (prim.tms, prim.tdi, prim.tdo)]
+            self._add_leaves(prim, len(self.ops))
+            self.ops.append(_OP.pack(
+                self.classes.index(cls),
+                *[enc for enc, _ in fields], prim.count,
+                *[offset for _, offset in fields]))
+
+    def _add_leaves(self, prim, index):
+        promise = prim._promise
+        if promise is None:
+            return
+        leaves = getattr(promise, '_promises', [promise])
+        for leaf in leaves:
+            start = leaf._bitstartselective if prim._TDO.isarbitrary \
+                    else leaf._bitstart
+            self.leaves[id(leaf)] = (leaf, index, start, leaf._bitlength)
+
+    def _extents(self, promise, extents):
+        if not promise._components:
+            if id(promise) not in self.leaves:
+                raise CompiledProgramError(
+                    "A read is not fulfilled by the program")
+            _, index, start, length = self.leaves[id(promise)]
+            extents.append(_EXTENT.pack(index, start, length))
+            return
+        for sub, _ in promise._components:
+            self._extents(sub, extents)
+
+    def build(self, topology, start, end):
+        roots = {}
+        for leaf, _, _, _ in self.leaves.values():
+            while leaf._parent is not None:
+                leaf = leaf._parent
+            roots[id(leaf)] = leaf
+        self.roots = sorted(roots.values(), key=lambda p: p.sn)
+        reads, extents = [], []
+        for root in self.roots:
+            first = len(extents)
+            self._extents(root, extents)
+            reads.append(_READ.pack(first, len(extents)-first))
+
+        names = b''.join(bytes([len(name)])+name for name in
+                         (cls.__name__.encode() for cls in self.classes))
+        states = JTAGStateMachine.state_names
+        header = _HEADER.pack(_MAGIC, _file_version, topology,
+                              states.index(start), states.index(end),
+                              len(self.classes), len(self.ops),
+                              len(reads), len(extents))
+        return b''.join([header, names]+self.ops+reads+extents+
+                        [bytes(self.payload)])
+
+class CompiledProgram(object):
+    """A compiled primitive stream that can be saved, loaded and run.
+
+    Create one from a chain's staged primitives with
+    JTAGScanChain.compile_program, or load a saved one with load.
+
+    Attributes:
+        topology: The topology hash of the chain the program was compiled for.
+        start_state: The TAP state the program starts in.
+        end_state: The TAP state the program leaves the chain in.
+        op_count: The number of primitives (and host sleeps) in the program.
+        read_count: The number of reads the program returns.
+    """
+    def __init__(self, buf):
+        """Create a CompiledProgram from its binary form.
+
+        Args:
+            buf: A bytes like object (or mmap) holding a saved program.
+        """
+        if len(buf) < _HEADER.size:
+            raise CompiledProgramError("Not a compiled program")
+        magic, version, self.topology, start, end, classcount, \
+            self.op_count, self.read_count, extentcount = \
+                _HEADER.unpack_from(buf)
+        if magic != _MAGIC or version != _file_version:
+            raise CompiledProgramError(
+                "Not a version %s compiled program"%_file_version)
+        states = JTAGStateMachine.state_names
+        self.start_state, self.end_state = states[start], states[end]
+
+        self._buf = buf
+        offset = _HEADER.size
+        self._class_names = []
+        for _ in range(classcount):
+            length = buf[offset]
+            self._class_names.append(
+                bytes(buf[offset+1:offset+1+length]).decode())
+            offset += 1+length
+        self._ops = offset
+        self._reads = self._ops+self.op_count*_OP.size
+        self._extents = self._reads+self.read_count*_READ.size
+        self._payload = self._extents+extentcount*_EXTENT.size
+
+    @classmethod
+    def compile(cls, chain):
+        """Compile the primitives staged on chain into a program.
+
+        The chain's queue is emptied and its TAP state advanced as if
+        it had been flushed, but nothing is executed.
+        """
+        return cls._compile(chain)[0]
+
+    @classmethod
+    def _compile(cls, chain):
+        """Like compile, but also return the root promise of each read, in read order."""
+        start = chain._sm.state
+        builder = _ProgramBuilder()
+        chain._command_queue.export(builder)
+        program = cls(builder.build(topology_hash(chain._devices),
+                                    start, chain._sm.state))
+        return program, builder.roots
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved program, memory mapping the file."""
+        with open(path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                #Empty files can not be mapped.
+                buf = f.read()
+        return cls(buf)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self._buf)
+
+    def tobytes(self):
+        return bytes(self._buf)
+
+    def _iter_ops(self):
+        """Decode the ops of the program one at a time.
+
+        Yields:
+            (class index, count, tms, tdi, tdo) tuples. Host sleeps
+            are (_HOST_SLEEP, seconds, None, None, None).
+        """
+        buf, base = self._buf, self._payload
+        for offset in range(self._ops, self._reads, _OP.size):
+            clsindex, tmsenc, tdienc, tdoenc, count, tmsoff, tdioff, \
+                tdooff = _OP.unpack_from(buf, offset)
+            if clsindex == _HOST_SLEEP:
+                yield (clsindex, _SLEEP.unpack_from(buf, base+tmsoff)[0],
+                       None, None, None)
+                continue
+            yield (clsindex, count,
+                   _decode(buf, base, tmsenc, tmsoff, count),
+                   _decode(buf, base, tdienc, tdioff, count),
+                   _decode(buf, base, tdoenc, tdooff, count))
+
+    def run(self, chain, *, patches=None, data=None):
+        """Run the program on chain's controller.
+
+        Anything already staged on the chain is flushed first. If the
+        chain is not in the program's start state (and the start state
+        is known), it is moved there.
+
+        Args:
+            chain: The JTAGScanChain to run on.
+            patches: A dict of op index to a list of (TDI start, data name, data start, length) tuples, for overwriting TDI bits with bits from data before the op runs (see PreparedProgram). A TDI start of None sets a constant TDI signal to the value of the data bits.
+            data: A dict of names to bitarrays used by patches.
+
+        Returns:
+            A list of bitarrays, one for each read in the program, in
+            the order the reads were staged.
+        """
+        funcs = self._bind(chain)
+        return self._execute(chain, funcs, self._iter_ops(), patches, data)
+
+    def poll(self, chain, read, *, value, mask=None, timeout=None,
+             interval=0):
+        """Run the program over and over until one of its reads matches.
+
+        The program is bound to the controller and decoded once, so
+        every try only costs the USB transfers (and a host sleep of
+        interval). It must end in the state it starts in (see
+        JTAGScanChain.poll).
+
+        Args:
+            chain: The JTAGScanChain to run on.
+            read: The index of the read to check.
+            value: A bitarray the read must equal, after masking.
+            mask: A bitarray of the bits to compare. All bits if None.
+            timeout: Seconds to try for before raising PollTimeoutError. Forever if None.
+            interval: Seconds to wait between tries.
+
+        Returns:
+            A (read value, number of tries) tuple.
+        """
+        if self.start_state != self.end_state:
+            raise CompiledProgramError(
+                "A polled program must end in the state it starts in")
+        if not 0 <= read < self.read_count:
+            raise CompiledProgramError("The program has no read %s"%read)
+        funcs = self._bind(chain)
+        ops = list(self._iter_ops())
+        if mask is not None:
+            value = value & mask
+        deadline = None if timeout is None else monotonic()+timeout
+        tries = 0
+        while True:
+            res = self._execute(chain, funcs, ops)[read]
+            tries += 1
+            if (res if mask is None else res & mask) == value:
+                return res, tries
+            if deadline is not None and monotonic() >= deadline:
+                raise PollTimeoutError(
+                    "Read %s did not match after %s tries (last read %s)"%
+                    (read, tries, res.to01()))
+            if interval:
+                sleep(interval)
+
+    def _bind(self, chain):
+        """Get chain ready to run the program.
+
+        Returns:
+            A (driver function, args, kwargs) tuple for each class.
+        """
+        if self.topology != topology_hash(chain._devices):
+            raise CompiledProgramError(
+                "The program was compiled for a different chain")
+        if not self.start_state.startswith('_PRE') and \
+           chain._sm.state != self.start_state:
+            chain.transition_tap(self.start_state)
+        chain.flush()
+        #What the program leaves the devices holding is not followed.
+        chain._command_queue._loaded_instructions = {}
+
+        available = {cls.__name__: cls for cls in
+                     chain._lv1_chain_primitives+
+                     chain._lv1_base_primitives}
+        funcs = []
+        controller = chain._controller
+        for name in self._class_names:
+            cls = available.get(name)
+            if cls is None:
+                raise CompiledProgramError(
+                    "The controller has no primitive %s"%name)
+            funcs.append((getattr(controller, cls._driver_function_name),
+                          cls._args, cls._kwargs))
+        return funcs
+
+    def _execute(self, chain, funcs, ops, patches=None, data=None):
+        """Call the driver functions for decoded ops, and collect the reads."""
+        buf = self._buf
+        readops = {_EXTENT.unpack_from(buf, offset)[0] for offset in
+                   range(self._extents, self._payload, _EXTENT.size)}
+        results = {}
+        for index, (clsindex, count, tms, tdi, tdo) in enumerate(ops):
+            if clsindex == _HOST_SLEEP:
+                sleep(count)
+                continue
+            if patches and index in patches:
+                tdi = _patch(tdi, count, patches[index], data)
+            func, args, kwargs = funcs[clsindex]
+            values = {'count': count, 'tms': tms, 'tdi': tdi, 'tdo': tdo}
+            res = func(*[values[attr] for attr in args],
+                       **{k: values[v] for k, v in kwargs.items()})
+            if index in readops:
+                results[index] = res
+        chain._sm.state = self.end_state
+
+        reads = []
+        for offset in range(self._reads, self._extents, _READ.size):
+            first, count = _READ.unpack_from(buf, offset)
+            value = None
+            for i in range(first, first+count):
+                index, start, length = _EXTENT.unpack_from(
+                    buf, self._extents+i*_EXTENT.size)
+                bits = results[index][start:start+length]
+                if value is None:
+                    value = bits
+                else:
+                    value += bits
+            reads.append(value)
+        return reads
+
+def _normalized(op):
+    """Make decoded ops comparable, whatever their signals were encoded as."""
+    clsindex, count = op[:2]
+    if clsindex == _HOST_SLEEP:
+        return op
+    return (clsindex, count)+tuple(_as_bitarray(value, count)
+                                   for value in op[2:])
+
+class PreparedProgram(object):
+    """A compiled program with holes in its TDI data, like a prepared statement.
+
+    The primitives staged by build are compiled once. Calling the
+    prepared program with new data for the holes overwrites the TDI
+    bits the holes compiled into, and runs the program without
+    compiling again.
+
+        >>> def write_page(chain, page):
+        ...     chain.rw_ir(data=bitarray('00000101'))
+        ...     chain.rw_dr(data=page)
+        >>> prog = chain.prepare(write_page, page=4096)
+        >>> for page in pages:
+        ...     prog(page=page)
+
+    The holes are found by compiling build several times with
+    different hole data and comparing the TDI bits, so the primitives
+    build stages must not depend on the values of the data (only on
+    its length). A prepared program whose compilation does depend on
+    the data raises CompiledProgramError when prepared.
+
+    Attributes:
+        program: The CompiledProgram, compiled with all holes 0.
+        holes: A dict of hole names to lengths in bits.
+    """
+    def __init__(self, chain, build, holes):
+        """Compile build into a PreparedProgram.
+
+        Args:
+            chain: The JTAGScanChain to compile and run on. Nothing may be staged on it.
+            build: A callable taking the chain and a bitarray for each hole (as keyword arguments) that stages primitives on the chain.
+            holes: A dict of hole names to lengths in bits.
+        """
+        if len(chain._command_queue):
+            raise CompiledProgramError(
+                "Flush the chain before preparing a program")
+        self._chain = chain
+        self.holes = dict(holes)
+        start = chain._sm.state
+
+        def compile_with(data):
+            chain._sm.state = start
+            build(chain, **data)
+            return CompiledProgram.compile(chain)
+
+        def filled(fill):
+            return {name: fill(name, length)
+                    for name, length in self.holes.items()}
+
+        zeros = filled(lambda name, length: _filled_bitarray(False, length))
+        self.program = compile_with(zeros)
+        base = list(self.program._iter_ops())
+        self._patches = {}
+        for name, length in self.holes.items():
+            data = dict(zeros)
+            data[name] = _filled_bitarray(True, length)
+            self._find_hole(name, length, base,
+                            list(compile_with(data)._iter_ops()))
+
+        #Check the holes against a compile with random data.
+        data = filled(lambda name, length: bitarray(
+            [random.getrandbits(1) for _ in range(length)]))
+        check = list(compile_with(data)._iter_ops())
+        chain._sm.state = start
+        if len(check) != len(base) or \
+           any(_normalized(self._patched(op, index, data)) !=
+               _normalized(op2)
+               for index, (op, op2) in enumerate(zip(base, check))):
+            raise CompiledProgramError(
+                "The compiled program depends on the hole data")
+
+    def _find_hole(self, name, length, base, ops):
+        """Record where the TDI bits of hole name ended up.
+
+        Most hole bits compile into arbitrary TDI bits, which differ
+        bit for bit between base and ops. Bits (like the last bit of a
+        scan) can also compile into an op sending one constant TDI
+        value, in which case the whole op's TDI changes.
+        """
+        if len(ops) != len(base):
+            raise CompiledProgramError(
+                "The compiled program depends on the hole data")
+        exact, coarse = {}, []
+        for index, (op, op2) in enumerate(zip(base, ops)):
+            if op[:2] != op2[:2]:
+                raise CompiledProgramError(
+                    "The compiled program depends on the hole data")
+            if op[0] == _HOST_SLEEP:
+                continue
+            tdi, tdi2 = op[3], op2[3]
+            if isinstance(tdi, bitarray) and isinstance(tdi2, bitarray):
+                positions = (tdi^tdi2).search(bitarray('1'))
+                if positions:
+                    exact[index] = positions
+            elif _as_bitarray(tdi, op[1]) != _as_bitarray(tdi2, op[1]):
+                coarse.append(index)
+        remaining = length-sum(len(p) for p in exact.values())
+        if remaining < 0 or bool(remaining) != bool(coarse) or \
+           len(coarse) > 1:
+            raise CompiledProgramError(
+                "Hole %s did not compile into TDI bits"%name)
+
+        datapos = length
+        for index in sorted(list(exact)+coarse):
+            if index not in exact:
+                datapos -= remaining
+                self._patches.setdefault(index, []).append(
+                    (None, name, datapos, remaining))
+                continue
+            segments = []
+            #Bits are shifted right to left, in data and in TDI.
+            for pos in reversed(exact[index]):
+                datapos -= 1
+                if segments and segments[-1][0] == pos+1 and \
+                   segments[-1][2] == datapos+1:
+                    segments[-1] = (pos, name, datapos,
+                                    segments[-1][3]+1)
+                else:
+                    segments.append((pos, name, datapos, 1))
+            self._patches.setdefault(index, []).extend(segments)
+
+    def _patched(self, op, index, data):
+        """Fill the holes of a decoded op with data."""
+        if index not in self._patches:
+            return op
+        clsindex, count, tms, tdi, tdo = op
+        if isinstance(tdi, bitarray):
+            tdi = tdi.copy()
+        return (clsindex, count, tms,
+                _patch(tdi, count, self._patches[index], data), tdo)
+
+    def __call__(self, **data):
+        """Run the program with data for every hole.
+
+        Returns:
+            A list of bitarrays, one for each read in the program, in
+            the order the reads were staged.
+        """
+        if set(data) != set(self.holes):
+            raise CompiledProgramError(
+                "Data is needed for exactly the holes %s"%
+                ", ".join(sorted(self.holes)))
+        for name, bits in data.items():
+            if len(bits) != self.holes[name]:
+                raise CompiledProgramError(
+                    "Hole %s is %s bits, not %s"%
+                    (name, self.holes[name], len(bits)))
+        return self.program.run(self._chain, patches=self._patches,
+                                data=data)
@@ -33,14 +33,14 @@ if not driver_count:
             'This is likely why the drivers could not be loaded.'+\
               '\033[0m')
 
-def getDriverInstanceForDevice(device):
+def getDriverInstanceForDevice(device, context=None):
     vid_dict = _controllerfilter.get(device.getVendorID())
     if vid_dict:
         driver_class = vid_dict.get(device.getProductID(),
                                     vid_dict.get(None))
         if driver_class:
             try:
-                return driver_class(device)
+                return driver_class(device, context=context)
             # pylint: disable=no-member
             except usb1.USBErrorAccess as e:
                 return InaccessibleController(driver_class, device)
@@ -49,7 +49,7 @@ def getDriverInstanceForDevice(device):
 def getAttachedControllers(cname=None):
     controllers = []
     for device in usbcontext.getDeviceList(skip_on_error=True):
-        controller = getDriverInstanceForDevice(device)
+        controller = getDriverInstanceForDevice(device, usbcontext)
         if controller:
             controllers.append(controller)
         #else:
@@ -74,6 +74,20 @@ def index_or_default(s):
         pass
     return s
 
+def interleave_tms_tdi(tmsdata, tdidata):
+    """Build the payload of a WRITE_TMS_TDI transfer.
+
+    Args:
+        tmsdata: A bitarray of TMS bits (right most bit first).
+        tdidata: A bitarray of TDI bits as long as tmsdata.
+
+    Returns:
+        The bytes to send, each pair of bits being one TMS and one TDI bit.
+    """
+    outdata = bitarray([val for pair in zip(tmsdata, tdidata)
+                        for val in pair])
+    return build_byte_align_buff(outdata).tobytes()[::-1]
+
 
 ##############
 # PRIMITIVES #
@@ -128,8 +142,8 @@ class DigilentAdeptController(CableDriver):
     _primitives = [DigilentWriteTDIPrimitive, DigilentWriteTMSPrimitive,
                    DigilentWriteTMSTDIPrimitive, DigilentReadTDOPrimitive,
                    DigilentClockTickPrimitive]
-    def __init__(self, dev):
-        super(DigilentAdeptController, self).__init__(dev)
+    def __init__(self, dev, *, context=None):
+        super(DigilentAdeptController, self).__init__(dev, context=context)
         h = self._dev.open()
 
         self.serialNumber = h.controlRead(
@@ -398,9 +412,7 @@ class DigilentAdeptController(CableDriver):
         count = len(tmsdata)
 
         t = time()
-        outdata = bitarray([val for pair in zip(tmsdata, tdidata)
-                            for val in pair])
-        outdata = build_byte_align_buff(outdata).tobytes()[::-1]
+        outdata = interleave_tms_tdi(tmsdata, tdidata)
 
         if self._scanchain and self._scanchain._print_statistics:
             print("TDI/TDI DATA PREP TIME", time()-t)#pragma: no cover
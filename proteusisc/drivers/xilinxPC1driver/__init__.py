@@ -12,12 +12,14 @@ from time import time
 import math
 import numbers
 
+import usb1
+
 from proteusisc.cabledriver import CableDriver
 from proteusisc.primitive import Level1Primitive,\
     Level2Primitive, Level3Primitive, Executable
 from proteusisc.contracts import NOCARE, ZERO, ONE, CONSTANT, ARBITRARY
 from proteusisc.errors import JTAGEnableFailedError,\
-    JTAGAlreadyEnabledError, JTAGNotEnabledError
+    JTAGAlreadyEnabledError, JTAGNotEnabledError, JTAGControlError
 from proteusisc.bittypes import ConstantBitarray, CompositeBitarray,\
     bitarray
 from . import _xpcu1utils
@@ -37,10 +39,32 @@ class XPC1TransferPrimitive(Level1Primitive, Executable):
     _args = ['count']
     _kwargs = {'TMS': 'tms', 'TDI': 'tdi', 'TDO': 'tdo'}
 
+class XPC1SingleStepTransferPrimitive(Level1Primitive, Executable):
+    """Transfer bits with the XPCU1 single step GPIO requests.
+
+    Every bit costs two control transfers (three when TDO is read).
+    The controller only offers this primitive to the compiler in CPLD
+    upgrade mode, where it replaces XPC1TransferPrimitive.
+    """
+    _function_name = 'transfer_bits_single_step'
+    _driver_function_name = 'transfer_bits_batched'
+    _max_send_bits = 0xFFFFFF+1
+    _max_recv_bits = 0xFFFFFF+1
+    _TMS, _TDI, _TDO = ARBITRARY, ARBITRARY, ARBITRARY
+    _COST_PRIM = 40
+    _COST_READ_BIT_GROUP = 20
+    _COST_PAYLOAD_BIT_GROUP = 20
+    _args = ['count']
+    _kwargs = {'TMS': 'tms', 'TDI': 'tdi', 'TDO': 'tdo'}
+
 class XilinxPC1Driver(CableDriver):
-    _primitives = [XPC1TransferPrimitive]
-    def __init__(self, dev):
-        super(XilinxPC1Driver, self).__init__(dev)
+    _primitives = [XPC1TransferPrimitive, XPC1SingleStepTransferPrimitive]
+    #Max number of single step control transfers in flight at once.
+    _SINGLE_STEP_WINDOW = 64
+
+    def __init__(self, dev, *, context=None):
+        super(XilinxPC1Driver, self).__init__(dev, context=context)
+        self._cpld_upgrade_mode = False
         h = self._dev.open()
 
         self.serialNumber = '000000000000'
@@ -63,6 +87,11 @@ class XilinxPC1Driver(CableDriver):
                                           self.serialNumber,
                                           self.firmwareVersion)
 
+    def _lv1_primitive_usable(self, prim):
+        #CPLD upgrade mode transfers every bit with single step requests.
+        return issubclass(prim, XPC1SingleStepTransferPrimitive) == \
+            self._cpld_upgrade_mode
+
     def jtag_enable(self):
         if self._dev.getProductID() == 0x0D:
             self._handle.claimInterface(0)
@@ -128,63 +157,154 @@ class XilinxPC1Driver(CableDriver):
     def transfer_bits_single(self, count, TMS, TDI, TDO=False):
         if not self._jtagon:
             raise JTAGNotEnabledError()
-        if isinstance(TMS, (numbers.Number, bool)):
-            TMS = bitarray(count*(bool(TMS),))
-        if isinstance(TDI, (numbers.Number, bool)):
-            TDI = bitarray(count*(bool(TDI),))
-        #if isinstance(TDO, (numbers.Number, bool)):
-        #    TDO = bitarray(count*(bool(TDO),))
         if self._scanchain:
-            self._scanchain._tap_transition_driver_trigger(TMS)
-        #self.xpcu_single_read()
-        outbits = bitarray()
-        TMS.reverse()
-        TDI.reverse()
-
-        for bit_num in range(count):
-            self.xpcu_single_write(TMS[bit_num], TDI[bit_num])
-            if TDO:
-                b = self.xpcu_single_read()
-                outbits.append(b)
-
-        if outbits:
-            outbits.reverse()
-            return outbits
+            self._scanchain._tap_transition_driver_trigger(
+                self._single_step_bits(TMS, count))
+        return self._transfer_bits_single_step(count, TMS, TDI, TDO,
+                                               read_first=False)
 
     def transfer_bits_single_cpld_upgrade(self, count, TMS, TDI, TDO=False):
         if not self._jtagon:
             raise JTAGNotEnabledError()
-        if isinstance(TMS, (numbers.Number, bool)):
-            TMS = bitarray(count*(bool(TMS),))
-        if isinstance(TDI, (numbers.Number, bool)):
-            TDI = bitarray(count*(bool(TDI),))
-        #if isinstance(TDO, (numbers.Number, bool)):
-        #    TDO = bitarray(count*(bool(TDO),))
-        #    TDO = bitarray(count*('1' if TDO else '0'))
         if self._scanchain:
-            self._scanchain._tap_transition_driver_trigger(TMS)
-        #self.xpcu_single_read()
-        outbits = bitarray()
-        TMS.reverse()
-        TDI.reverse()
-
-        for bit_num in range(count):
-            if TDO:
-                b = self.xpcu_single_read()
-                outbits.append(b)
-            self.xpcu_single_write(TMS[bit_num], TDI[bit_num])
+            self._scanchain._tap_transition_driver_trigger(
+                self._single_step_bits(TMS, count))
+        return self._transfer_bits_single_step(count, TMS, TDI, TDO,
+                                               read_first=True)
+
+    def transfer_bits_batched(self, count, *, TMS=True, TDI=False,
+                              TDO=False):
+        """Transfer bits with single step GPIO requests only if required.
+
+        The bulk GPIO transfer is used unless the controller is in
+        CPLD upgrade mode, where each bit is clocked with single step
+        requests (reading TDO before clocking, matching
+        transfer_bits_single_cpld_upgrade). Only bits with TDO set are
+        returned, same as transfer_bits.
+        """
+        if not self._jtagon:
+            raise JTAGNotEnabledError('JTAG Must be enabled first')
+        if not self._cpld_upgrade_mode:
+            return self.transfer_bits(count, TMS=TMS, TDI=TDI, TDO=TDO)
+        if count < 1:
+            raise ValueError()
+        return self._transfer_bits_single_step(count, TMS, TDI, TDO,
+                                               read_first=True)
 
+    @staticmethod
+    def _single_step_bits(bits, count):
+        if isinstance(bits, (numbers.Number, bool)):
+            return ConstantBitarray(bool(bits), count)
+        return bits
+
+    def _transfer_bits_single_step(self, count, TMS, TDI, TDO, *,
+                                   read_first):
+        #Bits are stored right to left; the rightmost bit is sent first.
+        TMS = self._single_step_bits(TMS, count)
+        TDI = self._single_step_bits(TDI, count)
+        TDO = self._single_step_bits(TDO, count)
+
+        ops = []
+        for tms, tdi, tdo in zip(reversed(TMS), reversed(TDI),
+                                 reversed(TDO)):
+            val = (bool(tms)<<1)|bool(tdi)
+            if tdo and read_first:
+                ops.append(None)
+            ops.append(0b100|val)
+            ops.append(val)
+            if tdo and not read_first:
+                ops.append(None)
+
+        outbits = bitarray(self._xpcu_single_step_batch(ops))
         if outbits:
             outbits.reverse()
             return outbits
 
-
+    def _xpcu_single_step_batch(self, ops):
+        """Issue a sequence of single step GPIO requests.
+
+        When the driver knows its USB context, libusb's asynchronous
+        API is used to keep up to _SINGLE_STEP_WINDOW control
+        transfers in flight so the per transfer round trip latency
+        overlaps. Control
+        transfers on the default endpoint complete in submission
+        order, so pipelining does not reorder the bits.
+
+        Args:
+            ops: A sequence of GPIO values to write (ints with TCK,
+             TMS, TDI in bits 2, 1, 0), or None to read TDO.
+
+        Returns:
+            A list of booleans read from TDO, one per None in ops.
+        """
+        handle = self._handle
+        usbcontext = self._usbcontext
+        if usbcontext is None or not hasattr(handle, 'getTransfer'):
+            res = []
+            for op in ops:
+                if op is None:
+                    res.append(self.xpcu_single_read())
+                else:
+                    handle.controlWrite(0x40, 0xb0, 0x30, op, b'')
+            return res
+
+        reads = [None]*sum(1 for op in ops if op is None)
+        errors = []
+        free = []
+        inflight = set()
+
+        def callback(transfer):
+            inflight.discard(transfer)
+            free.append(transfer)
+            status = transfer.getStatus()
+            if status != usb1.TRANSFER_COMPLETED:
+                errors.append(status)
+                return
+            slot = transfer.getUserData()
+            if slot is not None:
+                reads[slot] = bool(transfer.getBuffer()[0]&1)
+
+        opiter = iter(ops)
+        readindex = 0
+        try:
+            for op in opiter:
+                while not free and len(inflight)>=self._SINGLE_STEP_WINDOW:
+                    usbcontext.handleEvents()
+                if errors:
+                    break
+                transfer = free.pop() if free else handle.getTransfer()
+                if op is None:
+                    transfer.setControl(0xC0, 0xb0, 0x38, 0, 1,
+                                        callback=callback,
+                                        user_data=readindex)
+                    readindex += 1
+                else:
+                    transfer.setControl(0x40, 0xb0, 0x30, op, b'',
+                                        callback=callback)
+                inflight.add(transfer)
+                transfer.submit()
+            while inflight:
+                usbcontext.handleEvents()
+        finally:
+            for transfer in list(inflight):
+                transfer.cancel() #pragma: no cover
+            while inflight:
+                usbcontext.handleEvents() #pragma: no cover
+
+        if errors:
+            raise JTAGControlError("Single step GPIO transfer failed "
+                                   "with status %s"%errors[0])
+        return reads
 
     def xpcu_enable_output(self, enable):
         self._handle.controlWrite(0x40, 0xb0, 0x18 if enable else 0x10, 0, b'')
 
     def xpcu_enable_cpld_upgrade_mode(self, enable):
         self._handle.controlWrite(0x40, 0xb0, 0x52, 1 if enable else 0, b'')
+        self._cpld_upgrade_mode = bool(enable)
+        if self._scanchain:
+            #Plans made for the other mode use the wrong primitives.
+            self._scanchain._fitted_lv1_prim_cache.clear()
 
     def xpcu_set_jtag_speed(self, speed_mode):
         self._handle.controlWrite(0x40, 0xb0, 0x28, 0x10|speed_mode, b'')
@@ -273,9 +393,7 @@ class XilinxPC1Driver(CableDriver):
 
     @staticmethod
     def _count_tdo_bits(data, bit_count):
-        return bin(sum([((ord(data[i*2+1:i*2+2])>>4) &
-                         (( 1<< min(4, bit_count-(i*4)) )-1) )<<4*i
-                        for i in range(int(len(data)/2))])).count('1')
+        return _xpcu1utils.count_tdo_bits(data, bit_count)
 
     @staticmethod
     def _decode_tdo_bits(ret, *, bit_return_count=None, bit_count=None):
@@ -283,22 +401,13 @@ class XilinxPC1Driver(CableDriver):
             bit_return_count = XilinxPC1Driver._count_tdo_bits(ret,
                                                                bit_count)
 
-        bytes_wanted = int(math.ceil(bit_return_count/8.0))
-        bytes_expected = bytes_wanted +(1 if bytes_wanted%2 else 0)
-
-        final_group_index = (bit_return_count-(bit_return_count%32))//8
-        retiter = iter(ret[:final_group_index])
-        fullgroups = [bytes(elem[::-1]) for elem in
-                      zip(retiter, retiter, retiter, retiter)][::-1]
-        other=ret[final_group_index:][::-1]
-        other_bits = bitarray()
-        other_bits.frombytes(other)
-        other_bits = other_bits[:bit_return_count-(8*final_group_index)]
-
-        reordered_data = b"".join(fullgroups)
+        #The XPCU returns TDO as little endian 32 bit words with a
+        #trailing partial word. The C helper reverses word and byte
+        #order into a single big endian buffer in one pass.
         raw_bits = bitarray()
-        raw_bits.frombytes(reordered_data)
-        raw_bits = other_bits + raw_bits
+        raw_bits.frombytes(
+            _xpcu1utils.decode_tdo_bytes(ret, bit_return_count))
+        del raw_bits[bit_return_count:]
 
         return raw_bits
 
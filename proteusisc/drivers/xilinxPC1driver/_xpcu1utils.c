@@ -76,9 +76,105 @@ xpcu_calc_xfer_payload(PyObject *self, PyObject *args){
   return res;
 }
 
+static const uint8_t nibble_popcount[16] =
+  {0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4};
+
+static PyObject *
+xpcu_count_tdo_bits(PyObject *self, PyObject *args){
+  Py_buffer data;
+  Py_ssize_t bit_count;
+
+  //Arguments: bytes like payload, int
+  if (!PyArg_ParseTuple(args, "y*n", &data, &bit_count))
+    return NULL;
+
+  const uint8_t* buff = (const uint8_t*)data.buf;
+  Py_ssize_t groups = data.len/2;
+  Py_ssize_t total = 0;
+  for (Py_ssize_t i = 0; i < groups; i++){
+    //Each 4 bit group is 2 bytes: TMS|TDI and TDO|TCK nibbles.
+    Py_ssize_t remaining = bit_count - (i<<2);
+    uint8_t mask;
+    if (remaining >= 4)
+      mask = 0xF;
+    else if (remaining <= 0)
+      mask = 0;
+    else
+      mask = (1<<remaining)-1;
+    total += nibble_popcount[(buff[(i<<1)+1]>>4) & mask];
+  }
+
+  PyBuffer_Release(&data);
+  return PyLong_FromSsize_t(total);
+}
+
+static PyObject *
+xpcu_decode_tdo_bytes(PyObject *self, PyObject *args){
+  Py_buffer ret;
+  Py_ssize_t bit_return_count;
+
+  //Arguments: bytes like data read from the controller, int
+  if (!PyArg_ParseTuple(args, "y*n", &ret, &bit_return_count))
+    return NULL;
+
+  const uint8_t* in = (const uint8_t*)ret.buf;
+  Py_ssize_t inlen = ret.len;
+  //Bytes of complete 32 bit little endian words.
+  Py_ssize_t fullbytes = (bit_return_count-(bit_return_count%32))/8;
+  //Bits of the trailing partial word (0-31).
+  Py_ssize_t otherbits = bit_return_count - (fullbytes*8);
+
+  if (bit_return_count < 0 || fullbytes+(otherbits+7)/8 > inlen){
+    PyBuffer_Release(&ret);
+    PyErr_SetString(PyExc_ValueError,
+		    "Not enough data for requested bit count.");
+    return NULL;
+  }
+
+  Py_ssize_t outlen = (bit_return_count+7)/8;
+  PyObject* res = PyBytes_FromStringAndSize(NULL, outlen);
+  if (!res){
+    PyBuffer_Release(&ret);
+    return NULL;
+  }
+  uint8_t* out = (uint8_t*)PyBytes_AsString(res);
+  memset(out, 0, outlen);
+
+  //The partial word is sent last, so its bits come first. Its bytes
+  //are read from the end of the buffer backwards.
+  Py_ssize_t otherbytes = otherbits/8;
+  int shift = otherbits%8;
+  for (Py_ssize_t j = 0; j < otherbytes; j++)
+    out[j] = in[inlen-1-j];
+  if (shift)
+    out[otherbytes] = in[inlen-1-otherbytes] & (0xFF<<(8-shift));
+
+  //Full words follow, last word first, each word byte reversed.
+  Py_ssize_t pos = otherbytes;
+  for (Py_ssize_t g = fullbytes/4 - 1; g >= 0; g--){
+    for (int b = 3; b >= 0; b--){
+      uint8_t byte = in[(g<<2)+b];
+      if (shift){
+	out[pos] |= byte>>shift;
+	out[pos+1] = (byte<<(8-shift)) & 0xFF;
+      }else{
+	out[pos] = byte;
+      }
+      pos++;
+    }
+  }
+
+  PyBuffer_Release(&ret);
+  return res;
+}
+
 static PyMethodDef XpcuMethods[] = {
       {"calc_xfer_payload",  xpcu_calc_xfer_payload, METH_VARARGS,
        "Calculates a bytestream from 3 byte iters to send to the XPCU1."},
+      {"count_tdo_bits",  xpcu_count_tdo_bits, METH_VARARGS,
+       "Counts the TDO bits requested by an XPCU1 transfer payload."},
+      {"decode_tdo_bytes",  xpcu_decode_tdo_bytes, METH_VARARGS,
+       "Reorders the TDO data returned by the XPCU1 into big endian bytes."},
       {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
@@ -35,3 +35,15 @@ class NoMatchingControllerError(ProteusISCError):
 
 class ControllerFilterTooVagueError(ProteusISCError):
     pass
+
+class SVFError(ProteusISCError):
+    pass
+
+class SVFCompareError(SVFError):
+    pass
+
+class CompiledProgramError(ProteusISCError):
+    pass
+
+class PollTimeoutError(ProteusISCError):
+    pass
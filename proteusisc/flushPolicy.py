@@ -0,0 +1,134 @@
+"""Flush a chain's staged primitives automatically before too many pile up.
+
+Primitives staged on a JTAGScanChain stay queued until something
+flushes them, and every queued primitive holds on to its data and
+promises. Staging a long script without reading anything back can use
+a lot of memory. Flushing often loses chances to merge primitives, so
+a FlushPolicy only flushes once one of its limits is passed:
+
+    >>> chain = JTAGScanChain(controller,
+    ...                       flush_policy=FlushPolicy(max_bits=2**24))
+
+The limits are checked each time a primitive is staged. The queue is
+only cut where the rest of it can be compiled on its own (see
+CommandQueue.last_cut_point), so a register scan that is still open
+is left queued for later. A run of device primitives that will be
+aligned together is not cut either, unless a limit is passed twice
+over: a long script of device primitives has to be flushed in parts
+to keep its memory bounded, even if the parts are not aligned with
+each other.
+
+The memory used by the queue is a rough estimate: a fixed size for
+every primitive and promise, plus the bytes of the data written and
+the data to be read.
+"""
+from time import monotonic
+
+from .bittypes import CompositeBitarray
+
+#Rough sizes of a staged primitive and a promise, with their dicts.
+_PRIM_BYTES = 400
+_PROMISE_BYTES = 250
+
+_triggers = ('prims', 'bits', 'bytes', 'age')
+
+def estimate_bytes(prim):
+    """Estimate the memory a staged primitive holds on to."""
+    size = _PRIM_BYTES
+    data = getattr(prim, 'data', None)
+    if isinstance(data, CompositeBitarray):
+        size += (len(data)+7)//8
+    if getattr(prim, '_promise', None) is not None:
+        size += _PROMISE_BYTES+((getattr(prim, 'bitcount', 0) or 0)+7)//8
+    return size
+
+class FlushPolicy(object):
+    """Limits on a chain's queue of staged primitives.
+
+    Attributes:
+        triggered: A dict of the number of automatic flushes each limit caused, by limit ('prims', 'bits', 'bytes' or 'age').
+        deferred: The number of times a limit was passed but the queue had no safe cut point yet.
+        prims: The number of primitives queued.
+        bits: The number of register bits the queued primitives read or write.
+        bytes: The estimated memory held by the queued primitives.
+    """
+    def __init__(self, *, max_prims=None, max_bits=None, max_bytes=None,
+                 max_age=None, clock=monotonic):
+        """Create a new FlushPolicy. Limits left as None are not checked.
+
+        Args:
+            max_prims: The most primitives to keep queued.
+            max_bits: The most register bits the queued primitives may read or write.
+            max_bytes: The most memory (estimated, see estimate_bytes) the queued primitives may hold.
+            max_age: The most seconds to keep a primitive queued. Only checked when a primitive is staged.
+            clock: A callable returning the time in seconds.
+        """
+        self.max_prims = max_prims
+        self.max_bits = max_bits
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._clock = clock
+        self.triggered = dict.fromkeys(_triggers, 0)
+        self.deferred = 0
+        self._queue = None
+        self._reset([])
+
+    def watch(self, queue):
+        """Start keeping track of a CommandQueue."""
+        self._queue = queue
+        queue.flush_listeners.append(self)
+        self._reset(queue.queue)
+
+    def _reset(self, prims):
+        self.prims = len(prims)
+        self.bits = sum(getattr(p, 'bitcount', 0) or 0 for p in prims)
+        self.bytes = sum(estimate_bytes(p) for p in prims)
+        #The time each remaining primitive was staged is not kept, so
+        #what is left after a flush counts as staged at the flush.
+        self._since = self._clock() if prims else None
+        self._checked = 1
+
+    def staged(self, prim):
+        """Account for a newly staged primitive, and flush if a limit is passed."""
+        self.prims += 1
+        self.bits += getattr(prim, 'bitcount', 0) or 0
+        self.bytes += estimate_bytes(prim)
+        if self._since is None:
+            self._since = self._clock()
+
+        trigger = self._passed()
+        if trigger is None:
+            return
+        queue = self._queue
+        count = queue.last_cut_point(self._checked)
+        if not count and self._passed(2) is not None:
+            count = queue.last_cut_point(keep_aligned=False)
+        if not count:
+            self.deferred += 1
+            #Cut points found later can only come from what is
+            #staged after this.
+            self._checked = len(queue)
+            return
+        self.triggered[trigger] += 1
+        queue.flush(count=count)
+
+    def _passed(self, factor=1):
+        """Find the first limit passed factor times over, or None."""
+        if self.max_prims is not None and \
+           self.prims > self.max_prims*factor:
+            return 'prims'
+        if self.max_bits is not None and self.bits > self.max_bits*factor:
+            return 'bits'
+        if self.max_bytes is not None and \
+           self.bytes > self.max_bytes*factor:
+            return 'bytes'
+        if self.max_age is not None and \
+           self._clock()-self._since > self.max_age*factor:
+            return 'age'
+        return None
+
+    def flush_started(self, queue):
+        pass
+
+    def flush_finished(self, queue):
+        self._reset(queue.queue)
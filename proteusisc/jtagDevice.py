@@ -17,9 +17,16 @@ class JTAGDeviceBase(object):
     def __init__(self, chain, idcode):
         self._chain = chain
         self._current_DR = None
+        #run_instruction skips loading an instruction the device
+        #already holds. Set for devices that need the reload (like
+        #ones whose data registers reset on every IR update).
+        self.always_load_instruction = False
 
         fail = False
-        if isinstance(idcode, int):
+        if idcode is None:
+            #The device has no IDCODE (see BypassJTAGDevice).
+            self._id = None
+        elif isinstance(idcode, int):
             if len(bin(idcode)[2:]) > 32:
                 fail = True
             else:
@@ -44,7 +51,7 @@ class JTAGDeviceBase(object):
                              "bitarray of 32 bits (%s len: %s)"%\
                              (idcode,len(idcode)))
 
-        if not self._id & 1:
+        if self._id is not None and not self._id & 1:
             raise Exception("Invalid JTAG ID Code: LSB must be 1 "
                             "(IEEE 1149.1)")
 
@@ -72,3 +79,18 @@ class JTAGDevice(JTAGDeviceBase):
     def __init__(self, chain, idcode):
         super(JTAGDevice, self).__init__(chain, idcode)
         self._desc = self._chain.get_descriptor_for_idcode(self._id)
+
+class BypassJTAGDevice(JTAGDeviceBase):
+    """A device that selected its BYPASS register after reset instead of an IDCODE.
+
+    Nothing is known about the device except its 1 bit data register,
+    so it has no descriptor and its IR length is unknown. Chain level
+    primitives can still be used on its chain, but device primitives
+    can not, since the device can not be put in BYPASS while the other
+    devices are scanned.
+    """
+    def __init__(self, chain):
+        super(BypassJTAGDevice, self).__init__(chain, None)
+
+    def __repr__(self):
+        return "<D%s: BYPASS>"%self.chain_index
@@ -1,52 +1,46 @@
 import os
-import json
-import re
-import fnmatch
 import numbers
+from array import array
+from collections.abc import Mapping
 from bitarray import bitarray
 
 from .jtagUtils import manufacturer_lookup
-from .utils import memoized
+from .utils import memoized, lazy_property
+from .jtagDeviceDescriptionStore import JTAGDescriptorStore
 from .jtagDeviceDescriptionNetResolver import get_sid, get_details, decode_bsdl
+from .jtagDeviceDescriptionBSDL import decode_boundary_register
 
-_descr_file_re = re.compile('[01X]'*32+".json")
 base_descr_dir = os.path.join(os.path.expanduser("~"),
                               '.config', 'proteusisc', 'jtag_descr')
+base_descr_db = os.path.join(os.path.expanduser("~"),
+                             '.config', 'proteusisc', 'jtag_descr.sqlite3')
 
-def _check_cache_for_idcode(id_str):
-    best_file = None
-    try:
-        for file in os.listdir(base_descr_dir):
-            if _descr_file_re.match(file) and\
-               re.match(file.strip(".json").replace("X","."), id_str) and\
-               (not best_file or best_file.count('X') > file.count('X')):
-                best_file = file
-    except FileNotFoundError:
-        pass
-    if best_file:
-        return os.path.join(base_descr_dir, best_file)
-
-@memoized
+_store = None
+
+def get_descriptor_store():
+    """Get the descriptor store, importing the old JSON cache directory into it."""
+    global _store
+    if _store is None or _store.path != base_descr_db:
+        _store = JTAGDescriptorStore(base_descr_db,
+                                     legacy_dir=base_descr_dir)
+    return _store
+
+@memoized(maxsize=256, negative_ttl=60)
 def get_descriptor_for_idcode(idcode):
     """Use this method to find bsdl descriptions for devices.
     The caching on this method drastically lower the execution
     time when there are a lot of bsdl files and more than one
     device. May move it into a metaclass to make it more
-    transparent."""
+    transparent. Failed lookups (usually network errors) are
+    remembered for a minute so they are not retried on every scan."""
+    dat = get_descriptor_store().find(idcode)
     idcode = idcode&0x0fffffff
     id_str = "XXXX"+bin(idcode)[2:].zfill(28)
 
-    descr_file_path = _check_cache_for_idcode(id_str)
-    if descr_file_path:
-        with open(descr_file_path, 'r') as f:
-            dat = json.load(f)
-        if dat.get("_file_version",-1) == JTAGDeviceDescription.version:
-            return JTAGDeviceDescription(dat.get('idcode'),
-                                         dat.get('name'),
-                                         dat.get('ir_length'),
-                                         dat.get('instruction_opcodes'),
-                                         dat.get('registers'),
-                                         dat.get('instruction_register_map'))
+    if dat:
+        descr = JTAGDeviceDescription._load(dat)
+        if descr is not None:
+            return descr
 
     print("    Device detected ("+id_str+"). Fetching missing descriptor...")
     sid = get_sid(id_str)
@@ -76,24 +70,98 @@ def get_descriptor_for_idcode(idcode):
                                   details['name'], instruction_length,
                                   attribs['INSTRUCTION_OPCODE'],
                                   attribs['REGISTERS'],
-                                  attribs['INSTRUCTION_TO_REGISTER'])
+                                  attribs['INSTRUCTION_TO_REGISTER'],
+                                  attribs.get('BOUNDARY_REGISTER'))
 
-    #CACHE DESCR AS FILE!
-    if not os.path.isdir(base_descr_dir):
-        os.makedirs(base_descr_dir)
-    descr_file_path = os.path.join(base_descr_dir,
-                                   attribs['IDCODE_REGISTER']\
-                                   .upper()+'.json')
-    with open(descr_file_path, 'w') as f:
-        json.dump(descr._dump(), f)
+    get_descriptor_store().add(descr._dump())
 
     return descr
 
 
+class _OpcodeMap(Mapping):
+    """Read only mapping of instruction names to opcode bitarrays.
+
+    Every opcode is stored in one packed bitarray.
+    """
+    __slots__ = ('_index', '_packed', '_length')
+    def __init__(self, index, packed, length):
+        self._index = index
+        self._packed = packed
+        self._length = length
+
+    def __getitem__(self, name):
+        start = self._index[name]*self._length
+        return self._packed[start:start+self._length]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+class _IndexedMap(Mapping):
+    """Read only mapping of names to the values of an array.
+
+    Values equal to missing are treated as absent. If names is given,
+    values are indexes into it.
+    """
+    __slots__ = ('_index', '_values', '_names', '_missing')
+    def __init__(self, index, values, names=None, missing=None):
+        self._index = index
+        self._values = values
+        self._names = names
+        self._missing = missing
+
+    def __getitem__(self, name):
+        value = self._values[self._index[name]]
+        if value == self._missing:
+            raise KeyError(name)
+        return self._names[value] if self._names else value
+
+    def __iter__(self):
+        return (name for name, i in self._index.items()
+                if self._values[i] != self._missing)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 class JTAGDeviceDescription(object):
-    version = 1
+    """Everything needed to talk to a device type.
+
+    Descriptors are kept in a compact form (the same one returned by
+    _dump): instruction names and their opcodes packed in one string,
+    register lengths in a list, and the BOUNDARY_REGISTER attribute
+    as the raw BSDL string. The mappings used by primitives
+    (_instructions, _registers, _instruction_register_map) and
+    boundary_register are only built on first access.
+    """
+    version = 2
     def __init__(self, idcode, name, ir_length, instruction_opcodes,
-                 registers, instruction_register_map):
+                 registers, instruction_register_map,
+                 boundary_register=None):
+        if not isinstance(ir_length, int) or ir_length < 1:
+            raise Exception('BSDL files must provide the INSTRUCTION_LENGTH of the chain entry')
+        for insname, opcode in instruction_opcodes.items():
+            if len(opcode) != ir_length:
+                raise Exception("Opcode of %s is not INSTRUCTION_LENGTH "
+                                "bits long"%insname)
+
+        insnames = list(instruction_opcodes)
+        regnames = list(registers)
+        regindex = {reg:i for i, reg in enumerate(regnames)}
+        self._init(idcode, name, ir_length, {
+            'instructions': insnames,
+            'opcodes': "".join(instruction_opcodes[ins]
+                               for ins in insnames),
+            'registers': regnames,
+            'register_lengths': [registers[reg] for reg in regnames],
+            'instruction_registers':
+            [regindex.get(instruction_register_map.get(ins), -1)
+             for ins in insnames],
+            'boundary_register': boundary_register,
+        })
+
+    def _init(self, idcode, name, ir_length, compact):
         if isinstance(idcode, numbers.Number):
             self._idcode = idcode
             self._idcode_mask = 0x0FFFFFFF #top 4 bits is version
@@ -111,29 +179,74 @@ class JTAGDeviceDescription(object):
 
         self._device_name = name
         self._chip_package = "UNKNOWN"
-
-        if not isinstance(ir_length, int) or ir_length < 1:
-            raise Exception('BSDL files must provide the INSTRUCTION_LENGTH of the chain entry')
         self._ir_length = ir_length
+        self._compact = compact
 
-        #TODO Add checks to make sure the instruction lengths are sane
-        self._instructions = {k:bitarray(v) for k,v in instruction_opcodes.items()}
+    @classmethod
+    def _load(cls, dat):
+        """Create a descriptor from a dict returned by _dump.
 
-        self._registers = registers
-        self._instruction_register_map = instruction_register_map
+        Version 1 dicts (the old JSON cache format) are converted.
+
+        Returns:
+            The descriptor, or None if the dict's version is unknown.
+        """
+        version = dat.get("_file_version", -1)
+        if version == 1:
+            return cls(dat.get('idcode'), dat.get('name'),
+                       dat.get('ir_length'),
+                       dat.get('instruction_opcodes'),
+                       dat.get('registers'),
+                       dat.get('instruction_register_map'))
+        if version != cls.version:
+            return None
+        self = cls.__new__(cls)
+        self._init(dat['idcode'], dat.get('name'), dat['ir_length'],
+                   {k:dat.get(k) for k in
+                    ('instructions', 'opcodes', 'registers',
+                     'register_lengths', 'instruction_registers',
+                     'boundary_register')})
+        return self
 
     def _dump(self):
-        return {
+        dat = {
             '_file_version': JTAGDeviceDescription.version,
             'idcode': self._idcode_str,
             'name': self._device_name,
             'ir_length': self._ir_length,
-            'instruction_opcodes':
-            {k:"".join(["1" if tf else "0" for tf in v.tolist()])
-             for k,v in self._instructions.items()},
-            "registers": self._registers,
-            "instruction_register_map": self._instruction_register_map,
             }
+        dat.update(self._compact)
+        return dat
+
+    @lazy_property
+    def _instruction_index(self):
+        return {ins:i for i, ins in
+                enumerate(self._compact['instructions'])}
+
+    @lazy_property
+    def _instructions(self):
+        return _OpcodeMap(self._instruction_index,
+                          bitarray(self._compact['opcodes']),
+                          self._ir_length)
+
+    @lazy_property
+    def _registers(self):
+        regnames = self._compact['registers']
+        return _IndexedMap({reg:i for i, reg in enumerate(regnames)},
+                           array('L', self._compact['register_lengths']))
+
+    @lazy_property
+    def _instruction_register_map(self):
+        return _IndexedMap(self._instruction_index,
+                           array('h', self._compact['instruction_registers']),
+                           tuple(self._compact['registers']), -1)
+
+    @lazy_property
+    def boundary_register(self):
+        """The decoded BOUNDARY_REGISTER attribute (cell number to list
+        of fields), or None if the descriptor has none."""
+        raw = self._compact['boundary_register']
+        return decode_boundary_register(raw) if raw else None
 
     @property
     def manufacturer(self):
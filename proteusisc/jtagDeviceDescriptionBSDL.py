@@ -0,0 +1,277 @@
+"""Parse BSDL files into JTAG device descriptors without a network.
+
+BSDL (Boundary Scan Description Language) files are a subset of VHDL
+describing a device's JTAG interface. Only the entity name and the
+'attribute NAME of ENTITY : entity is VALUE;' statements are needed
+to build a JTAGDeviceDescription.
+
+The whole file is tokenized in a single pass of one regular
+expression that picks out the entity name and attribute statements
+while skipping comments and strings. String literals joined with '&'
+are concatenated, so the file's line layout does not matter.
+
+import_bsdl_dir parses a directory tree of BSDL files with a pool of
+processes and writes the resulting descriptors to the descriptor
+store.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+#Comments and strings are matched first so anything inside them is
+#skipped. Text outside of entity headers and attribute statements is
+#never looked at by Python code. Comments inside a value must run to
+#the end of their line, so a value has only one way to match; without
+#that, an unterminated attribute followed by comments backtracks
+#exponentially.
+_statement_re = re.compile(r'''
+    --[^\n]*
+  | "[^"]*"
+  | \bentity\s+(?P<entity>\w+)\s+is\b
+  | \battribute\s+(?P<attr>\w+)\s+of\s+[\w.]+\s*:\s*\w+\s+is\s+
+      (?P<value>(?:--[^\n]*(?![^\n])|"[^"]*"|[^;"-]|-(?!-))*);
+''', re.VERBOSE|re.IGNORECASE)
+_value_token_re = re.compile(r'--[^\n]*|"([^"]*)"|([^\s&"-]+|-)')
+
+#Whitespace inside attribute strings is only kept between two words.
+_string_word_space_re = re.compile(r'\w\s+\w')
+_string_punct_space_re = re.compile(r'(?<=[^\w\s])\s+|\s+(?=[^\w\s])')
+_string_space_re = re.compile(r'\s+')
+
+BSDL_EXTENSIONS = ('.bsd', '.bsdl', '.bsm')
+
+class BSDLParseError(Exception):
+    pass
+
+def _clean_string(value):
+    if not _string_word_space_re.search(value):
+        return "".join(value.split())
+    value = _string_punct_space_re.sub('', value)
+    return _string_space_re.sub(' ', value).strip(' ')
+
+def _decode_value(value):
+    """Convert the text of an attribute value to a python value."""
+    tokens = []
+    strings = []
+    raw = []
+    for m in _value_token_re.finditer(value):
+        string, other = m.groups()
+        if string is not None:
+            strings.append(string)
+            tokens.append(string)
+        elif other is not None:
+            raw.append(other)
+            tokens.append(other)
+
+    if strings and not raw:
+        return _clean_string("".join(strings))
+    if len(raw) == 1 and not strings:
+        v = raw[0]
+        if v.isdigit():
+            return int(v)
+        if v.lower() == 'true':
+            return True
+        if v.lower() == 'false':
+            return False
+    return " ".join(tokens)
+
+def tokenize_attributes(text):
+    """Collect the entity name and raw attribute values of a BSDL file.
+
+    Returns:
+        A tuple of the entity name (or None) and a dict of upper cased
+        attribute names to values. String values (concatenated with
+        '&') have their insignificant whitespace removed; numbers and
+        booleans are converted.
+    """
+    entity = None
+    attribs = {}
+    for m in _statement_re.finditer(text):
+        attr = m.group('attr')
+        if attr:
+            attribs[attr.upper()] = _decode_value(m.group('value'))
+        elif entity is None and m.group('entity'):
+            entity = m.group('entity')
+    return entity, attribs
+
+def process_attributes(attribs):
+    """Decode the raw BSDL attributes used to build a device descriptor.
+
+    Shared by every source of BSDL data.
+
+    Args:
+        attribs: A dict of upper cased attribute names to values, with string values stripped of insignificant whitespace.
+
+    Returns:
+        The attribs dict, with INSTRUCTION_OPCODE decoded into a dict,
+        REGISTER_ACCESS replaced with REGISTERS and
+        INSTRUCTION_TO_REGISTER dicts.
+    """
+    mandatory_attribs = ["INSTRUCTION_OPCODE", "IDCODE_REGISTER",
+                         "INSTRUCTION_LENGTH", "REGISTER_ACCESS",
+                         "BOUNDARY_LENGTH"]
+    for attr in mandatory_attribs:
+        if attr not in attribs:
+            raise BSDLParseError("Could not parse mandatory attribute "
+                                 "%s out of BSDL file."%attr)
+
+    # "BOUNDARY_REGISTER",
+    unused_attribs = {"PIN_MAP", "DESIGN_WARNING",
+                      "COMPONENT_CONFORMANCE", "USERCODE_REGISTER",
+                      "TAP_SCAN_CLOCK", "TAP_SCAN_IN", "TAP_SCAN_MODE",
+                      "TAP_SCAN_OUT"}
+    for attr in unused_attribs:
+        if attr in attribs:
+            del attribs[attr]
+
+    #INSTRUCTION_OPCODE PARSING
+    #Instructions with several opcodes use the first.
+    regs = dict()
+    for reg in attribs["INSTRUCTION_OPCODE"].split('),'):
+        name, opcodes = reg.split('(')
+        regs[name.upper()] = opcodes.rstrip(')').split(',')[0]
+    attribs['INSTRUCTION_OPCODE'] = regs
+
+    #IDCODE_REGISTER may list several revisions. Use the first.
+    attribs['IDCODE_REGISTER'] = attribs['IDCODE_REGISTER'].split(',')[0]
+
+    #BOUNDARY_REGISTER is left as a string. Large devices have
+    #thousands of cells that are rarely needed; descriptors decode it
+    #with decode_boundary_register on first access.
+
+    #REGISTER_ACCESS PARSING
+    v = attribs.pop("REGISTER_ACCESS")
+    v = v[:-1].split('),')
+    regs2ins = dict()
+    for reg_ins_map in v:
+        reg, ins = reg_ins_map.split('(')
+        reg = reg.upper()
+        ins_set = regs2ins.setdefault(reg, set())
+        for ins_tmp in ins.split(','):
+            ins_set.add(ins_tmp.upper())
+
+    tmp_reg2ins = {}
+    #NAME TO SIZE MAPPING
+    regs = {"BYPASS":1, "DEVICE_ID":32,
+            "BOUNDARY":attribs["BOUNDARY_LENGTH"]}
+    for reg in regs2ins.keys():
+        if '[' in reg:
+            name, l = reg.split('[')
+            l = int(l[:-1])
+        else:
+            name = reg
+            l = 1
+
+        if name not in ["BYPASS", "BOUNDARY", "DEVICE_ID"]:
+            regs[name] = l
+
+        tmp_reg2ins[name] = regs2ins[reg]
+
+    attribs['REGISTERS'] = regs
+
+    ins2reg = {}
+    for reg, ins_set in tmp_reg2ins.items():
+        for ins in ins_set:
+            ins2reg[ins] = reg
+
+    attribs["INSTRUCTION_TO_REGISTER"] = ins2reg
+    return attribs
+
+def decode_boundary_register(value):
+    """Decode a BOUNDARY_REGISTER attribute string.
+
+    Returns:
+        A dict of cell numbers to lists of the cell's fields.
+    """
+    cells = value[:-1].split('),')
+    cells = [cell.split('(') for cell in cells]
+    return {int(cell[0]):cell[1].split(',') for cell in cells}
+
+def parse_bsdl(text):
+    """Parse the text of a BSDL file.
+
+    Returns:
+        A tuple of the entity name and the processed attribute dict (see process_attributes).
+    """
+    entity, attribs = tokenize_attributes(text)
+    return entity, process_attributes(attribs)
+
+def bsdl_to_descriptor(text, name=None):
+    """Build a JTAGDeviceDescription from the text of a BSDL file.
+
+    Args:
+        text: The BSDL file contents.
+        name: The device name. Defaults to the BSDL entity name.
+    """
+    from .jtagDeviceDescription import JTAGDeviceDescription
+    entity, attribs = parse_bsdl(text)
+    return JTAGDeviceDescription(attribs['IDCODE_REGISTER'].upper(),
+                                 name or entity,
+                                 attribs['INSTRUCTION_LENGTH'],
+                                 attribs['INSTRUCTION_OPCODE'],
+                                 attribs['REGISTERS'],
+                                 attribs['INSTRUCTION_TO_REGISTER'],
+                                 attribs.get('BOUNDARY_REGISTER'))
+
+def _parse_bsdl_file(path):
+    """Parse one BSDL file (run in worker processes).
+
+    Returns:
+        A tuple of the path, and either the descriptor's dump or None,
+        and an error string or None.
+    """
+    try:
+        with open(path, 'r', errors='replace') as f:
+            text = f.read()
+        return path, bsdl_to_descriptor(text)._dump(), None
+    except Exception as e:
+        return path, None, "%s: %s"%(type(e).__name__, e)
+
+def find_bsdl_files(path, extensions=BSDL_EXTENSIONS):
+    """List the BSDL files in a directory tree, sorted by path."""
+    found = []
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.lower().endswith(extensions):
+                found.append(os.path.join(dirpath, filename))
+    return sorted(found)
+
+def import_bsdl_dir(path, *, store=None, processes=None,
+                    extensions=BSDL_EXTENSIONS):
+    """Parse every BSDL file in a directory tree into the descriptor store.
+
+    Args:
+        path: The directory to search for BSDL files.
+        store: The JTAGDescriptorStore to write to. Defaults to the one used by get_descriptor_for_idcode.
+        processes: The number of worker processes. Defaults to the number of CPUs. 1 parses in this process.
+        extensions: File name extensions of BSDL files.
+
+    Returns:
+        A tuple of the number of imported descriptors and a dict of
+        file paths that failed to parse to their error message.
+    """
+    if store is None:
+        from .jtagDeviceDescription import get_descriptor_store
+        store = get_descriptor_store()
+
+    files = find_bsdl_files(path, extensions)
+    if processes == 1 or len(files) < 2:
+        results = map(_parse_bsdl_file, files)
+        return _store_results(store, results)
+    with ProcessPoolExecutor(processes) as executor:
+        chunksize = max(1, len(files)//((processes or
+                                         os.cpu_count() or 1)*8))
+        results = executor.map(_parse_bsdl_file, files,
+                               chunksize=chunksize)
+        return _store_results(store, results)
+
+def _store_results(store, results):
+    failed = {}
+    descriptors = []
+    for filepath, descriptor, error in results:
+        if error:
+            failed[filepath] = error
+        else:
+            descriptors.append(descriptor)
+    store.add_many(descriptors)
+    return len(descriptors), failed
@@ -0,0 +1,175 @@
+"""Indexed on disk storage for JTAG device descriptors.
+
+Descriptors used to be cached as one JSON file per device, named
+after the device's IDCODE pattern (with X for bits that do not
+matter). Finding the descriptor for an IDCODE meant listing the
+directory and matching every file name against the IDCODE.
+
+The store keeps every descriptor in a SQLite database, indexed by the
+mask of the bits that matter in the descriptor's IDCODE pattern and
+the value of those bits. A lookup is one index search per distinct
+mask in the store (there are only a handful), most specific mask
+first, so the pattern with the fewest X bits wins, like before.
+
+Descriptors in the old JSON directory are imported automatically,
+and again whenever a file in it is added or modified.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS descriptors (
+    idcode TEXT PRIMARY KEY,
+    mask INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    xcount INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS descriptors_mask_value
+    ON descriptors (mask, value);
+CREATE TABLE IF NOT EXISTS migrated (
+    filename TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+def idcode_pattern_to_mask(pattern):
+    """Convert a 32 character IDCODE pattern of 0, 1, and X to a (mask, value) pair.
+
+    Args:
+        pattern: A string like 'XXXX0110110101001XXX000010010011'.
+
+    Returns:
+        A tuple of integers: the mask of bits that are not X, and the value of those bits.
+    """
+    pattern = pattern.upper()
+    if len(pattern) != 32 or set(pattern)-set('01X'):
+        raise ValueError("Invalid IDCODE pattern %r"%pattern)
+    mask = int(pattern.replace('0', '1').replace('X', '0'), 2)
+    value = int(pattern.replace('X', '0'), 2)
+    return mask, value
+
+class JTAGDescriptorStore(object):
+    """A persistent collection of device descriptors searchable by IDCODE.
+
+    Descriptors are stored in the dict format produced by
+    JTAGDeviceDescription._dump.
+
+    Args:
+        path: The path of the SQLite database file (created if missing).
+        legacy_dir: A directory of JSON descriptor files to import, or None.
+    """
+    def __init__(self, path, legacy_dir=None):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self._lock = threading.RLock()
+        self._masks = None
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+        if legacy_dir:
+            self.import_legacy_dir(legacy_dir)
+
+    def __repr__(self):
+        return "<JTAGDescriptorStore %s (%s descriptors)>"%\
+            (self.path, len(self)) # pragma: no cover
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM descriptors").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get_masks(self):
+        #Most specific (fewest X bits) first.
+        if self._masks is None:
+            self._masks = [mask for (mask,) in self._db.execute(
+                "SELECT DISTINCT mask FROM descriptors "
+                "ORDER BY xcount ASC, mask DESC")]
+        return self._masks
+
+    def find(self, idcode):
+        """Get the most specific descriptor that applies to an IDCODE.
+
+        Args:
+            idcode: The integer IDCODE read from a device.
+
+        Returns:
+            The descriptor dict, or None if no descriptor applies.
+        """
+        with self._lock:
+            for mask in self._get_masks():
+                row = self._db.execute(
+                    "SELECT data FROM descriptors "
+                    "WHERE mask=? AND value=?",
+                    (mask, idcode&mask)).fetchone()
+                if row:
+                    return json.loads(row[0])
+        return None
+
+    def add(self, descriptor, *, _commit=True):
+        """Store a descriptor dict, replacing any with the same IDCODE pattern."""
+        pattern = descriptor['idcode'].upper()
+        mask, value = idcode_pattern_to_mask(pattern)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO descriptors "
+                "(idcode, mask, value, xcount, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (pattern, mask, value, pattern.count('X'),
+                 json.dumps(descriptor)))
+            if _commit:
+                self._db.commit()
+            self._masks = None
+
+    def add_many(self, descriptors):
+        """Store several descriptor dicts in one transaction."""
+        with self._lock, self._db:
+            for descriptor in descriptors:
+                self.add(descriptor, _commit=False)
+
+    def import_legacy_dir(self, path):
+        """Import JSON descriptor files from a directory.
+
+        Files already imported are skipped unless they were modified
+        since.
+
+        Returns:
+            The number of files imported.
+        """
+        try:
+            filenames = os.listdir(path)
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            done = dict(self._db.execute(
+                "SELECT filename, mtime FROM migrated"))
+            imported = 0
+            with self._db:
+                for filename in filenames:
+                    if not filename.endswith(".json"):
+                        continue
+                    filepath = os.path.join(path, filename)
+                    mtime = os.stat(filepath).st_mtime
+                    if done.get(filename) == mtime:
+                        continue
+                    try:
+                        with open(filepath, 'r') as f:
+                            dat = json.load(f)
+                        self.add(dat, _commit=False)
+                    except (ValueError, KeyError, TypeError):
+                        continue #Not a descriptor file
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO migrated VALUES (?, ?)",
+                        (filename, mtime))
+                    imported += 1
+            return imported
@@ -1,15 +1,20 @@
-from . import jtagDeviceDescription
+from . import jtagDeviceDescription, calibration, chainTopology
 from .jtagStateMachine import JTAGStateMachine
 from .primitive import Primitive, DeviceTarget, Level1Primitive,\
     PrimitiveLv1Dispatcher
 from .primitive_defaults import RunInstruction,\
     TransitionTAP, RWDevDR, RWDevIR, RWDR, RWIR, RWReg, Sleep
-from .jtagDevice import JTAGDevice
+from .jtagDevice import JTAGDevice, BypassJTAGDevice
 from .command_queue import CommandQueue
 from .cabledriver import InaccessibleController
 from .errors import DevicePermissionDeniedError, JTAGAlreadyEnabledError,\
-    JTAGTooManyDevicesError
-from .jtagUtils import NULL_ID_CODES
+    JTAGTooManyDevicesError, ProteusISCError, CompiledProgramError
+from .jtagUtils import MAX_CHAIN_DEVICES, DISCOVERY_SCAN_BITS,\
+    parse_idcode_scan
+from .bittypes import ConstantBitarray
+from .utils import LRUCache
+from .svfWriter import SVFWriter
+from .compiledProgram import CompiledProgram, PreparedProgram
 
 class JTAGScanChain(object):
     """Represents a physical JTAG Scan Chain consisting of 0 or more devices controlled by a JTAG Controller.
@@ -52,7 +57,8 @@ class JTAGScanChain(object):
                  ignore_jtag_enabled=False, debug=False,
                  collect_compiler_artifacts=False,
                  collect_compiler_merge_artifacts=False,
-                 print_statistics=False):
+                 print_statistics=False, calibrate_costs=False,
+                 cache_topology=False, flush_policy=None):
         """Create a new JTAGScanChain to track and control a real chain.
 
         Args:
@@ -60,21 +66,26 @@ class JTAGScanChain(object):
             device_initializer: A callable that can map a (JTAGScanChain, Bitarray) to an instance of a JTAGDevice (Allows custom classes to be used).
             ignore_jtag_enabled: A boolean on if errors should be ignored when JTA is already enabled on the controller.
             debug: A boolean to enable extra debug printing.
+            calibrate_costs: A boolean on if the controller's primitive costs should be measured (or loaded from a previous measurement) when JTAG is enabled. See calibrate.
+            cache_topology: A boolean on if init_chain should store the devices it finds for this controller, and reuse them next time if one scan shows the chain is unchanged. See chainTopology.
+            flush_policy: A FlushPolicy with limits on the staged primitives, past which they are flushed automatically. See flushPolicy.
         """
         self._debug = debug
         self._collect_compiler_artifacts = collect_compiler_artifacts
         self._collect_compiler_merge_artifacts = collect_compiler_merge_artifacts
         self._print_statistics = print_statistics
-        self._fitted_lv1_prim_cache = {}
+        self._fitted_lv1_prim_cache = LRUCache(maxsize=256)
         self._devices = []
         self._hasinit = False
         self._sm = JTAGStateMachine()
         self._ignore_jtag_enabled = ignore_jtag_enabled
         self._desired_speed = None
+        self._calibrate_costs = calibrate_costs
+        self._calibrated = False
+        self._cache_topology = cache_topology
+        self._topology_descriptors = {}
 
         self.initialize_device_from_id = device_initializer
-        self.get_descriptor_for_idcode = \
-                    jtagDeviceDescription.get_descriptor_for_idcode
 
         if isinstance(controller, InaccessibleController):
             raise DevicePermissionDeniedError()
@@ -83,6 +94,9 @@ class JTAGScanChain(object):
         self._controller._scanchain = self
 
         self._command_queue = CommandQueue(self)
+        self._flush_policy = flush_policy
+        if flush_policy:
+            flush_policy.watch(self._command_queue)
 
         default_prims = {RunInstruction,
                          TransitionTAP, RWReg, RWDR, RWIR, Sleep,
@@ -108,6 +122,8 @@ class JTAGScanChain(object):
                 self._chain_primitives[prim._function_name] = prim
                 if issubclass(prim, Level1Primitive):
                     self._lv1_chain_primitives.append(prim)
+        #Uncalibrated classes, kept to recalibrate from.
+        self._lv1_base_primitives = list(self._lv1_chain_primitives)
 
         for func_name, prim in self._chain_primitives.items():
             if not self._gen_prim_adder(prim):
@@ -134,6 +150,13 @@ class JTAGScanChain(object):
             return True
         return False
 
+    def _replace_chain_primitive(self, cls_):
+        """Swap the registered chain primitive with cls_'s _function_name for cls_."""
+        if self._chain_primitives.get(cls_._function_name):
+            delattr(self, cls_._function_name)
+        self._chain_primitives[cls_._function_name] = cls_
+        self._gen_prim_adder(cls_)
+
     def __repr__(self):
         return "<JTAGScanChain>"
 
@@ -150,8 +173,18 @@ class JTAGScanChain(object):
             A TDOPromise for the return data from the staged prim.
             None if no return data from the prim.
         """
+        if isinstance(prim, DeviceTarget) and \
+           any(isinstance(dev, BypassJTAGDevice) for dev in self._devices):
+            raise ProteusISCError("Device primitives can not be used on "
+                "a chain with devices in BYPASS after reset (%s). Their "
+                "IR lengths are unknown."%", ".join(
+                    repr(dev) for dev in self._devices
+                    if isinstance(dev, BypassJTAGDevice)))
         self._command_queue.append(prim)
-        return prim.get_promise()
+        promise = prim.get_promise()
+        if self._flush_policy:
+            self._flush_policy.staged(prim)
+        return promise
 
     def get_prim(self, name):
         res = self._chain_primitives.get(name)
@@ -163,7 +196,8 @@ class JTAGScanChain(object):
         """Autodetect the devices attached to the Controller, and initialize a JTAGDevice for each.
 
         This is a required call before device specific Primitives can
-        be used.
+        be used. Devices that select BYPASS after reset instead of an
+        IDCODE are added as BypassJTAGDevice placeholders.
 
         """
         if not self._hasinit:
@@ -171,28 +205,183 @@ class JTAGScanChain(object):
             self._devices = []
 
             self.jtag_enable()
-            while True:
-                # pylint: disable=no-member
-                idcode = self.rw_dr(bitcount=32, read=True,
-                                    lastbit=False)()
-                if idcode in NULL_ID_CODES: break
-                dev = self.initialize_device_from_id(self, idcode)
+            idcodes = None
+            if self._cache_topology:
+                idcodes = self._verify_cached_topology()
+            verified = idcodes is not None
+            if not verified:
+                idcodes = self._scan_idcodes()
+            self.jtag_disable()
+
+            if idcodes is None or len(idcodes) > MAX_CHAIN_DEVICES:
+                raise JTAGTooManyDevicesError("This is an arbitrary "
+                    "limit to deal with breaking infinite loops. If "
+                    "you have more devices, please open a bug")
+
+            for idcode in idcodes:
+                if idcode is None:
+                    dev = BypassJTAGDevice(self)
+                else:
+                    dev = self.initialize_device_from_id(self, idcode)
                 if self._debug:
                     print(dev)
                 self._devices.append(dev)
-                if len(self._devices) >= 128:
-                    raise JTAGTooManyDevicesError("This is an arbitrary "
-                        "limit to deal with breaking infinite loops. If "
-                        "you have more devices, please open a bug")
-
-            self.jtag_disable()
 
             #The chain comes out last first. Reverse it to get order.
             self._devices.reverse()
 
-    def flush(self):
-        """Trigger the compilation, optimization, execution, and promise fullment of all primitives staged for execution."""
-        self._command_queue.flush()
+            #Devices without an IDCODE can not be verified with a scan.
+            if self._cache_topology and not verified and \
+               None not in idcodes:
+                chainTopology.save_topology(self._controller,
+                                            self._devices)
+
+    def _scan_idcodes(self):
+        """Read the IDCODEs of every device after a TAP reset.
+
+        The IDCODEs of a typical chain are read in one scan, shifting
+        in 1s so the end of the chain can be found. Longer chains are
+        read with one more scan.
+
+        Returns:
+            The list returned by parse_idcode_scan.
+        """
+        bits = None
+        for bitcount in (DISCOVERY_SCAN_BITS,
+                         (MAX_CHAIN_DEVICES+1)*32-DISCOVERY_SCAN_BITS):
+            # pylint: disable=no-member
+            newbits = self.rw_dr(data=ConstantBitarray(True, bitcount),
+                                 read=True, lastbit=False)()
+            bits = newbits if bits is None else newbits+bits
+            idcodes = parse_idcode_scan(bits)
+            if idcodes is not None:
+                return idcodes
+        return None
+
+    def _verify_cached_topology(self):
+        """Check the chain against the devices stored for the controller.
+
+        Returns:
+            The list of IDCODE bitarrays (like parse_idcode_scan) if
+            one scan of the chain read exactly the stored IDCODEs,
+            otherwise None (after resetting the TAP so the chain can
+            be discovered).
+        """
+        topology = chainTopology.load_topology(self._controller)
+        if not topology:
+            return None
+        expected = chainTopology.expected_idcode_scan(
+            [idcode for idcode, _ in topology])
+        # pylint: disable=no-member
+        bits = self.rw_dr(data=ConstantBitarray(True, len(expected)),
+                          read=True, lastbit=False)()
+        if bits != expected:
+            self._sm.reset()
+            return None
+
+        self._topology_descriptors = {idcode: descr for idcode, descr
+                                      in topology if descr}
+        return [expected[i:i+32]
+                for i in range(len(expected)-32, 0, -32)]
+
+    def get_descriptor_for_idcode(self, idcode):
+        """Get the JTAGDeviceDescription for a device's IDCODE.
+
+        Descriptors of a chain verified by init_chain (see
+        cache_topology) are used as is. Others are looked up with
+        jtagDeviceDescription.get_descriptor_for_idcode.
+        """
+        descr = self._topology_descriptors.get(idcode)
+        if descr is None:
+            descr = jtagDeviceDescription.get_descriptor_for_idcode(idcode)
+        return descr
+
+    def flush(self, until=None):
+        """Trigger the compilation, optimization, execution, and promise fullment of all primitives staged for execution.
+
+        Args:
+            until: A TDOPromise. If given, only the primitives needed to fulfill it are run (see CommandQueue.flush).
+        """
+        self._command_queue.flush(until=until)
+
+    def export_svf(self, dest):
+        """Compile the staged primitives and write them out as SVF instead of executing them.
+
+        No controller transfers are made, so JTAG does not need to be
+        enabled. See svfWriter for how the stream maps onto SVF.
+
+        Args:
+            dest: A path to write a complete SVF file to, or an SVFWriter to add to (for exporting in several batches).
+        """
+        if isinstance(dest, SVFWriter):
+            self._command_queue.export(dest)
+            return
+        with open(dest, 'w') as f:
+            writer = SVFWriter(f, state=self._sm.state)
+            self._command_queue.export(writer)
+            writer.finish()
+        self._sm.state = writer.state
+
+    def compile_program(self):
+        """Compile the staged primitives into a CompiledProgram instead of executing them.
+
+        The program can be saved and run later (on this chain, or any
+        chain with the same devices and controller type) without
+        compiling again.
+
+        Returns:
+            A CompiledProgram.
+        """
+        return CompiledProgram.compile(self)
+
+    def prepare(self, build, **holes):
+        """Compile a program with holes in its data once, to run many times with different data.
+
+        Args:
+            build: A callable taking this chain and a bitarray per hole (as keyword arguments) that stages primitives using the holes as data.
+            **holes: The length in bits of each hole, by name.
+
+        Returns:
+            A PreparedProgram. Call it with a bitarray for each hole to run it.
+        """
+        return PreparedProgram(self, build, holes)
+
+    def poll(self, build, *, value, mask=None, timeout=None, interval=0):
+        """Read a register over and over until it matches value, without compiling each try.
+
+        The primitives staged by build are compiled once, from and
+        back to a stable state (the current state if it is RTI or a
+        pause state, otherwise RTI), and the program is rerun until
+        the promise build returns reads value in the bits set in mask.
+        Anything already staged is flushed first.
+
+        Args:
+            build: A callable taking this chain that stages primitives and returns the TDOPromise to check.
+            value: A bitarray the read must equal, after masking.
+            mask: A bitarray of the bits to compare. All bits if None.
+            timeout: Seconds to try for before raising PollTimeoutError. Forever if None.
+            interval: Seconds to wait between tries.
+
+        Returns:
+            A (read value, number of tries) tuple.
+        """
+        state = self._sm.state
+        if state not in ('RTI', 'PAUSEDR', 'PAUSEIR'):
+            state = 'RTI'
+        self.transition_tap(state)
+        self.flush()
+        promise = build(self)
+        self.transition_tap(state)
+        program, roots = CompiledProgram._compile(self)
+        while promise is not None and promise._parent is not None:
+            promise = promise._parent
+        index = next((i for i, root in enumerate(roots)
+                      if root is promise), None)
+        if index is None:
+            raise CompiledProgramError(
+                "build must return a promise read by what it stages")
+        return program.poll(self, index, value=value, mask=mask,
+                            timeout=timeout, interval=interval)
 
     def jtag_disable(self):
         #self.flush()
@@ -211,6 +400,36 @@ class JTAGScanChain(object):
         if self._desired_speed:
             #Maybe the speed should be set before commands are executed
             self._controller.speed = self._desired_speed
+        if self._calibrate_costs and not self._calibrated:
+            self.calibrate()
+
+    def calibrate(self, *, recalibrate=False, clock=None):
+        """Fit the Level1Primitive cost model to this chain's controller.
+
+        Costs stored from an earlier calibration of the controller are
+        used if available. Otherwise every Level1Primitive of the
+        controller is timed (which requires JTAG to be enabled, and
+        leaves the TAP in Test-Logic-Reset), and the results are
+        stored for next time.
+
+        Args:
+            recalibrate: A boolean to force measuring the costs again.
+            clock: A callable returning the time in seconds to time the transfers with.
+
+        Returns:
+            The dict of costs per Level1Primitive class name.
+        """
+        costs = None
+        if not recalibrate:
+            costs = calibration.load_lv1_costs(self._controller)
+        if costs is None:
+            self.flush()
+            costs = calibration.measure_lv1_costs(self, clock=clock)
+            self._sm.reset()
+            calibration.save_lv1_costs(self._controller, costs)
+        calibration.apply_lv1_costs(self, costs)
+        self._calibrated = True
+        return costs
 
     @property
     def speed(self):
@@ -223,10 +442,7 @@ class JTAGScanChain(object):
         self._controller.speed = value
 
     def _tap_transition_driver_trigger(self, bits):
-        statetrans = [self._sm.state]
-        for bit in reversed(bits):
-            self._sm.transition_bit(bit)
-            statetrans.append(self._sm.state)
+        self._sm.apply_tms(bits)
 
     def get_compatible_lv1_prims(self, reqef):#, bitcount):
         styles = {0:'\033[92m', #GREEN
@@ -235,6 +451,8 @@ class JTAGScanChain(object):
         possible_prims = []
         #prim_mismatach_from_bitcount = False
         for prim in self._lv1_chain_primitives:
+            if not self._controller._lv1_primitive_usable(prim):
+                continue
             efstyledstr = ''
             ef = prim.get_effect()
 
@@ -262,24 +480,50 @@ class JTAGScanChain(object):
             #if prim_mismatach_from_bitcount:
             #    raise Exception('Unable to match Primative to lower '
             #                    'level Primative. Bitcount too large.')
-            raise Exception('Unable to match Primative to lower '
-                            'level Primative. Primitives Incompatible.')
+            raise ProteusISCError('Unable to match Primative to lower '
+                                  'level Primative. Primitives '
+                                  'Incompatible with %s.'%(reqef,))
 
         return possible_prims
 
-    def get_best_lv1_prim(self, reqef, bitcount):
-        possible_prims = self.get_compatible_lv1_prims(reqef)#, bitcount)
-        if not possible_prims:
-            raise Exception("Data too long to send using this "
-                            "controller. Splitting data not implemented.")
-        best_prim = possible_prims[0]
-        for prim in possible_prims[1:]:
-            if sum((e.score for e in prim.get_effect())) <\
-               sum((e.score for e in best_prim.get_effect())):
-                best_prim = prim
+    def plan_lv1_prims(self, reqef, bitcount):
+        """Pick the Level1Primitive classes used to send bitcount bits.
+
+        Requests too long for one primitive are sent as full chunks of
+        a 'bulk' primitive class, with the remaining bits sent by a
+        'tail' class. Every (bulk, tail) pair of compatible primitives
+        is scored with the primitives' cost model, and the cheapest
+        pair wins. Ties go to the primitive with the lowest
+        Requirement score.
+
+        Args:
+            reqef: A tuple of the TMS, TDI, TDO Requirements.
+            bitcount: An integer number of bits to send.
+
+        Returns:
+            A tuple of the (bulk, tail) Level1Primitive classes.
+        """
+        possible_prims = sorted(
+            self.get_compatible_lv1_prims(reqef),
+            key=lambda prim: sum((e.score for e in prim.get_effect())))
+
+        best_plan, best_score = None, None
+        for bulk in possible_prims:
+            full, rem = divmod(bitcount, bulk._max_chunk_bits(reqef))
+            bulkscore = bulk._calc_chunked_score(bitcount-rem, reqef)
+            for tail in (possible_prims if rem else (bulk,)):
+                score = bulkscore + (tail._calc_chunked_score(rem, reqef)
+                                     if rem else 0)
+                if best_score is None or score < best_score:
+                    #Without full chunks, the tail prim sends everything.
+                    best_plan = (bulk if full else tail, tail)
+                    best_score = score
         if self._debug:
-            print("PICKED", best_prim, "\n")
-        return best_prim
+            print("PICKED", best_plan, best_score, "\n")
+        return best_plan
+
+    def get_best_lv1_prim(self, reqef, bitcount):
+        return self.plan_lv1_prims(reqef, bitcount)[0]
 
     def get_fitted_lv1_prim(self, reqef, bitcount):
         """
@@ -303,10 +547,13 @@ class JTAGScanChain(object):
         m = will require reconfiguring argument and using multiple of prim
         M = Requires using multiple of several prims to satisfy requirement
         """
-        res = self._fitted_lv1_prim_cache.get(reqef)
+        #The best tail depends on the exact remainder, so plans are
+        #only shared by requests for the same number of bits.
+        key = (reqef, bitcount)
+        res = self._fitted_lv1_prim_cache.get(key)
         if res:
             return res
-        prim = self.get_best_lv1_prim(reqef, bitcount)
-        dispatcher = PrimitiveLv1Dispatcher(self, prim, reqef)
-        self._fitted_lv1_prim_cache[reqef] = dispatcher
+        bulk, tail = self.plan_lv1_prims(reqef, bitcount)
+        dispatcher = PrimitiveLv1Dispatcher(self, bulk, reqef, tail)
+        self._fitted_lv1_prim_cache.put(key, dispatcher)
         return dispatcher
@@ -1,4 +1,6 @@
-from .bittypes import bitarray
+from collections import deque
+
+from .bittypes import bitarray, ConstantBitarray
 
 class JTAGStateMachine(object):
     """A software implementation of the JTAG TAP state machine.
@@ -10,6 +12,12 @@ class JTAGStateMachine(object):
 
     This class is also used in JTAG Device simulators for testing.
 
+    States are tracked as small integers (indexes into state_names).
+    The next state for every state and TMS bit, the next state for
+    every state and byte of TMS bits, and the shortest TMS sequence
+    between every pair of states are all calculated once at import
+    (see _build_tables).
+
     """
     states = {
         "_PRE5": ["_PRE5", "_PRE4"],
@@ -40,49 +48,60 @@ class JTAGStateMachine(object):
         if state:
             self.state = state
 
-
     def transition_bit(self, bit):
-        choice = self.states.get(self._statestr, None)
-        if choice is not None:
-            self._statestr = choice[bit]
+        self._state = self._next[(self._state<<1)|bit]
+
+    def apply_tms(self, bits):
+        """Advance the state machine over a sequence of TMS bits.
+
+        Args:
+            bits: A bitarray (or other bit type) of TMS bits. The bits read from right to left.
+        """
+        count = len(bits)
+        if not count:
+            return
+        if isinstance(bits, ConstantBitarray):
+            #Constant input always settles in a state that loops to
+            #itself within a few bits.
+            nextstate = self._next
+            state = self._state
+            bit = int(bits._val)
+            for _ in range(count):
+                newstate = nextstate[(state<<1)|bit]
+                if newstate == state:
+                    break
+                state = newstate
+            self._state = state
+            return
+
+        data = bits.tobytes()
+        state = self._state
+        #The right most bits are in the high bits of the last byte,
+        #followed by pad bits.
+        pad = -count%8
+        if pad:
+            nextstate = self._next
+            tail = data[-1]>>pad
+            for _ in range(8-pad):
+                state = nextstate[(state<<1)|(tail&1)]
+                tail >>= 1
+            data = data[:-1]
+        lut = self._tms_byte_lut
+        for byte in reversed(data):
+            state = lut[(state<<8)|byte]
+        self._state = state
 
     @property
     def state(self):
-        return self._statestr
+        return self.state_names[self._state]
 
     @state.setter
     def state(self, value):
-        if value in self.states:
-            self._statestr = value
-        else:
+        index = self._state_index.get(value)
+        if index is None:
             raise ValueError("%s is not a valid state for this state machine"%value)
+        self._state = index
 
-    @classmethod
-    def _find_shortest_path(cls, start, end, path=None):
-        path = (path or []) + [start]
-        if start == end:
-            return path
-        if start not in cls.states:
-            return None # pragma: no cover
-        shortest = None
-        for node in cls.states[start]:
-            if node not in path:
-                newpath = cls._find_shortest_path(node, end, path)
-                if newpath:
-                    if not shortest or len(newpath) < len(shortest):
-                        shortest = newpath
-        return shortest
-
-    @classmethod
-    def _get_steps_from_nodes_path(cls, path):
-        steps = []
-        last_node = path[0]
-        for node in path[1:]:
-            steps.append(cls.states.get(last_node).index(node))
-            last_node = node
-        return bitarray(steps)
-
-    _lookup_cache = {}
     def calc_transition_to_state(self, newstate):
         """Given a target state, generate the sequence of transitions that would move this state machine instance to that target state.
 
@@ -92,29 +111,62 @@ class JTAGStateMachine(object):
         Returns:
             A bitarray containing the bits that would transition this
             state machine to the target state. The bits read from right
-            to left. For efficiency, this retulting bitarray is cached.
+            to left. For efficiency, this retulting bitarray is shared.
             Do not edit this bitarray, or it will cause undefined
             behavior.
         """
-        cached_val = JTAGStateMachine._lookup_cache.\
-                     get((self.state, newstate))
-        if cached_val:
-            return cached_val
-
-        if newstate not in self.states:
+        target = self._state_index.get(newstate)
+        if target is None:
             raise ValueError("%s is not a valid state for this state "
                              "machine"%newstate)
-
-        path = self._find_shortest_path(self._statestr, newstate)
-        if not path:
+        res = self._paths[self._state][target]
+        if res is None:
             raise ValueError("No path to the requested state.")
-        res = self._get_steps_from_nodes_path(path)
-        res.reverse()
-        JTAGStateMachine._lookup_cache[(self.state, newstate)] = res
         return res
 
     def reset(self):
-        self._statestr = "_PRE5"
+        self._state = self._state_index["_PRE5"]
+
+    @classmethod
+    def _build_tables(cls):
+        """Calculate the lookup tables used by every instance."""
+        cls.state_names = tuple(sorted(cls.states))
+        cls._state_index = {name: i for i, name in
+                            enumerate(cls.state_names)}
+        statecount = len(cls.state_names)
+
+        nextstate = []
+        for name in cls.state_names:
+            nextstate += [cls._state_index[n] for n in cls.states[name]]
+        cls._next = nextstate
+
+        lut = []
+        for state in range(statecount):
+            for byte in range(256):
+                s = state
+                for bit in range(8):
+                    s = nextstate[(s<<1)|((byte>>bit)&1)]
+                lut.append(s)
+        cls._tms_byte_lut = lut
+
+        #Breadth first search from every state, trying TMS=0 first,
+        #finds the shortest path to each state (preferring 0s first
+        #when there are several).
+        cls._paths = []
+        for start in range(statecount):
+            paths = [None]*statecount
+            paths[start] = []
+            queue = deque([start])
+            while queue:
+                state = queue.popleft()
+                for bit in (0, 1):
+                    newstate = nextstate[(state<<1)|bit]
+                    if paths[newstate] is None:
+                        paths[newstate] = paths[state]+[bit]
+                        queue.append(newstate)
+            cls._paths.append([
+                None if path is None else bitarray(path[::-1])
+                for path in paths])
 
     def __repr__(self):
         return "<%s (State: %s)>"%\
@@ -123,4 +175,6 @@ class JTAGStateMachine(object):
     def __eq__(self, other):
         if not isinstance(other, JTAGStateMachine):
             return NotImplemented
-        return self.state == other.state
+        return self._state == other._state
+
+JTAGStateMachine._build_tables()
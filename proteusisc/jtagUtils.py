@@ -6,6 +6,12 @@ from bitarray import bitarray
 NULL_ID_CODES = [bitarray('1'*32),
                  bitarray('0'*32)]
 
+#Arbitrary limit on devices in a chain (catches broken chains).
+MAX_CHAIN_DEVICES = 128
+#Bits read by the first chain discovery scan. Enough for 16 devices
+#and the end of the chain.
+DISCOVERY_SCAN_BITS = 17*32
+
 manufacturer_lookup = {
     1: 'AMD', 2: 'AMI', 4: 'Fujitsu', 7: 'Hitachi', 8: 'Inmos',
     11: 'Intersil', 13: 'Mostek', 14: 'Freescale (Motorola)',
@@ -110,3 +116,36 @@ def build_byte_align_buff(bits):
         rdiff = bitarray(8-bitmod)
         rdiff.setall(False)
     return rdiff+bits
+
+def parse_idcode_scan(bits):
+    """Split the data register bits read after a TAP reset into devices.
+
+    After a reset, every device loads its 32 bit IDCODE (which always
+    has its LSB set) into its data register, or selects the 1 bit
+    BYPASS register (which captures a 0) if it has no IDCODE. The
+    first bit read out of the chain (the right most bit of bits) is
+    therefore either the start of an IDCODE or a BYPASS device. The
+    end of the chain is found when 32 bits are all 1s (the value
+    shifted into TDI) or all 0s (nothing driving TDO).
+
+    Args:
+        bits: A bitarray of bits read from the chain, at least 32 longer than the total data register length of the chain.
+
+    Returns:
+        A list of 32 bit bitarrays of IDCODEs (or None for BYPASS
+        devices) in the order they were read (the device closest to
+        TDO first). None if the end of the chain was not found.
+    """
+    devices = []
+    end = len(bits)
+    while end >= 32:
+        idcode = bits[end-32:end]
+        if idcode in NULL_ID_CODES:
+            return devices
+        if idcode[-1]:
+            devices.append(idcode)
+            end -= 32
+        else:
+            devices.append(None)
+            end -= 1
+    return None
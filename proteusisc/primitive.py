@@ -1,6 +1,5 @@
 from abc import ABCMeta, abstractmethod
 import collections
-from functools import partial
 import operator
 import types
 
@@ -195,6 +194,7 @@ class Level1Primitive(Primitive):
     _COST_READ_MSG = 10
     _COST_READ_BIT_GROUP = 1
     _COST_PAYLOAD_BIT_GROUP = 1
+    _COST_CLOCK_BIT = 0
     _BIT_READ_GROUP_SIZE = 1
     _BIT_PAYLOAD_GROUP_SIZE = 1
 
@@ -226,6 +226,7 @@ class Level1Primitive(Primitive):
         readbitreqcost = tdosendcount*SEND_COEFF
         writetmscost = tmssendcount*SEND_COEFF
         writetdicost =  tdisendcount*SEND_COEFF
+        clockcost = count*cls._COST_CLOCK_BIT
 
         if debug:
             print("Base cost        ", cls._COST_PRIM)
@@ -234,9 +235,11 @@ class Level1Primitive(Primitive):
             print("Read Bit Cost    ", readbitcost)
             print("Write tms Cost   ", writetmscost)
             print("Write tdi Cost   ", writetdicost)
+            print("Clock Cost       ", clockcost)
 
         return cls._COST_PRIM + readenablecost +\
-            readbitreqcost + readbitcost + writetmscost + writetdicost
+            readbitreqcost + readbitcost + writetmscost + writetdicost +\
+            clockcost
 
 
     @property
@@ -263,16 +266,51 @@ class Level1Primitive(Primitive):
             (self.__class__.__name__, tms, tdi, tdo)
 
     @classmethod
-    def can_prim_handle_bitcount(cls, reqef, bitcount):
-        #Does not support arbitrary TDO with recv bits < send bits
+    def can_prim_handle_bitcount(cls, reqef, bitcount, tdo_count=None):
+        """Check if one instance of this primitive can send bitcount bits.
+
+        With ARBITRARY TDO, only the bits actually read count against
+        _max_recv_bits. If tdo_count is not provided, every bit is
+        assumed to be read.
+        """
         tdoef = reqef[2]
-        if tdoef == ARBITRARY and cls._max_send_bits > cls._max_recv_bits:
-            raise NotImplementedError("Does not yet support ARBITRARY "
-                                      "TDO with mismatch mas recv and "
-                                      "send.")
-        return bitcount <= cls._max_send_bits and\
-            (bitcount <= cls._max_recv_bits or\
-             tdoef in (CONSTANTZERO, ZERO, NOCARE))
+        if bitcount > cls._max_send_bits:
+            return False
+        if tdoef in (CONSTANTZERO, ZERO, NOCARE):
+            return True
+        if tdoef == ARBITRARY and tdo_count is not None:
+            return tdo_count <= cls._max_recv_bits
+        return bitcount <= cls._max_recv_bits
+
+    @classmethod
+    def _max_chunk_bits(cls, reqef):
+        """Get the most bits one instance can send for the reqef.
+
+        Used when splitting data between several instances, where the
+        number of bits read from each piece is not known, so reading
+        with ARBITRARY TDO is limited by _max_recv_bits.
+        """
+        maxbits = cls._max_send_bits
+        if cls._max_recv_bits < maxbits and\
+             reqef[2] not in (CONSTANTZERO, ZERO, NOCARE):
+            maxbits = cls._max_recv_bits
+        return maxbits
+
+    @classmethod
+    def _calc_chunked_score(cls, count, reqef):
+        """Estimate the cost of sending count bits split into instances of this primitive."""
+        maxbits = cls._max_chunk_bits(reqef)
+        tdoef = reqef[2]
+        reads = tdoef.isarbitrary or \
+                (not tdoef.isnocare and bool(tdoef.value))
+        full, rem = divmod(count, maxbits)
+        score = 0
+        if full:
+            score += full*cls._calc_score(maxbits, reqef,
+                                          maxbits if reads else 0)
+        if rem:
+            score += cls._calc_score(rem, reqef, rem if reads else 0)
+        return score
 
     def merge(self, target):
         if not isinstance(target, Level1Primitive):
@@ -298,7 +336,8 @@ class Level1Primitive(Primitive):
         best_score = self.score + target.score
         tdo_count = target.tdo.count(True)+self.tdo.count(True)
         for prim_cls in possible_prims:
-            if not prim_cls.can_prim_handle_bitcount(reqef, newcount):
+            if not prim_cls.can_prim_handle_bitcount(reqef, newcount,
+                                                     tdo_count):
                 continue
             prim_score = prim_cls._calc_score(newcount, reqef, tdo_count,
                                               debug=self.debug)
@@ -420,22 +459,34 @@ class Level1Primitive(Primitive):
 
 
 class PrimitiveLv1Dispatcher(object):
-    def __init__(self, chain, primcls, reqef):
+    """Creates Level1Primitives for a data request, splitting it as needed.
+
+    Data too long for one primitive is sent as full chunks of the bulk
+    primitive class, followed by the remaining bits sent with the tail
+    primitive class (which may itself need several chunks). Chunks are
+    taken from the right of the data, so they run in order.
+    """
+    def __init__(self, chain, primcls, reqef, tailcls=None):
         self._chain = chain
         self._primcls = primcls
+        self._tailcls = tailcls or primcls
         self._reqef = reqef
 
+    def plan_chunks(self, count):
+        """Get the (primitive class, bitcount) chunks in execution order."""
+        bulkmax = self._primcls._max_chunk_bits(self._reqef)
+        full, rem = divmod(count, bulkmax)
+        chunks = [(self._primcls, bulkmax)]*full
+        if rem:
+            tailmax = self._tailcls._max_chunk_bits(self._reqef)
+            tailfull, tailrem = divmod(rem, tailmax)
+            chunks += [(self._tailcls, tailmax)]*tailfull
+            if tailrem:
+                chunks.append((self._tailcls, tailrem))
+        return chunks
+
     def __call__(self, *args, count=None, tms=None, tdi=None, tdo=None,
                  **kwargs):
-        maxbits = self._primcls._max_send_bits
-        if self._primcls._max_recv_bits < maxbits and\
-             self._reqef[2] not in (CONSTANTZERO, ZERO, NOCARE):
-            maxbits = self._primcls._max_recv_bits
-
-        primgen = partial(self._primcls, _chain=self._chain,
-                       reqef=self._reqef)
-
-
         if isinstance(tms, collections.Iterable):
             count = count or len(tms)
         if isinstance(tdi, collections.Iterable):
@@ -443,10 +494,14 @@ class PrimitiveLv1Dispatcher(object):
         if isinstance(tdo, collections.Iterable):
             count = count or len(tdo)
 
+        chunks = self.plan_chunks(count)
+
         #No need to split up data
-        if count <= maxbits:
-            return [primgen(*args, count=count,
-                            tms=tms, tdi=tdi, tdo=tdo, **kwargs)]
+        if len(chunks) == 1:
+            primcls, _ = chunks[0]
+            return [primcls(*args, count=count, tms=tms, tdi=tdi, tdo=tdo,
+                            _chain=self._chain, reqef=self._reqef,
+                            **kwargs)]
 
         #Have to split up data
         istms, istdi, istdo = True, True, True
@@ -465,43 +520,39 @@ class PrimitiveLv1Dispatcher(object):
             CompositeBitarray(tdi) if isinstance(tdi, bitarray) else tdi,\
             CompositeBitarray(tdo) if isinstance(tdo, bitarray) else tdo
 
-        kwargs['count'] = maxbits
         _promise = kwargs.pop("_promise", None)
-        orig_promise = _promise
 
-        #print("ORIGINAL PROMISE", _promise)
+        #Carve every chunk off the left of the data in a single pass
+        #(each split starts where the last one stopped), then put the
+        #chunks back in execution order.
+        lengths = [chunkbits for _, chunkbits in reversed(chunks)]
+        tmss = self._carve(tms, lengths) if istms else None
+        tdis = self._carve(tdi, lengths) if istdi else None
+        tdos = self._carve(tdo, lengths) if istdo else None
+        promises = _promise.split_chunks(lengths)[::-1] \
+                   if _promise else None
+
         primitives = []
-        for i in range(count//maxbits):
+        for i, (primcls, chunkbits) in enumerate(chunks):
+            kwargs['count'] = chunkbits
             if istms:
-                tms, kwargs['tms'] = tms.split(len(tms)-maxbits)
+                kwargs['tms'] = tmss[-1-i]
             if istdi:
-                tdi, kwargs['tdi'] = tdi.split(len(tdi)-maxbits)
+                kwargs['tdi'] = tdis[-1-i]
             if istdo:
-                tdo, kwargs['tdo'] = tdo.split(len(tdo)-maxbits)
-            if _promise:
-                #print("SPLITTING", _promise, "INTO")
-                _promise, kwargs['_promise']\
-                    = _promise.split(len(_promise)-maxbits)
-                #print("  ", _promise)
-                #print("  ", kwargs['_promise'])
-            #print(kwargs)
-            #print()
-            p = primgen(*args, **kwargs)
-            primitives.append(p)
-
-        if count%maxbits:
-            kwargs['count'] = count%maxbits
-            if istms:
-                kwargs['tms']= tms
-            if istdi:
-                kwargs['tdi'] = tdi
-            if istdo:
-                kwargs['tdo'] = tdo
-            if _promise:
-                kwargs['_promise'] = _promise
-
-            #print(kwargs)
-            p = primgen(*args, **kwargs)
-            primitives.append(p)
-
+                kwargs['tdo'] = tdos[-1-i]
+            if promises:
+                kwargs['_promise'] = promises[i]
+            primitives.append(primcls(*args, _chain=self._chain,
+                                      reqef=self._reqef, **kwargs))
         return primitives
+
+    @staticmethod
+    def _carve(data, lengths):
+        """Split data into pieces of the given lengths, left to right."""
+        pieces = []
+        for length in lengths[:-1]:
+            piece, data = data.split(length)
+            pieces.append(piece)
+        pieces.append(data)
+        return pieces
@@ -53,13 +53,25 @@ class RunInstruction(Level3Primitive, DeviceTarget):
         transition_tap = chain.get_prim('transition_tap')
         sleep = chain.get_prim('sleep')
 
-        seq = FrameSequence(chain,
-            Frame(chain, *(
-                rw_dev_ir(dev=d, _synthetic=frame[i]._synthetic,
-                    _chain=chain,
-                    data=bitarray(d._desc._instructions[frame[i].insname])
-                ) for i, d in enumerate(devs))))
-        sm.state = "UPDATEIR"
+        #The instruction each device holds at this point of the
+        #compile (None if unknown). See CommandQueue.
+        shadow = getattr(chain._command_queue, '_ir_shadow', None)
+        if shadow is not None and not sm.state.startswith('_PRE') and \
+           all(shadow[i] == p.insname and
+               (p._synthetic or not d.always_load_instruction)
+               for i, (p, d) in enumerate(zip(frame, devs))):
+            seq = FrameSequence(chain)
+        else:
+            seq = FrameSequence(chain,
+                Frame(chain, *(
+                    rw_dev_ir(dev=d, _synthetic=frame[i]._synthetic,
+                        _chain=chain,
+                        data=bitarray(
+                            d._desc._instructions[frame[i].insname])
+                    ) for i, d in enumerate(devs))))
+            sm.state = "UPDATEIR"
+            if shadow is not None:
+                shadow[:] = [p.insname for p in frame]
 
         if frame._valid_prim.data:
             seq.append(Frame(chain,
@@ -94,6 +106,10 @@ class RunInstruction(Level3Primitive, DeviceTarget):
                         _chain=chain)
                           for i, d in enumerate(devs))))
             sm.state = "UPDATEIR"
+            if shadow is not None:
+                status = seq[-1]
+                shadow[:] = [instruction_named(d, status[i].data)
+                             for i, d in enumerate(devs)]
 
         return seq
 
@@ -169,6 +185,16 @@ class RunInstruction(Level3Primitive, DeviceTarget):
             self._promise = promise
         return self._promise
 
+def instruction_named(dev, data):
+    """Get the name of the instruction with code data on dev, or None."""
+    if data is None or dev._desc is None:
+        return None
+    code = bitarray([bool(bit) for bit in data])
+    for name, inscode in dev._desc._instructions.items():
+        if inscode == code:
+            return name
+    return None
+
 ################# END LV3 Primatimes (Dev) #################
 
 ################### LV2 Primatimes (Dev) ###################
@@ -288,6 +314,9 @@ class RWDR(Level2Primitive, DataRW):
                         _chain=self._chain, lastbit=target.lastbit)
         return None
 
+    def apply_tap_effect(self, sm):
+        sm.state = "UPDATEDR" if self.lastbit else "SHIFTDR"
+
     def expand(self, chain, sm):
         prims = []
         if sm.state != "SHIFTDR":
@@ -330,6 +359,9 @@ class RWIR(Level2Primitive, DataRW):
                         _chain=self._chain, lastbit=target.lastbit)
         return None
 
+    def apply_tap_effect(self, sm):
+        sm.state = "UPDATEIR" if self.lastbit else "SHIFTIR"
+
     def expand(self, chain, sm):
         prims = []
 
@@ -363,6 +395,10 @@ class RWReg(Level2Primitive, DataRW, ExpandRequiresTAP):
     def merge(self, target):
         return None
 
+    def apply_tap_effect(self, sm):
+        if self.lastbit:
+            sm.transition_bit(True)
+
     def expand(self, chain, sm):
         if sm.state not in {"SHIFTIR", "SHIFTDR"}:
             raise ProteusISCError("Invalid State. RWReg Requires state "
@@ -444,7 +480,8 @@ class TransitionTAP(Level2Primitive, ExpandRequiresTAP):
                     return target
                 elif target.loop:
                     return TransitionTAP(self.state,
-                                         self.loop+target.loop)
+                                         loop=self.loop+target.loop,
+                                         _chain=self._chain)
                 else:
                     return self
         return None
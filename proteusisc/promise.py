@@ -34,12 +34,10 @@ class TDOPromise(object):
 
     If a promise does not yet have a value, it will automatically
     trigger a flush operation on the associated JTAGScanChain, which
-    will compile and execute all pending primitives and distribute the
-    resulting data to the promises.
-
-    Reading the value of any promise from the currently unexecuted set
-    of primitives will automatically run all pending primitives, and
-    fulfill all their promises.
+    will compile and execute the pending primitives up to (and
+    including) the one the promise reads from, and distribute the
+    resulting data to their promises. Primitives staged after it stay
+    queued, so they can still be combined with later primitives.
 
     Manually flushing the scan chain will automatically fulfill all
     pending promises.
@@ -61,6 +59,7 @@ class TDOPromise(object):
         self._value = None
         self._parent = _parent
         self._components = []
+        self._pending = 0
         self._bitstart = bitstart
         self._bitlength = bitlength
         self._bitstartselective = bitstartselective if \
@@ -70,7 +69,7 @@ class TDOPromise(object):
     def __call__(self):
         if self._value:
             return self._value
-        self._chain.flush()
+        self._chain.flush(until=self)
         return self._value
 
     def __repr__(self):
@@ -101,6 +100,8 @@ class TDOPromise(object):
 
     def _addsub(self, subpromise, offset):
         self._components.append((subpromise, offset))
+        if subpromise._value is None:
+            self._pending += 1
 
     def split(self, bitindex):
         """Split a promise into two promises at the provided index.
@@ -144,10 +145,50 @@ class TDOPromise(object):
         right = TDOPromise(self._chain, 0, len(self)-bitindex,
                           _parent=self)
         self._components = []
+        self._pending = 0
         self._addsub(left, 0)
         self._addsub(right, bitindex)
         return left, right
 
+    def split_chunks(self, lengths):
+        """Split a promise into several consecutive promises at once.
+
+        Same result as calling split repeatedly, but every chunk is a
+        direct child of this promise. Splitting a long read into many
+        primitives stays linear in the number of chunks, and
+        fulfilling the chunks does not recurse through a deep chain
+        of parents.
+
+        Args:
+            lengths: A list of integer chunk lengths, left to right. They must add up to the length of this promise.
+
+        Returns:
+            A list of TDOPromise instances, one per chunk.
+
+        """
+        if sum(lengths) != len(self):
+            raise ValueError(
+                "Chunk lengths do not add up to the promise's size. "
+                "Len: %s; chunk total: %s"%(len(self), sum(lengths)))
+        if len(lengths) == 1:
+            return [self]
+
+        self._components = []
+        self._pending = 0
+        chunks = []
+        offset = 0
+        for length in lengths:
+            #Only the first chunk's data starts at this promise's
+            #offset. The others start at the beginning of their own
+            #primitive's data.
+            chunk = TDOPromise(self._chain,
+                               self._bitstart if not offset else 0,
+                               length, _parent=self)
+            self._addsub(chunk, offset)
+            chunks.append(chunk)
+            offset += length
+        return chunks
+
     def _fulfill(self, bits, ignore_nonpromised_bits=False):
         """Supply the promise with the bits from its associated primitive's execution.
 
@@ -167,6 +208,7 @@ class TDOPromise(object):
 
         """
         if self._allsubsfulfilled():
+            wasfulfilled = self._value is not None
             if not self._components:
                 if ignore_nonpromised_bits:
                     self._value = bits[self._bitstartselective:
@@ -178,8 +220,17 @@ class TDOPromise(object):
                 self._value = self._components[0][0]._value
                 for sub, offset in self._components[1:]:
                     self._value += sub._value
-            if self._parent is not None:
-                self._parent._fulfill(None)
+            if self._parent is not None and not wasfulfilled:
+                self._parent._subfulfilled()
+
+    def _subfulfilled(self):
+        """Record that one of this promise's subpromises got its value.
+
+        Fulfills this promise once the last pending subpromise is in.
+        """
+        self._pending -= 1
+        if self._pending <= 0:
+            self._fulfill(None)
 
     def _allsubsfulfilled(self):
         """Check if every subpromise has been fulfilles
@@ -187,8 +238,7 @@ class TDOPromise(object):
         Returns:
             A boolean describing if all subpromises have been fulfilled
         """
-        return not any((sub._value is None
-                        for sub, offset in self._components))
+        return self._pending <= 0
 
     def makesubatoffset(self, bitoffset, *, _offsetideal=None):
         """Create a copy of this promise with an offset, and use it as this promise's child.
@@ -316,6 +366,48 @@ class TDOPromiseCollection(object):
 
             return processed_left, processed_right
 
+    def split_chunks(self, lengths):
+        """Split a promise collection into several consecutive collections at once.
+
+        Same operation as the one on TDOPromise. Every contained
+        promise is placed in the chunk (or chunks) it overlaps in a
+        single pass over the collection.
+
+        Args:
+            lengths: A list of integer chunk lengths, left to right, in bits of the associated primitive.
+
+        Returns:
+            A list of TDOPromiseCollection instances, one per chunk.
+
+        """
+        chunks = [TDOPromiseCollection(self._chain) for _ in lengths]
+        starts, ends = [], []
+        offset = 0
+        for length in lengths:
+            starts.append(offset)
+            offset += length
+            ends.append(offset)
+
+        first = 0
+        for p in self._promises:
+            while first < len(lengths)-1 and ends[first] <= p._bitstart:
+                first += 1
+            last = first
+            while last < len(lengths)-1 and ends[last] < p._bitend:
+                last += 1
+
+            if first == last:
+                chunks[first].add(p, -starts[first])
+                continue
+
+            pieces = p.split_chunks(
+                [min(p._bitend, ends[i])-max(p._bitstart, starts[i])
+                 for i in range(first, last+1)])
+            chunks[first].add(pieces[0], -starts[first])
+            for i, piece in enumerate(pieces[1:], first+1):
+                chunks[i].add(piece, 0)
+        return chunks
+
     def __repr__(self):
         return "<PC %s (%s bits); %s>" % (self.sn, len(self), self._promises) #pragma: no cover
 
@@ -0,0 +1,559 @@
+"""Play SVF and XSVF files on a JTAGScanChain.
+
+Files are parsed one statement at a time, and their scans are queued
+as primitives (rw_ir/rw_dr, transition_tap and sleep). Queued
+primitives are flushed whenever about window_bits bits have been
+queued, and the TDO values the file expects are checked against the
+returned promises after every flush, so memory use does not grow with
+the size of the file.
+
+    >>> chain.jtag_enable()
+    >>> SVFPlayer(chain).play("program.svf")
+    >>> SVFPlayer(chain).play_xsvf("program.xsvf")
+
+Bitarrays follow the rest of proteusisc: the right most bit is
+shifted first, which is the least significant bit of SVF and XSVF
+values.
+"""
+import re
+import struct
+
+from .bittypes import bitarray
+from .errors import SVFError, SVFCompareError
+
+_svf_states = {
+    'RESET': 'TLR', 'IDLE': 'RTI',
+    'DRSELECT': 'DRSCAN', 'DRCAPTURE': 'CAPTUREDR', 'DRSHIFT': 'SHIFTDR',
+    'DREXIT1': 'EXIT1DR', 'DRPAUSE': 'PAUSEDR', 'DREXIT2': 'EXIT2DR',
+    'DRUPDATE': 'UPDATEDR',
+    'IRSELECT': 'IRSCAN', 'IRCAPTURE': 'CAPTUREIR', 'IRSHIFT': 'SHIFTIR',
+    'IREXIT1': 'EXIT1IR', 'IRPAUSE': 'PAUSEIR', 'IREXIT2': 'EXIT2IR',
+    'IRUPDATE': 'UPDATEIR',
+}
+_stable_states = {'TLR', 'RTI', 'PAUSEDR', 'PAUSEIR'}
+
+_xsvf_states = ('TLR', 'RTI', 'DRSCAN', 'CAPTUREDR', 'SHIFTDR', 'EXIT1DR',
+                'PAUSEDR', 'EXIT2DR', 'UPDATEDR', 'IRSCAN', 'CAPTUREIR',
+                'SHIFTIR', 'EXIT1IR', 'PAUSEIR', 'EXIT2IR', 'UPDATEIR')
+
+_token_re = re.compile(r'\(([^)]*)\)|([^\s()]+)')
+_space_re = re.compile(r'\s+')
+
+def iter_svf_statements(f):
+    """Parse SVF statements from a file one at a time.
+
+    Args:
+        f: A text file object.
+
+    Yields:
+        (line number, list of tokens) tuples, one per statement. The
+        contents of parentheses are one token, without whitespace.
+    """
+    parts = []
+    lineno = start = 0
+    for lineno, line in enumerate(f, 1):
+        for marker in ('!', '//'):
+            index = line.find(marker)
+            if index >= 0:
+                line = line[:index]
+        while line:
+            if not parts:
+                if not line.strip():
+                    break
+                start = lineno
+            end = line.find(';')
+            if end < 0:
+                parts.append(line)
+                break
+            parts.append(line[:end])
+            line = line[end+1:]
+            tokens = [_space_re.sub('', paren) if paren else word.upper()
+                      for paren, word in _token_re.findall(''.join(parts))]
+            parts = []
+            if tokens:
+                yield start, tokens
+    if ''.join(parts).strip():
+        raise SVFError("Line %s: statement not terminated by ';'"%start)
+
+def _hexbits(text, length):
+    """Get the length least significant bits of an SVF hex value."""
+    text = text.strip()
+    if len(text)%2:
+        text = '0'+text
+    bits = bitarray()
+    try:
+        bits.frombytes(bytes.fromhex(text))
+    except ValueError:
+        raise SVFError("Invalid hex value (%s)"%text[:32]) from None
+    return _fit(bits, length)
+
+def _fit(bits, length):
+    if len(bits) < length:
+        pad = bitarray(length-len(bits))
+        pad.setall(False)
+        return pad+bits
+    return bits[len(bits)-length:]
+
+def _ones(length):
+    bits = bitarray(length)
+    bits.setall(True)
+    return bits
+
+def _zeros(length):
+    bits = bitarray(length)
+    bits.setall(False)
+    return bits
+
+class _ScanParams(object):
+    """The sticky parameters of one SVF scan command (SIR, HDR, ...)."""
+    def __init__(self, default_tdi):
+        self.length = 0
+        self.tdi = bitarray()
+        self.tdo = None
+        self.mask = bitarray()
+        self._default_tdi = default_tdi
+
+    def update(self, lineno, tokens):
+        """Apply a statement's tokens to the parameters."""
+        try:
+            length = int(tokens[1])
+        except (IndexError, ValueError):
+            raise SVFError("Line %s: %s needs a length"%
+                           (lineno, tokens[0])) from None
+        params = dict(zip(tokens[2::2], tokens[3::2]))
+        unknown = set(params)-{'TDI', 'TDO', 'MASK', 'SMASK'}
+        if unknown or len(tokens)%2:
+            raise SVFError("Line %s: invalid %s parameters"%
+                           (lineno, tokens[0]))
+        if length != self.length:
+            self.length = length
+            self.mask = None
+            self.tdi = None
+        if 'TDI' in params:
+            self.tdi = _hexbits(params['TDI'], length)
+        elif self.tdi is None:
+            self.tdi = self._default_tdi(length)
+        if 'MASK' in params:
+            self.mask = _hexbits(params['MASK'], length)
+        elif self.mask is None:
+            self.mask = _ones(length)
+        self.tdo = _hexbits(params['TDO'], length) \
+                   if 'TDO' in params else None
+
+class SVFPlayer(object):
+    """Plays SVF and XSVF files on a JTAGScanChain.
+
+    JTAG must be enabled on the chain before playing. TRST statements
+    are ignored (no supported controller has a TRST pin), and PIO
+    statements are not supported.
+
+    Attributes:
+        window_bits: The number of scanned bits to queue before flushing and checking TDO values.
+        xrepeat: A boolean for if XSVF XREPEAT retries are honoured. Retrying requires checking every XSDRTDO scan as soon as it runs, which is slower.
+        scans: The number of IR and DR scans played.
+    """
+    def __init__(self, chain, *, window_bits=1<<20, xrepeat=True):
+        self._chain = chain
+        self.window_bits = window_bits
+        self.xrepeat = xrepeat
+        self.scans = 0
+        self._queued_bits = 0
+        self._pending = []
+        self._reset_state()
+
+    def _reset_state(self):
+        self._endir = self._enddr = 'RTI'
+        self._run_state = self._run_end = 'RTI'
+        self._params = {
+            'SIR': _ScanParams(_ones), 'SDR': _ScanParams(_zeros),
+            'HIR': _ScanParams(_ones), 'TIR': _ScanParams(_ones),
+            'HDR': _ScanParams(_zeros), 'TDR': _ScanParams(_zeros),
+        }
+
+    def flush(self):
+        """Run everything queued and check the TDO values read."""
+        self._chain.flush()
+        pending, self._pending = self._pending, []
+        self._queued_bits = 0
+        for promise, expected, mask, where in pending:
+            self._check(promise, expected, mask, where)
+
+    @staticmethod
+    def _check(promise, expected, mask, where):
+        res = promise()
+        if ((res ^ expected) & mask).any():
+            raise SVFCompareError(
+                "%s: TDO mismatch. Expected %s, read %s, mask %s"%
+                (where, expected.to01(), res.to01(), mask.to01()))
+
+    def _queued(self, bits):
+        self._queued_bits += bits
+        if self._queued_bits >= self.window_bits:
+            self.flush()
+
+    def _capture(self, ir):
+        """Queue the start of a new IR or DR scan.
+
+        The shortest path from PAUSEDR to SHIFTDR (or PAUSEIR to
+        SHIFTIR) goes through EXIT2 and resumes the last scan. SVF
+        scans always pass through UPDATE and CAPTURE, which the
+        shortest path to CAPTURE does from any state.
+        """
+        self._chain.transition_tap('CAPTUREIR' if ir else 'CAPTUREDR')
+
+    def _scan(self, ir, tdi, tdo, mask, end, where):
+        """Queue a full IR or DR scan that finishes in state end.
+
+        Returns:
+            The promise of the read bits, or None if tdo is None.
+        """
+        chain = self._chain
+        read = tdo is not None
+        self._capture(ir)
+        if end in ('PAUSEIR', 'PAUSEDR'):
+            #rw_ir/rw_dr always pass through UPDATE, so scan the
+            #register directly and leave it from EXIT1.
+            chain.transition_tap('SHIFTIR' if ir else 'SHIFTDR')
+            promise = chain.rw_reg(data=tdi, read=read)
+        elif ir:
+            promise = chain.rw_ir(data=tdi, read=read)
+        else:
+            promise = chain.rw_dr(data=tdi, read=read)
+        chain.transition_tap(end)
+        self.scans += 1
+        if read:
+            self._pending.append((promise, tdo, mask, where))
+        self._queued(len(tdi))
+        return promise
+
+    def _wait(self, state, cycles=0, seconds=0):
+        """Queue cycles TCKs and a delay of seconds in state.
+
+        TCKs outside of RTI and TLR are waited out with a sleep, which
+        requires the chain's TCK frequency to be known.
+        """
+        chain = self._chain
+        chain.transition_tap(state)
+        if cycles:
+            if state in ('RTI', 'TLR'):
+                chain.transition_tap(state, loop=cycles)
+            elif chain.speed:
+                seconds += cycles/chain.speed
+            else:
+                raise SVFError("Can not wait %s TCKs in %s without "
+                               "knowing the TCK frequency"%(cycles, state))
+        if seconds:
+            chain.sleep(delay=seconds*1000)
+        self._queued(cycles)
+
+    ######## SVF ########
+
+    def play(self, source):
+        """Play an SVF file.
+
+        Args:
+            source: A path or text file object.
+        """
+        if isinstance(source, str):
+            with open(source, 'r') as f:
+                return self.play(f)
+        for lineno, tokens in iter_svf_statements(source):
+            handler = getattr(self, '_svf_'+tokens[0], None)
+            if handler is None:
+                raise SVFError("Line %s: unsupported statement %s"%
+                               (lineno, tokens[0]))
+            handler(lineno, tokens)
+        self.flush()
+
+    @staticmethod
+    def _svf_state_name(lineno, name):
+        try:
+            return _svf_states[name]
+        except KeyError:
+            raise SVFError("Line %s: unknown state %s"%
+                           (lineno, name)) from None
+
+    def _svf_scan(self, lineno, tokens, ir):
+        kind = 'IR' if ir else 'DR'
+        tail = self._params['T'+kind]
+        head = self._params['H'+kind]
+        body = self._params['S'+kind]
+        body.update(lineno, tokens)
+        parts = (tail, body, head)
+        tdi = tail.tdi+body.tdi+head.tdi
+        tdo = mask = None
+        if any(p.tdo is not None for p in parts):
+            tdo = bitarray()
+            mask = bitarray()
+            for p in parts:
+                tdo += p.tdo if p.tdo is not None else _zeros(p.length)
+                mask += p.mask if p.tdo is not None else _zeros(p.length)
+        if len(tdi):
+            self._scan(ir, tdi, tdo, mask,
+                       self._endir if ir else self._enddr,
+                       "Line %s"%lineno)
+
+    def _svf_SIR(self, lineno, tokens):
+        self._svf_scan(lineno, tokens, True)
+
+    def _svf_SDR(self, lineno, tokens):
+        self._svf_scan(lineno, tokens, False)
+
+    def _svf_header(self, lineno, tokens):
+        self._params[tokens[0]].update(lineno, tokens)
+
+    _svf_HIR = _svf_TIR = _svf_HDR = _svf_TDR = _svf_header
+
+    def _svf_ENDIR(self, lineno, tokens):
+        self._endir = self._svf_stable_state(lineno, tokens[1:])
+
+    def _svf_ENDDR(self, lineno, tokens):
+        self._enddr = self._svf_stable_state(lineno, tokens[1:])
+
+    def _svf_stable_state(self, lineno, tokens):
+        if len(tokens) != 1:
+            raise SVFError("Line %s: expected one state"%lineno)
+        state = self._svf_state_name(lineno, tokens[0])
+        if state not in _stable_states:
+            raise SVFError("Line %s: %s is not a stable state"%
+                           (lineno, tokens[0]))
+        return state
+
+    def _svf_STATE(self, lineno, tokens):
+        states = [self._svf_state_name(lineno, t) for t in tokens[1:]]
+        if not states or states[-1] not in _stable_states:
+            raise SVFError("Line %s: STATE must end in a stable state"%
+                           lineno)
+        for state in states:
+            self._chain.transition_tap(state)
+
+    def _svf_RUNTEST(self, lineno, tokens):
+        args = tokens[1:]
+        if args and args[0] in _svf_states:
+            self._run_state = self._svf_stable_state(lineno, args[:1])
+            self._run_end = self._run_state
+            args = args[1:]
+        cycles = 0
+        seconds = 0.0
+        try:
+            while args:
+                if args[0] == 'ENDSTATE':
+                    self._run_end = self._svf_stable_state(lineno, args[1:2])
+                    args = args[2:]
+                elif args[0] == 'MAXIMUM':
+                    args = args[3:]
+                elif args[1] == 'TCK':
+                    cycles = int(float(args[0]))
+                    args = args[2:]
+                elif args[1] == 'SEC':
+                    seconds = float(args[0])
+                    args = args[2:]
+                else:
+                    raise SVFError("Line %s: unsupported RUNTEST "
+                                   "clock %s"%(lineno, args[1]))
+        except (IndexError, ValueError):
+            raise SVFError("Line %s: invalid RUNTEST"%lineno) from None
+        self._wait(self._run_state, cycles, seconds)
+        self._chain.transition_tap(self._run_end)
+
+    def _svf_FREQUENCY(self, lineno, tokens):
+        if len(tokens) > 1:
+            self.flush()
+            self._chain.speed = int(float(tokens[1]))
+
+    def _svf_TRST(self, lineno, tokens):
+        pass
+
+    ######## XSVF ########
+
+    def play_xsvf(self, source):
+        """Play an XSVF file.
+
+        Args:
+            source: A path or binary file object.
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return self.play_xsvf(f)
+        self._xsdrsize = 0
+        self._xtdomask = None
+        self._xtdoexpected = None
+        self._xrepeat = 32
+        self._xruntest = 0
+        self._reset_state()
+        handlers = {
+            1: self._xsvf_XTDOMASK, 2: self._xsvf_XSIR,
+            3: self._xsvf_XSDR, 4: self._xsvf_XRUNTEST,
+            7: self._xsvf_XREPEAT, 8: self._xsvf_XSDRSIZE,
+            9: self._xsvf_XSDRTDO, 12: self._xsvf_XSDRB,
+            13: self._xsvf_XSDRC, 14: self._xsvf_XSDRE,
+            15: self._xsvf_XSDRTDOB, 16: self._xsvf_XSDRTDOC,
+            17: self._xsvf_XSDRTDOE, 18: self._xsvf_XSTATE,
+            19: self._xsvf_XENDIR, 20: self._xsvf_XENDDR,
+            21: self._xsvf_XSIR2, 22: self._xsvf_XCOMMENT,
+            23: self._xsvf_XWAIT,
+        }
+        index = 0
+        while True:
+            cmd = source.read(1)
+            if not cmd or cmd[0] == 0: #XCOMPLETE
+                break
+            handler = handlers.get(cmd[0])
+            if handler is None:
+                raise SVFError("Command %s: unsupported XSVF command "
+                               "0x%02x"%(index, cmd[0]))
+            handler(source, "Command %s"%index)
+            index += 1
+        self.flush()
+
+    @staticmethod
+    def _read(f, count):
+        dat = f.read(count)
+        if len(dat) != count:
+            raise SVFError("Unexpected end of XSVF file")
+        return dat
+
+    def _read_bits(self, f, length):
+        bits = bitarray()
+        bits.frombytes(self._read(f, (length+7)//8))
+        return _fit(bits, length)
+
+    def _xsvf_XTDOMASK(self, f, where):
+        self._xtdomask = self._read_bits(f, self._xsdrsize)
+
+    def _xsvf_XSIR(self, f, where):
+        self._xsvf_sir(f, self._read(f, 1)[0], where)
+
+    def _xsvf_XSIR2(self, f, where):
+        self._xsvf_sir(f, struct.unpack('>H', self._read(f, 2))[0], where)
+
+    def _xsvf_sir(self, f, length, where):
+        self._scan(True, self._read_bits(f, length), None, None,
+                   self._endir, where)
+        if self._xruntest:
+            self._wait('RTI', seconds=self._xruntest/1e6)
+
+    def _xsvf_XSDR(self, f, where):
+        self._xsvf_sdr(self._read_bits(f, self._xsdrsize), where)
+
+    def _xsvf_XSDRTDO(self, f, where):
+        tdi = self._read_bits(f, self._xsdrsize)
+        self._xtdoexpected = self._read_bits(f, self._xsdrsize)
+        self._xsvf_sdr(tdi, where)
+
+    def _xsvf_sdr(self, tdi, where):
+        tdo = self._xtdoexpected
+        mask = self._xtdomask if self._xtdomask is not None else\
+               _ones(len(tdi))
+        if tdo is None or not mask.any():
+            self._scan(False, tdi, None, None, self._enddr, where)
+            if self._xruntest:
+                self._wait('RTI', seconds=self._xruntest/1e6)
+            return
+        if not (self.xrepeat and self._xrepeat):
+            self._scan(False, tdi, tdo, mask, self._enddr, where)
+            if self._xruntest:
+                self._wait('RTI', seconds=self._xruntest/1e6)
+            return
+
+        #The TDO value is compared in EXIT1DR, before the register
+        #is updated. On a mismatch the XSVF player goes back to
+        #SHIFTDR through PAUSEDR (shifting one extra bit), leaves
+        #through UPDATEDR, waits 25% longer, and scans again.
+        chain = self._chain
+        runtest = self._xruntest
+        self.flush()
+        self._capture(False)
+        for attempt in range(self._xrepeat+1):
+            chain.transition_tap('SHIFTDR')
+            promise = chain.rw_reg(data=tdi, read=True)
+            self.scans += 1
+            chain.flush()
+            res = promise()
+            if not ((res ^ tdo) & mask).any() or \
+               attempt == self._xrepeat:
+                break
+            for state in ('PAUSEDR', 'EXIT2DR', 'SHIFTDR', 'EXIT1DR',
+                          'UPDATEDR', 'RTI'):
+                chain.transition_tap(state)
+            runtest += runtest>>2
+            if runtest:
+                self._wait('RTI', seconds=runtest/1e6)
+        chain.transition_tap(self._enddr)
+        if runtest:
+            self._wait('RTI', seconds=runtest/1e6)
+        chain.flush()
+        self._check(promise, tdo, mask, where)
+
+    def _xsvf_segment(self, f, where, begin, end, compare):
+        tdi = self._read_bits(f, self._xsdrsize)
+        tdo = mask = None
+        if compare:
+            self._xtdoexpected = tdo = self._read_bits(f, self._xsdrsize)
+            mask = self._xtdomask if self._xtdomask is not None else\
+                   _ones(len(tdi))
+        chain = self._chain
+        if begin:
+            self._capture(False)
+            chain.transition_tap('SHIFTDR')
+        promise = chain.rw_reg(data=tdi, read=compare, lastbit=end)
+        if end:
+            chain.transition_tap(self._enddr)
+        self.scans += 1
+        if compare:
+            self._pending.append((promise, tdo, mask, where))
+        self._queued(len(tdi))
+
+    def _xsvf_XSDRB(self, f, where):
+        self._xsvf_segment(f, where, True, False, False)
+
+    def _xsvf_XSDRC(self, f, where):
+        self._xsvf_segment(f, where, False, False, False)
+
+    def _xsvf_XSDRE(self, f, where):
+        self._xsvf_segment(f, where, False, True, False)
+
+    def _xsvf_XSDRTDOB(self, f, where):
+        self._xsvf_segment(f, where, True, False, True)
+
+    def _xsvf_XSDRTDOC(self, f, where):
+        self._xsvf_segment(f, where, False, False, True)
+
+    def _xsvf_XSDRTDOE(self, f, where):
+        self._xsvf_segment(f, where, False, True, True)
+
+    def _xsvf_XRUNTEST(self, f, where):
+        self._xruntest = struct.unpack('>I', self._read(f, 4))[0]
+
+    def _xsvf_XREPEAT(self, f, where):
+        self._xrepeat = self._read(f, 1)[0]
+
+    def _xsvf_XSDRSIZE(self, f, where):
+        self._xsdrsize = struct.unpack('>I', self._read(f, 4))[0]
+        self._xtdomask = None
+
+    def _xsvf_state(self, f, where):
+        code = self._read(f, 1)[0]
+        if code >= len(_xsvf_states):
+            raise SVFError("%s: unknown XSVF state %s"%(where, code))
+        return _xsvf_states[code]
+
+    def _xsvf_XSTATE(self, f, where):
+        self._chain.transition_tap(self._xsvf_state(f, where))
+
+    def _xsvf_XENDIR(self, f, where):
+        self._endir = 'PAUSEIR' if self._read(f, 1)[0] else 'RTI'
+
+    def _xsvf_XENDDR(self, f, where):
+        self._enddr = 'PAUSEDR' if self._read(f, 1)[0] else 'RTI'
+
+    def _xsvf_XCOMMENT(self, f, where):
+        while self._read(f, 1) != b'\x00':
+            pass
+
+    def _xsvf_XWAIT(self, f, where):
+        wait_state = self._xsvf_state(f, where)
+        end_state = self._xsvf_state(f, where)
+        usecs = struct.unpack('>I', self._read(f, 4))[0]
+        self._wait(wait_state, seconds=usecs/1e6)
+        self._chain.transition_tap(end_state)
@@ -0,0 +1,198 @@
+"""Write compiled primitive streams out as SVF.
+
+An SVFWriter follows the TAP state machine through the TMS, TDI and
+TDO bits of compiled Level 1 primitives, and writes the equivalent SVF
+statements as it goes: SIR/SDR for every register scan, STATE for
+moves between stable states, and RUNTEST for clocks spent looping in a
+stable state (or waiting on the host). Nothing is kept but the scan being shifted, so streams
+of any length can be written.
+
+    >>> chain.rw_ir(data=bitarray('00000001'))
+    >>> chain.export_svf("idcode.svf")
+
+The written file can be played back with an SVFPlayer, or any other
+SVF capable tool. A few things do not map exactly onto SVF:
+
+    * SVF scans always start from a stable state. A scan that leaves
+      through UPDATE straight into the next scan is ended in IDLE,
+      which adds one clock in IDLE.
+    * SVF can not resume a scan after pausing it, so shifting again
+      from EXIT2 raises an SVFError.
+    * The values read back are not known when exporting, so scans that
+      read TDO are marked with a comment instead of a TDO value.
+"""
+from itertools import repeat
+
+from .bittypes import bitarray
+from .errors import SVFError
+from .jtagStateMachine import JTAGStateMachine
+from .primitive_defaults import HostSleep
+from .svfPlayer import _svf_states, _stable_states
+
+_svf_names = {state: name for name, state in _svf_states.items()}
+
+def _bits(value, count):
+    """Iterate the bits of a prepared primitive argument in shift order."""
+    if isinstance(value, (bool, int)) or value is None:
+        return repeat(bool(value), count)
+    return (bool(bit) for bit in reversed(value))
+
+def _state_path(start, tms):
+    """List the states entered going from start over TMS bits tms."""
+    sm = JTAGStateMachine(start)
+    path = []
+    for bit in reversed(tms):
+        sm.transition_bit(bit)
+        path.append(sm.state)
+    return path
+
+class SVFWriter(object):
+    """Writes SVF equivalent to a stream of compiled Level 1 primitives.
+
+    Several batches of primitives can be written in a row; the TAP
+    state carries over from one to the next. Call finish once the last
+    batch is written.
+
+    Attributes:
+        scans: The number of SIR and SDR statements written.
+        state: The TAP state at the end of what has been written.
+    """
+    def __init__(self, f, *, state=None):
+        """Create a new SVFWriter.
+
+        Args:
+            f: A text file object to write to.
+            state: The TAP state the stream starts in. Unknown (a _PRE state) if not given.
+        """
+        self._f = f
+        self._sm = JTAGStateMachine(state)
+        self._svf_state = None
+        self._path = []
+        self._scan = None
+        self._loops = 0
+        self._end = {'IR': 'RTI', 'DR': 'RTI'}
+        self.scans = 0
+        self._write("! Written by proteusisc")
+        if self._sm.state in _stable_states:
+            self._statement("STATE %s"%_svf_names[self._sm.state])
+            self._svf_state = self._sm.state
+
+    @property
+    def state(self):
+        return self._sm.state
+
+    def write_prims(self, prims):
+        """Write the SVF for a list of executable Level 1 primitives."""
+        for prim in prims:
+            if isinstance(prim, HostSleep):
+                self._sleep(prim.delay/1000)
+                continue
+            prim.prepare_args()
+            count = prim.count
+            for tms, tdi, tdo in zip(_bits(prim.tms, count),
+                                     _bits(prim.tdi, count),
+                                     _bits(prim.tdo, count)):
+                self._clock(tms, tdi, tdo)
+
+    def finish(self):
+        """Write out anything pending, leaving the TAP in a stable state.
+
+        A stream that stops between stable states is finished in IDLE.
+        """
+        self._write_loops()
+        if self._scan:
+            if not self._scan[3]:
+                raise SVFError("The stream stopped in the middle of a scan")
+            self._write_scan('RTI')
+        elif self._path:
+            self._path = []
+            self._statement("STATE IDLE")
+            self._svf_state = 'RTI'
+        if self._svf_state:
+            self._sm.state = self._svf_state
+
+    def _sleep(self, seconds):
+        self._write_loops()
+        if self._scan or self._path or not self._svf_state:
+            raise SVFError("SVF can only wait in a stable state, not %s"%
+                           self._sm.state)
+        name = _svf_names[self._svf_state]
+        self._statement("RUNTEST %s %.6E SEC ENDSTATE %s"%
+                        (name, seconds, name))
+
+    def _write(self, line):
+        self._f.write(line+"\n")
+
+    def _statement(self, statement):
+        self._write(statement+";")
+
+    def _clock(self, tms, tdi, tdo):
+        cur = self._sm.state
+        self._sm.transition_bit(tms)
+        nxt = self._sm.state
+        scan = self._scan
+
+        if cur in ('SHIFTDR', 'SHIFTIR'):
+            scan[1].append(tdi)
+            scan[2] |= tdo
+            if nxt != cur:
+                scan[3] = True
+                self._path = []
+            return
+        if cur.startswith('_PRE'):
+            if nxt == 'TLR':
+                self._statement("STATE RESET")
+                self._svf_state = 'TLR'
+            return
+        if nxt == cur:
+            self._loops += 1
+            return
+
+        self._write_loops()
+        if nxt in ('SHIFTDR', 'SHIFTIR'):
+            if cur.startswith('EXIT2'):
+                raise SVFError("SVF can not resume a paused scan")
+            if scan:
+                #Scanning again straight from UPDATE.
+                self._write_scan('RTI')
+            self._scan = [nxt[-2:], [], False, False]
+            self._path = []
+            return
+
+        self._path.append(nxt)
+        if nxt not in _stable_states:
+            return
+        if scan:
+            self._write_scan(nxt)
+            return
+        names = [_svf_names[state] for state in self._path]
+        if self._svf_state and self._path == _state_path(
+                self._svf_state,
+                JTAGStateMachine(self._svf_state)\
+                    .calc_transition_to_state(nxt)):
+            names = names[-1:]
+        self._statement("STATE %s"%" ".join(names))
+        self._svf_state = nxt
+        self._path = []
+
+    def _write_loops(self):
+        if self._loops:
+            name = _svf_names[self._svf_state]
+            self._statement("RUNTEST %s %d TCK ENDSTATE %s"%
+                            (name, self._loops, name))
+            self._loops = 0
+
+    def _write_scan(self, end):
+        kind, tdi, read, _ = self._scan
+        if self._end[kind] != end:
+            self._statement("END%s %s"%(kind, _svf_names[end]))
+            self._end[kind] = end
+        if read:
+            self._write("! TDO read")
+        value = bitarray(tdi[::-1]).to01()
+        self._statement("S%s %d TDI (%0*X)"%
+                        (kind, len(tdi), (len(tdi)+3)//4, int(value, 2)))
+        self.scans += 1
+        self._scan = None
+        self._path = []
+        self._svf_state = end
@@ -1,2 +1,6 @@
-from .controller import FakeDevHandle, FakeXPCU1Handle, FakeUSBDev
+from .controller import FakeDevHandle, FakeXPCU1Handle, FakeUSBDev,\
+    FakeUSBContext
 from .device import ShiftRegister, MockPhysicalJTAGDevice
+from .timing import VirtualClock, LatencyHandle
+from .trace import RecordingUSBDev, ReplayUSBDev, TraceMismatchError,\
+    read_trace, summarize_trace
@@ -1,14 +1,25 @@
 from .. import bitarray
-from itertools import chain
+from itertools import chain, compress
 import struct
 import math
 # pylint: disable=no-name-in-module
-from usb1 import USBErrorPipe, USBErrorOverflow
+from usb1 import USBErrorPipe, USBErrorOverflow, TRANSFER_COMPLETED
 
+from .device import shift_device_chain
 from ..drivers.digilentdriver import _CMSG_PROD_NAME, _CMSG_USER_NAME,\
     _CMSG_SERIAL_NO, _CMSG_FW_VER, _CMSG_DEV_CAPS, _CMSG_OEM_SEED,\
     _CMSG_PROD_ID, _CMSG_OEM_CHECK
 
+def _const_bits(value, count):
+    """Make a bitarray of count bits all set to value."""
+    bits = bitarray(count)
+    bits.setall(bool(value))
+    return bits
+
+def _pad_tdo(tdo):
+    """Reverse TDO bits (first read first) and pad them to whole bytes."""
+    return bitarray([False]*(8-(len(tdo)%8)))+tdo[::-1]
+
 class FakeXPCU1Handle(object):
     USB_VEND_ID = 0x03FD
     USB_PROD_ID = 0x0008
@@ -31,6 +42,11 @@ class FakeXPCU1Handle(object):
         self.transfer_bit_count = 0
         self.doing_transfer = False
         self._blk_read_buffer = []
+        self.cpld_upgrade = False
+        self.control_transfer_count = 0
+        self._gpio = 0
+        self._tdo_latch = False
+        self.tck_count = 0
 
     def controlWrite(self, request_type, request, value, index, data,
                      timeout=0):
@@ -41,6 +57,7 @@ class FakeXPCU1Handle(object):
                             "not be negative.")
         valueh = (value>>8) & 0xFF
         valuel = value & 0xFF
+        self.control_transfer_count += 1
 
         if valuel == self.XC_DEVICE_DISABLE:
             self._jtag_on = False
@@ -50,10 +67,16 @@ class FakeXPCU1Handle(object):
             if index & 0x10 is not 0x10 or index & 0xf > 4:
                 raise Exception("Invalid speed '%02x'"%index)
             self.speed = index
-        #elif valuel == self.XC_WRITE_JTAG_SINGLE:
-        #    pass
-        #elif valuel == self.XC_SET_CPLD_UPGRADE:
-        #    pass
+        elif valuel == self.XC_WRITE_JTAG_SINGLE:
+            #Bits 2, 1, 0 of index are TCK, TMS, TDI. Devices are
+            #clocked on the rising edge of TCK.
+            if index & 0b100 and not self._gpio & 0b100:
+                self.tck_count += 1
+                self._tdo_latch = self._write_to_dev_chain(
+                    bool(index & 0b10), bool(index & 0b1))
+            self._gpio = index & 0b111
+        elif valuel == self.XC_SET_CPLD_UPGRADE:
+            self.cpld_upgrade = bool(index)
         elif valuel == self.XC_JTAG_TRANSFER:
             self.doing_transfer = True
             self.transfer_bit_count = ((valueh<<16) | index)+1
@@ -64,11 +87,19 @@ class FakeXPCU1Handle(object):
 
     def controlRead(self, request_type, request, value, index, length,
                     timeout=0):
+        self.control_transfer_count += 1
         if value is self.XC_REVERSE_WINDEX:
             res = int(bin(index)[2:].zfill(8)[::-1], 2)\
                   .to_bytes(1, 'little')
-        #elif value is self.XC_READ_JTAG_SINGLE:
-        #    pass
+        elif value is self.XC_READ_JTAG_SINGLE:
+            #The firmware reports the TDO value latched on the last
+            #clock. In CPLD upgrade mode the TDO pin is read directly,
+            #which is the bit the next clock will shift out.
+            if self.cpld_upgrade:
+                tdo = self.devices[-1].tdo if self.devices else False
+            else:
+                tdo = self._tdo_latch
+            res = bytes((int(tdo),))
         elif value is self.XC_RET_CONSTANT:
             res = b'\xB5\x03'
         elif value is self.XC_GET_VERSION:
@@ -105,18 +136,14 @@ class FakeXPCU1Handle(object):
                             (expected_data_len, len(data)))
         tms, tdi, tdo, tck = FakeXPCU1Handle.\
                     _decode_transfer_bits(data, self.transfer_bit_count)
-        res_tmp = []
         dataout = b''
 
-        for i in range(self.transfer_bit_count):
-            if tck[i]:
-                resbit = self._write_to_dev_chain(tms[i], tdi[i])
-                if tdo[i]:
-                    res_tmp = [resbit] + res_tmp
-                    if len(res_tmp) == 32:
-                        tmpbits = bitarray(res_tmp)
-                        dataout += tmpbits.tobytes()[::-1]
-                        res_tmp = []
+        resbits = self._clock_chain(bitarray(compress(tms, tck)),
+                                    bitarray(compress(tdi, tck)))
+        resbits = bitarray(compress(resbits, compress(tdo, tck)))
+        for i in range(0, len(resbits)-len(resbits)%32, 32):
+            dataout += resbits[i:i+32][::-1].tobytes()[::-1]
+        res_tmp = resbits[len(resbits)-len(resbits)%32:][::-1].tolist()
 
         if res_tmp:
             if len(res_tmp) > 16:
@@ -147,6 +174,11 @@ class FakeXPCU1Handle(object):
         """Check if the controller's JTAG enable bit is set"""
         return self._jtag_on
 
+    @property
+    def tck_frequency(self):
+        """The TCK frequency (Hz) of the current speed setting."""
+        return 750000*2**(4-(self.speed&0xF))
+
     def close(self):
         """Close the handle.
 
@@ -156,6 +188,10 @@ class FakeXPCU1Handle(object):
         interface."""
         pass
 
+    def getTransfer(self):
+        """Get an object implementing the usb1.USBTransfer control interface."""
+        return FakeControlTransfer(self)
+
     def _write_to_dev_chain(self, tms, tdi):
         """Simulate electrically asserting a bit to the JTAG output pins.
 
@@ -177,6 +213,16 @@ class FakeXPCU1Handle(object):
         #    (oldstate,self.devices[0].tap.state,tdi))
         return tdi
 
+    def _clock_chain(self, tms, tdi):
+        """Clock bitarrays of TMS and TDI bits (first clocked bit
+        first) through the simulated devices, counting every TCK.
+
+        Returns:
+            A bitarray of the TDO bits, first clocked bit first.
+        """
+        self.tck_count += len(tms)
+        return shift_device_chain(self.devices, tms, tdi)
+
     @staticmethod
     def _decode_transfer_bits(data, transfer_bit_count):
         #Deal with issue of bitarray not accepting bytearrays
@@ -211,6 +257,67 @@ class FakeXPCU1Handle(object):
         print("TCK: %s (%s)", (tck.to01(), tck.count(True)))
 
 
+class FakeControlTransfer(object):
+    """Simulates the control transfer subset of usb1.USBTransfer.
+
+    The transfer runs against the fake handle's synchronous control
+    functions as soon as it is submitted, and the callback is called
+    before submit returns. No event handling is needed to complete
+    it.
+    """
+    def __init__(self, handle):
+        self._handle = handle
+        self._submitted = False
+        self._setup = None
+        self._callback = None
+        self._user_data = None
+        self._status = None
+        self._buffer = b''
+
+    def setControl(self, request_type, request, value, index,
+                   buffer_or_len, callback=None, user_data=None,
+                   timeout=0):
+        if self._submitted:
+            raise Exception("Can not modify a submitted transfer.")
+        self._setup = (request_type, request, value, index, buffer_or_len)
+        self._callback = callback
+        self._user_data = user_data
+
+    def submit(self):
+        if self._submitted:
+            raise Exception("Transfer already submitted.")
+        request_type, request, value, index, buffer_or_len = self._setup
+        self._submitted = True
+        if request_type & 0x80:
+            self._buffer = self._handle.controlRead(
+                request_type, request, value, index, buffer_or_len)
+        else:
+            self._handle.controlWrite(request_type, request, value,
+                                      index, buffer_or_len)
+            self._buffer = buffer_or_len
+        self._status = TRANSFER_COMPLETED
+        self._submitted = False
+        if self._callback:
+            self._callback(self)
+
+    def cancel(self):#pragma: no cover
+        pass
+
+    def isSubmitted(self):
+        return self._submitted
+
+    def getStatus(self):
+        return self._status
+
+    def getUserData(self):
+        return self._user_data
+
+    def getBuffer(self):
+        return self._buffer
+
+    def getActualLength(self):
+        return len(self._buffer)
+
 class FakeDevHandle(object):
     """Artificial USB Digilent ISC controller that implements the usb1.USBDeviceHandle interface.
 
@@ -272,12 +379,18 @@ class FakeDevHandle(object):
         self._adv_req_read_tdo = False
         self._adv_req_bitcount = 0
         self._speed = 4000000
+        self.tck_count = 0
 
     @property
     def jtagon(self):
         """Check if the controller's JTAG enable bit is set"""
         return self._jtag_on
 
+    @property
+    def tck_frequency(self):
+        """The TCK frequency (Hz) set by the last SET_SPEED."""
+        return self._speed
+
     def close(self):
         """Close the handle.
 
@@ -493,6 +606,16 @@ class FakeDevHandle(object):
         #    (oldstate,self.devices[0].tap.state,tdi))
         return tdi
 
+    def _clock_chain(self, tms, tdi):
+        """Clock bitarrays of TMS and TDI bits (first clocked bit
+        first) through the simulated devices, counting every TCK.
+
+        Returns:
+            A bitarray of the TDO bits, first clocked bit first.
+        """
+        self.tck_count += len(tms)
+        return shift_device_chain(self.devices, tms, tdi)
+
     def _initialize_advanced_return(self, bitcount, read_tdo,
                                     **params):
         """Helper method to assign some important values to keep track of Digilent controller state."""
@@ -525,11 +648,9 @@ class FakeDevHandle(object):
         bits = bits[(8*len(data)) - (bitcount*2):]
         tms = bits[::2][::-1]
         tdi = bits[1::2][::-1]
-        tdo = []
-        for i in range(bitcount):
-            tdo.append(self._write_to_dev_chain(tms[i], tdi[i]))
+        tdo = self._clock_chain(tms, tdi)
         if read_tdo:
-            tdo_bits = bitarray(([False]*(8-(len(tdo)%8)))+tdo[::-1])
+            tdo_bits = _pad_tdo(tdo)
             tdo_bytes = tdo_bits.tobytes()
             self._blk_read_buffer.append(tdo_bytes[::-1])
 
@@ -546,11 +667,10 @@ class FakeDevHandle(object):
         bits = bitarray()
         bits.frombytes(data[::-1])
         tms = bits[(8*len(data)) - (bitcount):]
-        tdo = []
-        for tmsbit in reversed(tms):
-            tdo.append(self._write_to_dev_chain(tmsbit, tdi))
+        tdo = self._clock_chain(tms[::-1],
+                                _const_bits(tdi, bitcount))
         if read_tdo:
-            tdo_bits = bitarray(([False]*(8-(len(tdo)%8)))+tdo[::-1])
+            tdo_bits = _pad_tdo(tdo)
             tdo_bytes = tdo_bits.tobytes()
             self._blk_read_buffer.append(tdo_bytes[::-1])
 
@@ -558,14 +678,13 @@ class FakeDevHandle(object):
         tms = params[0]
         tdi = params[1]
         bitcount = sum([b<<(i*8) for i,b in enumerate(params[2:6])])
-        tdo = []
-        for i in range(bitcount):
-            tdo.append(self._write_to_dev_chain(tms, tdi))
+        tdo = self._clock_chain(_const_bits(tms, bitcount),
+                                _const_bits(tdi, bitcount))
 
         self._adv_req_bitcount = bitcount
         self._adv_req_read_tdo = True
         self._blk_read_buffer.append(b'\x01\x00')
-        tdo_bits = bitarray(([False]*(8-(len(tdo)%8)))+tdo[::-1])
+        tdo_bits = _pad_tdo(tdo)
         tdo_bytes = tdo_bits.tobytes()
         self._blk_read_buffer.append(tdo_bytes[::-1])
 
@@ -582,11 +701,10 @@ class FakeDevHandle(object):
         bits = bitarray()
         bits.frombytes(data[::-1])
         tdi = bits[(8*len(data)) - (bitcount):]
-        tdo = []
-        for tdibit in reversed(tdi):
-            tdo.append(self._write_to_dev_chain(tms, tdibit))
+        tdo = self._clock_chain(_const_bits(tms, bitcount),
+                                tdi[::-1])
         if read_tdo:
-            tdo_bits = bitarray(([False]*(8-(len(tdo)%8)))+tdo[::-1])
+            tdo_bits = _pad_tdo(tdo)
             tdo_bytes = tdo_bits.tobytes()
             self._blk_read_buffer.append(tdo_bytes[::-1])
 
@@ -594,8 +712,8 @@ class FakeDevHandle(object):
         tms = params[0]
         tdi = params[1]
         bitcount = sum([b<<(i*8) for i,b in enumerate(params[2:6])])
-        for i in range(bitcount):
-            self._write_to_dev_chain(tms, tdi)
+        self._clock_chain(_const_bits(tms, bitcount),
+                          _const_bits(tdi, bitcount))
 
         self._adv_req_read_tdo = False
         self._adv_req_bitcount = bitcount
@@ -650,6 +768,21 @@ class FakeUSBDev(object):
     def open(self):
         return self.ctrl_handle
     def getVendorID(self):
-        return type(self.ctrl_handle).USB_VEND_ID
+        return self.ctrl_handle.USB_VEND_ID
     def getProductID(self):
-        return type(self.ctrl_handle).USB_PROD_ID
+        return self.ctrl_handle.USB_PROD_ID
+
+class FakeUSBContext(object):
+    """The event handling subset of a usb1.USBContext.
+
+    Fake transfers complete as soon as they are submitted, so there
+    are never any events to handle. Passing one to a driver lets it
+    use asynchronous transfers on a fake handle.
+
+    Attributes:
+        event_count: The number of times handleEvents was called.
+    """
+    def __init__(self):
+        self.event_count = 0
+    def handleEvents(self):
+        self.event_count += 1
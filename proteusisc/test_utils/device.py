@@ -80,6 +80,29 @@ class ShiftRegister(object):
         #print("%s >> REG >> %s", (val, res))
         return res
 
+    def peek(self):
+        """Get the value the next shift will output without shifting."""
+        return self._data[-1]
+
+    def shift_bits(self, bits):
+        """Shift a sequence of bits through the register at once.
+
+        Gives the same result as calling shift for every bit in order.
+
+        Args:
+            bits: A bitarray of the bits to shift in, first bit first.
+
+        Returns:
+            A bitarray of the bits shifted out, first bit first.
+        """
+        count = len(bits)
+        stream = bitarray(reversed(self._data))
+        stream += bits
+        newdata = stream[count:]
+        newdata.reverse()
+        self._data = deque(newdata, len(self))
+        return stream[:count]
+
     def clear(self, val=False):
         """Clear the shift register to a constant value.
 
@@ -159,6 +182,21 @@ class BlackHoleShiftRegister(object):
         self._data.appendleft(val)
         return False
 
+    def peek(self):
+        """Get the undefined value the next shift will output."""
+        return False
+
+    def shift_bits(self, bits):
+        """Shift a sequence of bits into the register at once.
+
+        Returns:
+            A bitarray (as long as bits) of undefined values.
+        """
+        self._data.extendleft(bits)
+        res = bitarray(len(bits))
+        res.setall(False)
+        return res
+
     def clear(self, val=False):
         """Clear the shift register to a constant value.
 
@@ -181,6 +219,79 @@ class BlackHoleShiftRegister(object):
         return True
 
 
+_SHIFT_STATES = ("SHIFTDR", "SHIFTIR")
+
+def _run_end(bits, start, value):
+    """Get the index after the run of value starting at start."""
+    try:
+        return bits.index(not value, start)
+    except ValueError:
+        return len(bits)
+
+def shift_device_chain(devices, tms, tdi):
+    """Simulate clocking bits through a chain of mock devices.
+
+    Gives the same result as passing every bit through each device's
+    shift method in turn, but only bits that change the TAP state are
+    stepped one at a time. A run of TMS=0 in a SHIFT state goes
+    through each device's register as one bitarray shift, and a run
+    of TMS bits that keeps the TAP in another state only calls the
+    state's handler.
+
+    Args:
+        devices: The MockPhysicalJTAGDevices in the chain, the one connected to TDI first.
+        tms: A bitarray of TMS bits, first clocked bit first.
+        tdi: A bitarray of TDI bits as long as tms, first clocked bit first.
+
+    Returns:
+        A bitarray of the TDO bits of the last device, first clocked bit first.
+    """
+    count = len(tms)
+    if not devices:
+        return bitarray(tdi)
+    tdo = bitarray()
+    sm = devices[0].tap
+    if any(dev.tap != sm for dev in devices):
+        #TAPs out of step. Shortcuts assume one shared state.
+        for i in range(count):
+            bit = tdi[i]
+            for dev in devices:
+                bit = dev.shift(tms[i], bit)
+            tdo.append(bit)
+        return tdo
+
+    nextstate = sm._next
+    i = 0
+    while i < count:
+        tmsbit = tms[i]
+        state = sm.state
+        if state in _SHIFT_STATES:
+            if not tmsbit:
+                end = _run_end(tms, i, tmsbit)
+                data = tdi[i:end]
+                for dev in devices:
+                    data = dev.shift_bits(data)
+                tdo += data
+                i = end
+                continue
+        elif nextstate[(sm._state<<1)|tmsbit] == sm._state:
+            end = _run_end(tms, i, tmsbit)
+            for dev in devices:
+                dev.hold(end-i)
+            held = bitarray(end-i)
+            held.setall(False)
+            tdo += held
+            i = end
+            continue
+
+        bit = tdi[i]
+        for dev in devices:
+            bit = dev.shift(tmsbit, bit)
+        tdo.append(bit)
+        i += 1
+    return tdo
+
+
 class MockPhysicalJTAGDevice(object):
     def __init__(self, *, name=None, status=bitarray('11111011'),
                  idcode=bitarray('00000110110101001000000010010011'),
@@ -239,6 +350,15 @@ class MockPhysicalJTAGDevice(object):
     def irlen(self):
         return self._irlen
 
+    @property
+    def tdo(self):
+        """The value on the TDO pin: the bit the next clock shifts out."""
+        if self.tap.state=="SHIFTDR":
+            return self.DR.peek()
+        if self.tap.state=="SHIFTIR":
+            return self.IR.peek()
+        return False
+
     def clearhistory(self):
         self.event_history = []
 
@@ -258,6 +378,29 @@ class MockPhysicalJTAGDevice(object):
         #(self.name,oldstate,self.tap.state,res))
         return res
 
+    def shift_bits(self, tdi):
+        """Clock bits through the device while TMS stays 0 in a SHIFT state.
+
+        Args:
+            tdi: A bitarray of the bits to shift in, first bit first.
+
+        Returns:
+            A bitarray of the TDO bits, first bit first.
+        """
+        reg = self.DR if self.tap.state == "SHIFTDR" else self.IR
+        return reg.shift_bits(tdi)
+
+    def hold(self, count):
+        """Clock count bits that keep the TAP in its current state.
+
+        Only valid outside of the SHIFT states, where no register
+        shifts. The state's handler runs once per bit, like shift.
+        """
+        func = getattr(self, "_"+self.tap.state, None)
+        if func:
+            for _ in range(count):
+                func()
+
     def calc_status_register_val(self):
         #Meant to be overridden
         return self._custom_status
@@ -285,6 +428,8 @@ class MockPhysicalJTAGDevice(object):
         #print(self.name, "** Updated DR: %s"%(drval))
         self.event_history.append("UPDATEDR")
         self.event_history.append(drval)
+    def _PAUSEDR(self):
+        self.event_history.append("PAUSEDR")
     def _CAPTUREIR(self):
         self.event_history.append("CAPTUREIR")
         self.IR.loadData(self.calc_status_register_val())
@@ -295,6 +440,8 @@ class MockPhysicalJTAGDevice(object):
         #      (self.name, irval, insname, regname))
         self.event_history.append("UPDATEIR")
         self.event_history.append(irval)
+    def _PAUSEIR(self):
+        self.event_history.append("PAUSEIR")
 
 
 class MockXC2C256(MockPhysicalJTAGDevice):
@@ -0,0 +1,122 @@
+from .controller import FakeControlTransfer
+
+class VirtualClock(object):
+    """A clock that only moves when told to.
+
+    Calling the clock returns the current time in seconds, like
+    time.perf_counter, so it can be handed to code that times
+    things.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class LatencyHandle(object):
+    """Wraps a fake controller handle to simulate USB transfer time.
+
+    Every control or bulk transfer through the wrapper advances a
+    VirtualClock by a fixed setup latency for its kind of transfer,
+    plus a time per byte moved. With tck set, the time to clock every
+    TCK the transfer caused at the controller's current speed (as set
+    by the driver's SET_SPEED) is added too. Everything else is passed
+    to the wrapped handle.
+
+    The simulated time of each CommandQueue flush is recorded in
+    flush_times for every chain passed to watch.
+
+    Attributes:
+        handle: The fake handle (FakeDevHandle, FakeXPCU1Handle, ...) to wrap.
+        clock: The VirtualClock to advance.
+        control_latency: Seconds each control transfer takes before any data moves.
+        bulk_latency: Seconds each bulk transfer takes before any data moves.
+        byte_time: Seconds it takes to move each byte.
+        tck: A boolean for if the TCK cycles of each transfer are charged for.
+        transfer_count: The number of transfers made.
+        flush_times: A list of the simulated seconds each watched flush took.
+    """
+    def __init__(self, handle, clock, *, transfer_latency=125e-6,
+                 control_latency=None, bulk_latency=None,
+                 byte_time=8/12e6, bytes_per_second=None, tck=False):
+        """Create a handle wrapper with a timing model.
+
+        Args:
+            handle: The fake handle to wrap.
+            clock: The VirtualClock to advance.
+            transfer_latency: Default for control_latency and bulk_latency.
+            control_latency: Seconds of setup per control transfer.
+            bulk_latency: Seconds of setup per bulk transfer.
+            byte_time: Seconds per byte moved.
+            bytes_per_second: Sets byte_time to 1/bytes_per_second if given.
+            tck: A boolean for if TCK cycles are charged for.
+        """
+        self.handle = handle
+        self.clock = clock
+        self.control_latency = transfer_latency \
+                               if control_latency is None else control_latency
+        self.bulk_latency = transfer_latency \
+                            if bulk_latency is None else bulk_latency
+        self.byte_time = byte_time if bytes_per_second is None \
+                         else 1/bytes_per_second
+        self.tck = tck
+        self.transfer_count = 0
+        self.flush_times = []
+        self._flush_start = None
+
+    def __getattr__(self, name):
+        attr = getattr(self.handle, name)
+        if name == 'getTransfer':
+            #Async transfers must also be charged for.
+            return lambda: FakeControlTransfer(self)
+        return attr
+
+    def _charge(self, latency, bytecount, tck_count):
+        self.transfer_count += 1
+        seconds = latency + bytecount*self.byte_time
+        if self.tck:
+            seconds += (self.handle.tck_count-tck_count)/\
+                       self.handle.tck_frequency
+        self.clock.advance(seconds)
+
+    def controlWrite(self, request_type, request, value, index, data,
+                     timeout=0):
+        tck_count = self.handle.tck_count
+        res = self.handle.controlWrite(request_type, request, value,
+                                       index, data, timeout)
+        self._charge(self.control_latency, len(data), tck_count)
+        return res
+
+    def controlRead(self, request_type, request, value, index, length,
+                    timeout=0):
+        tck_count = self.handle.tck_count
+        res = self.handle.controlRead(request_type, request, value,
+                                      index, length, timeout)
+        self._charge(self.control_latency, length, tck_count)
+        return res
+
+    def bulkWrite(self, endpoint, data, timeout=0):
+        tck_count = self.handle.tck_count
+        res = self.handle.bulkWrite(endpoint, data, timeout)
+        self._charge(self.bulk_latency, len(data), tck_count)
+        return res
+
+    def bulkRead(self, endpoint, length, timeout=0):
+        tck_count = self.handle.tck_count
+        res = self.handle.bulkRead(endpoint, length, timeout)
+        self._charge(self.bulk_latency, length, tck_count)
+        return res
+
+    def watch(self, chain):
+        """Record the simulated time of every flush of a JTAGScanChain
+        in flush_times."""
+        chain._command_queue.flush_listeners.append(self)
+
+    def flush_started(self, queue):
+        self._flush_start = self.clock()
+
+    def flush_finished(self, queue):
+        self.flush_times.append(self.clock()-self._flush_start)
@@ -0,0 +1,293 @@
+"""Record the USB traffic of a controller, and replay it later.
+
+A RecordingUSBDev wraps a usb1.USBDevice (or a fake one). Every
+control and bulk transfer made through the handles it opens is written
+to a binary trace file along with when it started and how long it
+took. A ReplayUSBDev built from that file stands in for the device:
+its handles check that each transfer matches the recorded one and
+answer with the recorded response, so the whole driver and compiler
+stack can be run again without the hardware.
+
+    >>> with RecordingUSBDev(usbdev, "idcode.trace") as dev:
+    ...     chain = JTAGScanChain(getDriverInstanceForDevice(dev))
+    ...     chain.init_chain()
+    >>> dev = ReplayUSBDev("idcode.trace")
+    >>> chain = JTAGScanChain(getDriverInstanceForDevice(dev))
+    >>> chain.init_chain()
+    >>> dev.check_finished()
+
+Trace file layout (little endian): an 8 byte magic, a version byte,
+and the vendor and product IDs (2 bytes each), followed by one record
+per transfer. A record is the transfer kind (byte), start and duration
+in seconds (doubles), the request type or endpoint (byte), request
+(byte), value and index (2 bytes each), the requested length (4
+bytes), the libusb error code or 0 (4 bytes), and the length of the
+data (4 bytes) followed by the data. The data is what was written for
+writes, and what was read for reads.
+"""
+import struct
+from collections import namedtuple
+from time import perf_counter
+
+import usb1
+
+from .controller import FakeControlTransfer
+
+CONTROL_WRITE, CONTROL_READ, BULK_WRITE, BULK_READ = range(4)
+_kind_names = ('controlWrite', 'controlRead', 'bulkWrite', 'bulkRead')
+
+_MAGIC = b'PISCUSBT'
+_file_version = 1
+_HEADER = struct.Struct('<8sBHH')
+_RECORD = struct.Struct('<BddBBHHIiI')
+
+TraceRecord = namedtuple('TraceRecord', [
+    'kind', 'start', 'duration', 'request_type', 'request', 'value',
+    'index', 'length', 'status', 'data'])
+TraceRecord.__doc__ = """One transfer of a trace.
+
+For bulk transfers, request_type is the endpoint, and request, value
+and index are 0. status is the libusb error code the transfer failed
+with, or 0."""
+
+class TraceMismatchError(Exception):
+    """A replayed transfer is not the one recorded."""
+    pass
+
+def read_trace(path):
+    """Read a trace file.
+
+    Returns:
+        A (vendor ID, product ID, list of TraceRecords) tuple.
+    """
+    with open(path, 'rb') as f:
+        dat = f.read()
+    magic, version, vid, pid = _HEADER.unpack_from(dat)
+    if magic != _MAGIC or version != _file_version:
+        raise ValueError("%s is not a version %s USB trace"%
+                         (path, _file_version))
+    records = []
+    offset = _HEADER.size
+    while offset < len(dat):
+        fields = _RECORD.unpack_from(dat, offset)
+        offset += _RECORD.size
+        datalen = fields[-1]
+        records.append(TraceRecord(*fields[:-1],
+                                   data=dat[offset:offset+datalen]))
+        offset += datalen
+    return vid, pid, records
+
+def summarize_trace(records):
+    """Add up where the time of a trace went.
+
+    Returns:
+        A dict with the number of transfers, the bytes sent and
+        received, the seconds spent in transfers (usb_time), and the
+        seconds spent on the host between transfers (host_time).
+    """
+    summary = {'transfers': len(records), 'bytes_out': 0, 'bytes_in': 0,
+               'usb_time': 0.0, 'host_time': 0.0}
+    end = None
+    for rec in records:
+        if rec.kind in (CONTROL_WRITE, BULK_WRITE):
+            summary['bytes_out'] += len(rec.data)
+        else:
+            summary['bytes_in'] += len(rec.data)
+        summary['usb_time'] += rec.duration
+        if end is not None:
+            summary['host_time'] += max(0.0, rec.start-end)
+        end = rec.start+rec.duration
+    return summary
+
+class RecordingUSBDev(object):
+    """Wraps a usb1.USBDevice to record the traffic of its handles.
+
+    Every handle opened is a RecordingHandle writing to the same
+    trace file. The file is complete once close is called (or the
+    with block ends).
+    """
+    def __init__(self, dev, path, *, timer=perf_counter):
+        self.dev = dev
+        self._timer = timer
+        self._t0 = timer()
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, _file_version,
+                                      dev.getVendorID(),
+                                      dev.getProductID()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        return RecordingHandle(self, self.dev.open())
+
+    def getVendorID(self):
+        return self.dev.getVendorID()
+
+    def getProductID(self):
+        return self.dev.getProductID()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def _record(self, kind, start, end, setup, length, status, data):
+        rtype, request, value, index = setup
+        self._file.write(_RECORD.pack(kind, start-self._t0, end-start,
+                                      rtype, request, value, index,
+                                      length, status, len(data)))
+        self._file.write(bytes(data))
+
+class RecordingHandle(object):
+    """A usb1.USBDeviceHandle wrapper that records every transfer.
+
+    Asynchronous control transfers are run synchronously so they can
+    be recorded in order. Everything else is passed to the wrapped
+    handle.
+    """
+    def __init__(self, recorder, handle):
+        self._recorder = recorder
+        self.handle = handle
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def getTransfer(self):
+        return FakeControlTransfer(self)
+
+    def _transfer(self, kind, setup, length, func, *args):
+        timer = self._recorder._timer
+        start = timer()
+        try:
+            res = func(*args)
+        except usb1.USBError as e:
+            self._recorder._record(kind, start, timer(), setup, length,
+                                   e.value, b'')
+            raise
+        data = args[-2] if kind in (CONTROL_WRITE, BULK_WRITE) else res
+        self._recorder._record(kind, start, timer(), setup, length,
+                               0, data)
+        return res
+
+    def controlWrite(self, request_type, request, value, index, data,
+                     timeout=0):
+        return self._transfer(CONTROL_WRITE,
+                              (request_type, request, value, index),
+                              len(data), self.handle.controlWrite,
+                              request_type, request, value, index,
+                              data, timeout)
+
+    def controlRead(self, request_type, request, value, index, length,
+                    timeout=0):
+        return self._transfer(CONTROL_READ,
+                              (request_type, request, value, index),
+                              length, self.handle.controlRead,
+                              request_type, request, value, index,
+                              length, timeout)
+
+    def bulkWrite(self, endpoint, data, timeout=0):
+        return self._transfer(BULK_WRITE, (endpoint, 0, 0, 0), len(data),
+                              self.handle.bulkWrite, endpoint, data,
+                              timeout)
+
+    def bulkRead(self, endpoint, length, timeout=0):
+        return self._transfer(BULK_READ, (endpoint, 0, 0, 0), length,
+                              self.handle.bulkRead, endpoint, length,
+                              timeout)
+
+class ReplayUSBDev(object):
+    """Stands in for the device a trace was recorded from.
+
+    Every handle opened is a ReplayHandle reading from the same
+    position in the trace.
+
+    Attributes:
+        records: The TraceRecords of the trace.
+        position: The index of the next record to replay.
+        clock: A VirtualClock advanced by the recorded duration of each transfer, or None.
+    """
+    def __init__(self, path, *, clock=None):
+        self._vid, self._pid, self.records = read_trace(path)
+        self.position = 0
+        self.clock = clock
+
+    def open(self):
+        return ReplayHandle(self)
+
+    def getVendorID(self):
+        return self._vid
+
+    def getProductID(self):
+        return self._pid
+
+    def check_finished(self):
+        """Raise TraceMismatchError if any recorded transfer was not replayed."""
+        if self.position != len(self.records):
+            raise TraceMismatchError(
+                "%s of %s transfers replayed"%
+                (self.position, len(self.records)))
+
+    def _next(self, kind, setup, length, data=None):
+        if self.position >= len(self.records):
+            raise TraceMismatchError(
+                "Transfer %s (%s%s) is past the end of the trace"%
+                (self.position, _kind_names[kind], setup))
+        rec = self.records[self.position]
+        if rec.kind != kind or\
+           (rec.request_type, rec.request, rec.value, rec.index) != setup or\
+           rec.length != length or\
+           (data is not None and rec.data != bytes(data)):
+            raise TraceMismatchError(
+                "Transfer %s is %s%s but %s%s was recorded"%
+                (self.position, _kind_names[kind], setup,
+                 _kind_names[rec.kind],
+                 (rec.request_type, rec.request, rec.value, rec.index)))
+        self.position += 1
+        if self.clock:
+            self.clock.advance(rec.duration)
+        if rec.status:
+            usb1.raiseUSBError(rec.status)
+        return rec
+
+class ReplayHandle(object):
+    """A usb1.USBDeviceHandle that answers with a trace's responses."""
+    def __init__(self, dev):
+        self._dev = dev
+
+    def controlWrite(self, request_type, request, value, index, data,
+                     timeout=0):
+        self._dev._next(CONTROL_WRITE,
+                        (request_type, request, value, index),
+                        len(data), data)
+        return len(data)
+
+    def controlRead(self, request_type, request, value, index, length,
+                    timeout=0):
+        return self._dev._next(CONTROL_READ,
+                               (request_type, request, value, index),
+                               length).data
+
+    def bulkWrite(self, endpoint, data, timeout=0):
+        self._dev._next(BULK_WRITE, (endpoint, 0, 0, 0), len(data), data)
+        return len(data)
+
+    def bulkRead(self, endpoint, length, timeout=0):
+        return self._dev._next(BULK_READ, (endpoint, 0, 0, 0), length).data
+
+    def getTransfer(self):
+        return FakeControlTransfer(self)
+
+    def claimInterface(self, interface):
+        pass
+
+    def releaseInterface(self, interface):
+        pass
+
+    def setInterfaceAltSetting(self, interface, alt_setting):
+        pass
+
+    def close(self):
+        pass
@@ -1,28 +1,188 @@
 import collections
+import copy
 import functools
+import threading
+import time
+
+CacheInfo = collections.namedtuple(
+   "CacheInfo", ["hits", "misses", "negative_hits", "evictions",
+                 "maxsize", "currsize"])
+
+_MISSING = object()
+
+def _fresh_error(error):
+   '''Get a stored exception ready to raise again. Raising the stored
+   instance itself would add to its traceback every time.
+   '''
+   try:
+      return copy.copy(error)
+   except Exception:
+      # Can not be rebuilt from its args.
+      return error.with_traceback(None)
+
+class LRUCache(object):
+   '''A thread safe dict like cache that keeps at most maxsize entries,
+   dropping the least recently used first. Entries may expire after
+   a time to live (in seconds). Errors can be stored with put_error,
+   and are raised again by get.
+   '''
+   def __init__(self, maxsize=128, ttl=None, timer=time.monotonic):
+      self.maxsize = maxsize
+      self.ttl = ttl
+      self.timer = timer
+      self.lock = threading.RLock()
+      self._data = collections.OrderedDict()
+      self.hits = self.misses = self.negative_hits = self.evictions = 0
+
+   def __len__(self):
+      return len(self._data)
+
+   def __contains__(self, key):
+      return self.get(key, _MISSING, _count=False) is not _MISSING
+
+   def get(self, key, default=None, *, _count=True):
+      with self.lock:
+         entry = self._data.get(key)
+         if entry is not None:
+            expires, failed, value = entry
+            if expires is None or expires > self.timer():
+               self._data.move_to_end(key)
+               if failed:
+                  if _count:
+                     self.negative_hits += 1
+                  raise _fresh_error(value)
+               if _count:
+                  self.hits += 1
+               return value
+            del self._data[key]
+         if _count:
+            self.misses += 1
+         return default
+
+   def _put(self, key, failed, value, ttl):
+      if self.maxsize == 0:
+         return
+      expires = None if ttl is None else self.timer()+ttl
+      with self.lock:
+         self._data[key] = (expires, failed, value)
+         self._data.move_to_end(key)
+         if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+               self._data.popitem(last=False)
+               self.evictions += 1
+
+   def put(self, key, value, ttl=_MISSING):
+      self._put(key, False, value, self.ttl if ttl is _MISSING else ttl)
+
+   def put_error(self, key, error, ttl):
+      '''Store an exception that get will raise until ttl expires.'''
+      self._put(key, True, error, ttl)
+
+   def clear(self):
+      with self.lock:
+         self._data.clear()
+
+   def info(self):
+      with self.lock:
+         return CacheInfo(self.hits, self.misses, self.negative_hits,
+                          self.evictions, self.maxsize, len(self._data))
+
+class _Flight(object):
+   __slots__ = ('event', 'value', 'error')
+   def __init__(self):
+      self.event = threading.Event()
+      self.value = self.error = None
 
 class memoized(object):
    '''Decorator. Caches a function's return value each time it is called.
    If called later with the same arguments, the cached value is returned
    (not reevaluated).
+
+   Can be used bare or with options:
+      maxsize: Maximum number of cached results (least recently used
+         are dropped first). None (the default) is unbounded.
+      ttl: Seconds a result stays valid. None is forever.
+      negative_ttl: Seconds to cache exceptions raised by the function
+         (one of negative_errors), raising them again instead of
+         calling the function. None does not cache errors.
+
+   Concurrent calls with the same arguments wait for the first one
+   instead of calling the function again. Statistics are available
+   from cache_info().
    '''
-   def __init__(self, func):
+   def __new__(cls, func=None, **kwargs):
+      if func is None:
+         return functools.partial(cls, **kwargs)
+      return super(memoized, cls).__new__(cls)
+   def __init__(self, func, *, maxsize=None, ttl=None, negative_ttl=None,
+                negative_errors=(Exception,), timer=time.monotonic):
       self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      for arg in args:
-         if not isinstance(arg, collections.Hashable):
-            # uncacheable. a list, for instance.
-            # better to not cache than blow up.
-            return self.func(*args)
-      if args in self.cache:
-         return self.cache[args]
-      else:
-         value = self.func(*args)
-         self.cache[args] = value
-         return value
+      self.cache = LRUCache(maxsize, ttl, timer)
+      self.negative_ttl = negative_ttl
+      self.negative_errors = negative_errors
+      self._inflight = {}
+      functools.update_wrapper(self, func)
+   def __call__(self, *args, **kwargs):
+      key = args
+      if kwargs:
+         key += (_MISSING,) + tuple(sorted(kwargs.items()))
+      try:
+         hash(key)
+      except TypeError:
+         # uncacheable. a list, for instance.
+         # better to not cache than blow up.
+         return self.func(*args, **kwargs)
+
+      cache = self.cache
+      with cache.lock:
+         value = cache.get(key, _MISSING)
+         if value is not _MISSING:
+            return value
+         flight = self._inflight.get(key)
+         leader = flight is None
+         if leader:
+            flight = self._inflight[key] = _Flight()
+
+      if not leader:
+         flight.event.wait()
+         if flight.error is not None:
+            raise _fresh_error(flight.error)
+         return flight.value
+
+      try:
+         flight.value = self.func(*args, **kwargs)
+         cache.put(key, flight.value)
+         return flight.value
+      except BaseException as e:
+         flight.error = e
+         if self.negative_ttl is not None and \
+            isinstance(e, self.negative_errors):
+            cache.put_error(key, e, self.negative_ttl)
+         raise
+      finally:
+         with cache.lock:
+            del self._inflight[key]
+         flight.event.set()
+   def cache_info(self):
+      return self.cache.info()
+   def cache_clear(self):
+      self.cache.clear()
    def __repr__(self):
       return self.func.__doc__ # pragma: no cover
    def __get__(self, obj, objtype):
       '''Support instance methods.'''
       return functools.partial(self.__call__, obj) # pragma: no cover
+
+class lazy_property(object):
+   '''Decorator. Computes a property on first access and stores the
+   value on the instance, so later accesses are plain attribute reads.
+   '''
+   def __init__(self, func):
+      self.func = func
+      self.__doc__ = func.__doc__
+   def __get__(self, obj, objtype=None):
+      if obj is None:
+         return self # pragma: no cover
+      value = self.func(obj)
+      obj.__dict__[self.func.__name__] = value
+      return value
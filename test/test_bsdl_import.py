@@ -0,0 +1,154 @@
+#-*- coding: utf-8 -*-
+import pytest
+
+from proteusisc.jtagDeviceDescriptionBSDL import tokenize_attributes,\
+    parse_bsdl, bsdl_to_descriptor, import_bsdl_dir, BSDLParseError,\
+    decode_boundary_register
+from proteusisc.jtagDeviceDescriptionStore import JTAGDescriptorStore
+
+SAMPLE_BSDL = """\
+-- BSDL file for a made up CPLD
+--   "quotes" and -- dashes in comments are ignored
+
+entity XC2C256_TQ144 is
+
+generic (PHYSICAL_PIN_MAP : string := "TQ144" );
+
+port (
+	TCK: in bit;
+	TDI: in bit;
+	TDO: out bit;
+	TMS: in bit;
+	P1: inout bit
+);
+
+use STD_1149_1_2001.all;
+
+attribute COMPONENT_CONFORMANCE of XC2C256_TQ144 : entity is
+	"STD_1149_1_1993";
+
+attribute PIN_MAP of XC2C256_TQ144 : entity is PHYSICAL_PIN_MAP;
+
+constant TQ144: PIN_MAP_STRING:=
+	"TCK:48," &
+	"TDI:63," &
+	"P1:1";
+
+attribute TAP_SCAN_IN of TDI : signal is true;
+attribute TAP_SCAN_CLOCK of TCK : signal is (33.0e6, BOTH);
+
+attribute INSTRUCTION_LENGTH of XC2C256_TQ144 : entity is 8;
+
+attribute INSTRUCTION_OPCODE of XC2C256_TQ144 : entity is
+	"BYPASS     ( 11111111 )," &
+	"EXTEST     ( 00000000 )," &
+	"IDCODE     ( 00000001 )," &
+	"HIGHZ      ( 11111100, 11111101 )," & -- two opcodes
+	"ISC_PROGRAM( 11101010 )";
+
+attribute INSTRUCTION_CAPTURE of XC2C256_TQ144 : entity is "XXXXXX01";
+
+attribute IDCODE_REGISTER of XC2C256_TQ144 : entity is
+	"XXXX" &		-- version
+	"0110" &		-- part number
+	"1101" &
+	"0100" &
+	"1XXX" &
+	"00001001001" &	-- manufacturer
+	"1";
+
+attribute REGISTER_ACCESS of XC2C256_TQ144 : entity is
+	"BYPASS ( BYPASS, HIGHZ )," &
+	"DATAREG[1371] ( ISC_PROGRAM )," &
+	"BOUNDARY ( EXTEST )";
+
+attribute BOUNDARY_LENGTH of XC2C256_TQ144 : entity is 3;
+
+attribute BOUNDARY_REGISTER of XC2C256_TQ144 : entity is
+	"2 (BC_4, P1, input, X)," &
+	"1 (BC_1, *, output3, X, 0, 1, Z)," &
+	"0 (BC_1, *, control, 0)";
+
+end XC2C256_TQ144;
+"""
+
+def test_tokenize_attributes():
+    entity, attribs = tokenize_attributes(SAMPLE_BSDL)
+    assert entity == "XC2C256_TQ144"
+    assert attribs['INSTRUCTION_LENGTH'] == 8
+    assert attribs['TAP_SCAN_IN'] is True
+    assert attribs['COMPONENT_CONFORMANCE'] == "STD_1149_1_1993"
+    assert attribs['IDCODE_REGISTER'] == \
+        "XXXX0110110101001XXX000010010011"
+    assert attribs['INSTRUCTION_OPCODE'].startswith(
+        "BYPASS(11111111),EXTEST(00000000),")
+    #Words stay separated, everything else is packed.
+    entity, attribs = tokenize_attributes(
+        'attribute DESIGN_WARNING of X : entity is "Do not ( use ) it";')
+    assert attribs['DESIGN_WARNING'] == "Do not(use)it"
+
+def test_tokenize_mixed_value_keeps_order():
+    entity, attribs = tokenize_attributes(
+        'attribute A of X : entity is (1.0e6, "x") & BOTH;')
+    assert attribs['A'] == "(1.0e6, x ) BOTH"
+    entity, attribs = tokenize_attributes(
+        'attribute A of X : entity is 5 "a";')
+    assert attribs['A'] == "5 a"
+
+def test_tokenize_unterminated_attribute():
+    #Used to backtrack exponentially in the number of comment lines.
+    text = 'attribute A of X : entity is "1"\n' + \
+        '-- a comment - with, punctuation\n'*40
+    assert tokenize_attributes(text) == (None, {})
+    entity, attribs = tokenize_attributes(
+        text+'  & "2" -- ; \n ;\nentity X is')
+    assert entity == "X" and attribs == {'A': "12"}
+
+def test_parse_bsdl():
+    entity, attribs = parse_bsdl(SAMPLE_BSDL)
+    assert attribs['INSTRUCTION_OPCODE'] == {
+        'BYPASS': '11111111', 'EXTEST': '00000000', 'IDCODE': '00000001',
+        'HIGHZ': '11111100', 'ISC_PROGRAM': '11101010'}
+    assert attribs['REGISTERS'] == {'BYPASS': 1, 'DEVICE_ID': 32,
+                                    'BOUNDARY': 3, 'DATAREG': 1371}
+    assert attribs['INSTRUCTION_TO_REGISTER'] == {
+        'BYPASS': 'BYPASS', 'HIGHZ': 'BYPASS', 'EXTEST': 'BOUNDARY',
+        'ISC_PROGRAM': 'DATAREG'}
+    assert decode_boundary_register(attribs['BOUNDARY_REGISTER'])[1] == \
+        ['BC_1', '*', 'output3', 'X', '0', '1', 'Z']
+
+def test_parse_bsdl_missing_attribute():
+    with pytest.raises(BSDLParseError):
+        parse_bsdl(SAMPLE_BSDL.replace("INSTRUCTION_LENGTH", "FOO"))
+
+def test_bsdl_to_descriptor():
+    desc = bsdl_to_descriptor(SAMPLE_BSDL)
+    assert desc._device_name == "XC2C256_TQ144"
+    assert desc._ir_length == 8
+    assert desc._instructions['IDCODE'].to01() == '00000001'
+    assert desc.does_descriptor_apply_to_idcode(0x06D4A093)
+    assert 'boundary_register' not in desc.__dict__
+    assert desc.boundary_register[0] == \
+        ['BC_1', '*', 'control', '0']
+
+def test_import_bsdl_dir(tmpdir):
+    lib = tmpdir.mkdir("lib")
+    for i in range(8):
+        sub = lib.ensure_dir("vendor%s"%(i%2))
+        sub.join("dev%s.bsd"%i).write(SAMPLE_BSDL.replace(
+            '"0110" &', '"%s" &'%bin(i)[2:].zfill(4)))
+    lib.join("broken.bsd").write("entity BROKEN is end BROKEN;")
+    lib.join("readme.txt").write("not bsdl")
+
+    store = JTAGDescriptorStore(str(tmpdir.join("descr.db")))
+    count, failed = import_bsdl_dir(str(lib), store=store, processes=2)
+    assert count == 8
+    assert list(failed) == [str(lib.join("broken.bsd"))]
+    assert len(store) == 8
+    assert store.find(0x00D4A093)['name'] == "XC2C256_TQ144"
+    assert store.find(0x07D4A093)['ir_length'] == 8
+
+    #Parsing in process gives the same result.
+    store = JTAGDescriptorStore(str(tmpdir.join("descr2.db")))
+    assert import_bsdl_dir(str(lib), store=store, processes=1) == \
+        (count, failed)
@@ -0,0 +1,95 @@
+#-*- coding: utf-8 -*-
+import pytest
+
+from proteusisc import calibration
+from proteusisc.bittypes import bitarray
+from proteusisc.contracts import ARBITRARY, NOCARE, ONE
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.test_utils import FakeDevHandle, FakeUSBDev,\
+    MockPhysicalJTAGDevice, VirtualClock, LatencyHandle
+
+@pytest.fixture(autouse=True)
+def calib_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(calibration, 'base_calib_dir', str(tmpdir))
+    return tmpdir
+
+def _make_chain(**kwargs):
+    clock = VirtualClock()
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'))
+    handle = LatencyHandle(FakeDevHandle(d0), clock,
+                           transfer_latency=1e-3, byte_time=1e-6)
+    c = getDriverInstanceForDevice(FakeUSBDev(handle))
+    return JTAGScanChain(c, **kwargs), clock, handle
+
+def test_fit_line():
+    a, b = calibration._fit_line([(8, 18), (64, 130), (512, 1026)])
+    assert a == pytest.approx(2)
+    assert b == pytest.approx(2)
+
+def test_calibrate_fits_latency_model():
+    chain, clock, handle = _make_chain()
+    chain.jtag_enable()
+    costs = chain.calibrate(clock=clock)
+    chain.jtag_disable()
+
+    #Every Digilent transfer is at least a command write and a
+    #status read, followed by the data and the transfer stats.
+    for name, primcosts in costs.items():
+        assert primcosts['prim'] >= 4000000, name
+    #Reading adds one bulk read per transfer.
+    tms = costs['DigilentWriteTMSPrimitive']
+    assert tms['read_msg'] == pytest.approx(1000000, rel=0.01)
+    assert tms['clock_bit'] == 125 #1 byte per 8 bits
+    #The clock tick transfer carries no per bit payload.
+    assert costs['DigilentClockTickPrimitive']['clock_bit'] == 0
+
+    base = {p.__name__: p for p in chain._lv1_base_primitives}
+    calibrated = {p.__name__: p for p in chain._lv1_chain_primitives}
+    tmsprim = calibrated['DigilentWriteTMSPrimitive']
+    assert issubclass(tmsprim, base['DigilentWriteTMSPrimitive'])
+    assert tmsprim._COST_PRIM == tms['prim']
+    assert tmsprim._calc_score(100, (ARBITRARY, NOCARE, ONE), 100) == \
+        tms['prim']+tms['read_msg']+100*(tms['clock_bit']+tms['read_bit'])
+    assert chain.get_prim('write_tms') is tmsprim
+
+    #The chain still works with the calibrated primitives.
+    chain.init_chain()
+    assert len(chain._devices) == 1
+
+def test_calibration_is_stored_per_controller(calib_dir):
+    chain, clock, handle = _make_chain()
+    chain.jtag_enable()
+    costs = chain.calibrate(clock=clock)
+    assert calib_dir.join(
+        "DigilentAdeptController_10146D508907.json").check()
+
+    chain2, clock2, handle2 = _make_chain()
+    chain2.jtag_enable()
+    count = handle2.transfer_count
+    assert chain2.calibrate(clock=clock2) == costs
+    assert handle2.transfer_count == count
+
+    chain2.calibrate(recalibrate=True, clock=clock2)
+    assert handle2.transfer_count > count
+
+def test_calibrate_on_jtag_enable():
+    chain, clock, handle = _make_chain(calibrate_costs=True)
+    chain.init_chain()
+    assert len(chain._devices) == 1
+    assert all(getattr(p, '_calibrated_from', None)
+               for p in chain._lv1_chain_primitives)
+    assert calibration.load_lv1_costs(chain._controller) is not None
+
+def test_unmeasured_prims_are_scaled():
+    chain, clock, handle = _make_chain()
+    costs = {p.__name__: {'prim': p._COST_PRIM*1000, 'clock_bit': 0,
+                          'read_msg': 0, 'read_bit': 0}
+             for p in chain._lv1_base_primitives}
+    costs['DigilentClockTickPrimitive'] = None
+    calibration.apply_lv1_costs(chain, costs)
+    tick = chain.get_prim('tick_clock')
+    basetick = tick._calibrated_from
+    assert basetick in chain._lv1_base_primitives
+    assert tick._COST_PRIM == basetick._COST_PRIM*1000
+    assert tick._COST_READ_MSG == basetick._COST_READ_MSG*1000
@@ -0,0 +1,82 @@
+#-*- coding: utf-8 -*-
+import json
+import struct
+
+import pytest
+
+from proteusisc import chainTopology, jtagDeviceDescription
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.jtagUtils import parse_idcode_scan
+from proteusisc.test_utils import FakeDevHandle, FakeUSBDev,\
+    MockPhysicalJTAGDevice, VirtualClock, LatencyHandle
+
+codes = (
+    bitarray('00000110110101001000000010010011'),
+    bitarray('01000110110101001000000010010011'),
+    bitarray('10000110110101001000000010010011'),
+)
+
+@pytest.fixture(autouse=True)
+def topology_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(chainTopology, 'base_topology_dir', str(tmpdir))
+    return tmpdir
+
+def _make_chain(*idcodes):
+    devs = [MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+            for i, code in enumerate(idcodes)]
+    handle = LatencyHandle(FakeDevHandle(*devs), VirtualClock())
+    c = getDriverInstanceForDevice(FakeUSBDev(handle))
+    return JTAGScanChain(c, cache_topology=True), handle
+
+def _ids(chain):
+    return [dev._id for dev in chain._devices]
+
+def _expected_ids(idcodes):
+    return [struct.unpack("<L", code.tobytes()[::-1])[0]
+            for code in idcodes]
+
+def test_expected_idcode_scan():
+    bits = chainTopology.expected_idcode_scan(_expected_ids(codes))
+    assert parse_idcode_scan(bits) == list(reversed(codes))
+
+def test_topology_reused(topology_dir, monkeypatch):
+    chain, handle = _make_chain(*codes)
+    chain.init_chain()
+    assert _ids(chain) == _expected_ids(codes)
+    path = topology_dir.join("DigilentAdeptController_10146D508907.json")
+    dat = json.loads(path.read())
+    assert [d['idcode'] for d in dat['devices']] == _expected_ids(codes)
+    assert [d['ir_length'] for d in dat['devices']] == [8, 8, 8]
+
+    chain2, handle2 = _make_chain(*codes)
+    def no_lookup(idcode):
+        raise AssertionError("Descriptor looked up for %08X"%idcode)
+    monkeypatch.setattr(jtagDeviceDescription, 'get_descriptor_for_idcode',
+                        no_lookup)
+    chain2.init_chain()
+    assert _ids(chain2) == _expected_ids(codes)
+    assert chain2._devices[1]._desc._ir_length == 8
+    assert handle2.transfer_count <= handle.transfer_count
+
+def test_topology_mismatch_rediscovers(topology_dir):
+    chain, _ = _make_chain(*codes[:2])
+    chain.init_chain()
+
+    chain2, _ = _make_chain(*codes)
+    chain2.init_chain()
+    assert _ids(chain2) == _expected_ids(codes)
+    stored = chainTopology.load_topology(chain2._controller)
+    assert [idcode for idcode, _ in stored] == _expected_ids(codes)
+
+    chain3, _ = _make_chain(codes[2])
+    chain3.init_chain()
+    assert _ids(chain3) == _expected_ids(codes[2:])
+
+def test_topology_ignores_bad_file(topology_dir):
+    topology_dir.join("DigilentAdeptController_10146D508907.json")\
+                .write("{")
+    chain, _ = _make_chain(*codes)
+    chain.init_chain()
+    assert _ids(chain) == _expected_ids(codes)
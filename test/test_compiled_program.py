@@ -0,0 +1,217 @@
+#-*- coding: utf-8 -*-
+import pytest
+
+from proteusisc.bittypes import bitarray, ConstantBitarray
+from proteusisc.compiledProgram import CompiledProgram, _encode, _decode,\
+    SCALAR, CONSTANT, RAW, RLE
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.errors import CompiledProgramError, PollTimeoutError
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.test_utils import FakeDevHandle, FakeXPCU1Handle,\
+    FakeUSBDev, MockPhysicalJTAGDevice
+
+codes = (
+    bitarray('00000110110101001000000010010011'),
+    bitarray('01000110110101001000000010010011'),
+)
+
+def _chain(handle_class, idcodes=codes):
+    ctrl = handle_class(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                          for i, code in enumerate(idcodes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.init_chain()
+    return chain
+
+def _queue(chain):
+    d0, d1 = chain._devices
+    chain.transition_tap("TLR")
+    a, _ = d0.run_instruction("IDCODE", read=True)
+    b, _ = d1.run_instruction("BYPASS", data=bitarray('1'), read=True)
+    chain.sleep(delay=1)
+    c, _ = d0.run_instruction("IDCODE", read=True)
+    return [a, b, c]
+
+@pytest.mark.parametrize("handle_class", [FakeDevHandle, FakeXPCU1Handle])
+def test_compiled_program(tmpdir, handle_class):
+    chain = _chain(handle_class)
+    program = chain.compile_program()
+    assert len(chain._command_queue) == 0
+    program = chain.compile_program()
+    assert program.op_count == 0
+
+    _queue(chain)
+    program = chain.compile_program()
+    assert program.read_count == 3
+    assert program.start_state == "_PRE5"
+    assert program.end_state == chain._sm.state
+    path = str(tmpdir.join("idcode.jobj"))
+    program.save(path)
+
+    chain.jtag_enable()
+    promises = _queue(chain)
+    expected = [p() for p in promises]
+    assert all(expected)
+    chain.jtag_disable()
+
+    chain.jtag_enable()
+    loaded = CompiledProgram.load(path)
+    assert loaded.tobytes() == program.tobytes()
+    assert loaded.run(chain) == expected
+    assert chain._sm.state == loaded.end_state
+    #The same program again, from the state the last run left.
+    assert loaded.run(chain) == expected
+    chain.jtag_disable()
+
+def test_compiled_program_wrong_chain():
+    program = _chain(FakeDevHandle).compile_program()
+    chain = _chain(FakeDevHandle, codes[:1])
+    chain.jtag_enable()
+    with pytest.raises(CompiledProgramError):
+        program.run(chain)
+    chain.jtag_disable()
+
+    chain = _chain(FakeXPCU1Handle)
+    _queue(chain)
+    program = chain.compile_program()
+    chain = _chain(FakeDevHandle)
+    chain.jtag_enable()
+    with pytest.raises(CompiledProgramError):
+        program.run(chain)
+    chain.jtag_disable()
+
+    with pytest.raises(CompiledProgramError):
+        CompiledProgram(b'PISCUSBT'+bytes(64))
+
+@pytest.mark.parametrize("value, kind", [
+    (True, SCALAR),
+    (ConstantBitarray(True, 50), CONSTANT),
+    (bitarray('1101000110'), RAW),
+    (bitarray('1'*1000+'0'*3000+'1'*7), RLE),
+    (bitarray('0'*5000+'1'), RLE),
+])
+def test_compiled_program_encoding(value, kind):
+    payload = bytearray(b'xx')
+    count = len(value) if kind != SCALAR else 8
+    encoding, offset = _encode(value, count, payload)
+    assert encoding&0xF == kind
+    decoded = _decode(bytes(payload), 0, encoding, offset, count)
+    if kind == SCALAR:
+        assert decoded is value
+    else:
+        assert list(decoded) == list(value)
+
+def _build(chain, ir, dr):
+    chain.rw_ir(data=ir)
+    chain.rw_dr(data=dr, read=True)
+
+@pytest.mark.parametrize("handle_class", [FakeDevHandle, FakeXPCU1Handle])
+def test_prepared_program(handle_class):
+    chain = _chain(handle_class)
+    chain.jtag_enable()
+    chain.transition_tap("RTI")
+    chain.flush()
+    prog = chain.prepare(_build, ir=16, dr=70)
+    assert chain._sm.state == "RTI"
+
+    for ir, dr in (('0000000100000001', '1'*70),
+                   ('1111111111111111', '10'*35),
+                   ('0000000111111111', '0'*69+'1')):
+        ir, dr = bitarray(ir), bitarray(dr)
+        #Registers read back what the scan before left in them, so
+        #follow the same scan both ways.
+        prog(ir=ir, dr=dr)
+        chain.transition_tap("RTI")
+        chain.rw_ir(data=ir)
+        promise = chain.rw_dr(data=dr, read=True)
+        assert prog(ir=ir, dr=dr) == [promise()]
+    chain.jtag_disable()
+
+def test_prepared_program_errors():
+    chain = _chain(FakeDevHandle)
+    chain.jtag_enable()
+    prog = chain.prepare(_build, ir=16, dr=8)
+    with pytest.raises(CompiledProgramError):
+        prog(ir=bitarray('1'*16))
+    with pytest.raises(CompiledProgramError):
+        prog(ir=bitarray('1'*16), dr=bitarray('1'*9))
+
+    def depends_on_data(chain, dr):
+        chain.rw_dr(data=dr[:4] if dr[0] else dr)
+    with pytest.raises(CompiledProgramError):
+        chain.prepare(depends_on_data, dr=8)
+
+    def no_hole(chain, dr):
+        chain.rw_dr(data=bitarray('1'*8))
+    with pytest.raises(CompiledProgramError):
+        chain.prepare(no_hole, dr=8)
+
+    chain.transition_tap("RTI")
+    with pytest.raises(CompiledProgramError):
+        chain.prepare(_build, ir=16, dr=8)
+    chain.jtag_disable()
+
+class _BusyDevice(MockPhysicalJTAGDevice):
+    """Reports busy (status bit 2 set) until its IR has been updated busy times."""
+    def __init__(self, *args, busy, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.busy = busy
+        self.ir_updates = 0
+
+    def calc_status_register_val(self):
+        if self.ir_updates < self.busy:
+            return bitarray('00000101')
+        return bitarray('00000001')
+
+    def _UPDATEIR(self):
+        super()._UPDATEIR()
+        self.ir_updates += 1
+
+def _busy_chain(handle_class, busy):
+    devs = [_BusyDevice(name="D%s"%i, idcode=code, busy=busy)
+            for i, code in enumerate(codes)]
+    chain = JTAGScanChain(getDriverInstanceForDevice(
+        FakeUSBDev(handle_class(*devs))))
+    chain.init_chain()
+    chain.jtag_enable()
+    for dev in devs:
+        dev.ir_updates = 0
+    return chain, devs
+
+def _read_status(chain):
+    #Loads the instruction, then reads the status: two IR updates a try.
+    return chain._devices[0].run_instruction(
+        "BYPASS", read_status=True)[1]
+
+@pytest.mark.parametrize("handle_class", [FakeDevHandle, FakeXPCU1Handle])
+def test_poll(handle_class):
+    chain, devs = _busy_chain(handle_class, busy=6)
+    res, tries = chain.poll(_read_status, mask=bitarray('00000100'),
+                            value=bitarray('00000000'), timeout=5)
+    assert tries == 4
+    assert res == bitarray('00000001')
+    assert devs[0].ir_updates == 8
+    assert chain._sm.state == 'RTI'
+    assert len(chain._command_queue) == 0
+
+    devs[0].ir_updates = 0
+    res, tries = chain.poll(_read_status, value=bitarray('00000001'))
+    assert tries == 4
+    chain.jtag_disable()
+
+def test_poll_errors():
+    chain, devs = _busy_chain(FakeDevHandle, busy=10**6)
+    with pytest.raises(PollTimeoutError):
+        chain.poll(_read_status, mask=bitarray('00000100'),
+                   value=bitarray('00000000'), timeout=0.05)
+    assert chain._sm.state == 'RTI'
+
+    def no_read(chain):
+        chain._devices[0].run_instruction("BYPASS")
+    with pytest.raises(CompiledProgramError):
+        chain.poll(no_read, value=bitarray('1'))
+
+    chain.rw_ir(data=bitarray('1'*16))
+    program = chain.compile_program()
+    with pytest.raises(CompiledProgramError):
+        program.poll(chain, 0, value=bitarray('1'))
+    chain.jtag_disable()
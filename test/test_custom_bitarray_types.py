@@ -361,6 +361,15 @@ def test_composite_split_prepare_preferfalse_nopreserve():
     assert bitarray(iter(bits.prepare(reqef=ONE, primef=ARBITRARY))) ==\
         bitarray('111100000')
 
+def test_composite_prepare_constant_bitarray_components():
+    bits = CompositeBitarray(bitarray('11')) + bitarray('111')
+    assert bits.prepare(reqef=ONE, primef=CONSTANT) == \
+        ConstantBitarray(True, 5)
+
+    bits = CompositeBitarray(bitarray('00')) + bitarray('000')
+    assert bits.prepare(reqef=ZERO, primef=CONSTANT) == \
+        ConstantBitarray(False, 5)
+
 def test_composite_split_prepare_clip_edge_preserve():
     ab = PreferFalseBitarray(2) + (ConstantBitarray(True, 1)+PreferFalseBitarray(3))
     l,r = ab.split(1)
@@ -813,6 +822,10 @@ def test_Composite_tobytes():
                            ConstantBitarray(True, 19))
     assert c1.tobytes() == b'\x6C\xFF\xFF\xE0'
 
+    c1 = CompositeBitarray(bitarray('01101100'),
+                           ConstantBitarray(True, 16))
+    assert c1.tobytes() == b'\x6C\xFF\xFF'
+
 def test_Constant_iter():
     c1 = ConstantBitarray(True, 3)
     assert list(iter(c1)) == [True]*3
@@ -0,0 +1,121 @@
+#-*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+from proteusisc import jtagDeviceDescription
+from proteusisc.jtagDeviceDescriptionStore import JTAGDescriptorStore,\
+    idcode_pattern_to_mask
+
+def _descr(pattern, name):
+    return {
+        '_file_version': 1,
+        'idcode': pattern,
+        'name': name,
+        'ir_length': 2,
+        'instruction_opcodes': {'BYPASS': '11', 'IDCODE': '01'},
+        'registers': {'BYPASS': 1, 'DEVICE_ID': 32},
+        'instruction_register_map': {'BYPASS': 'BYPASS',
+                                     'IDCODE': 'DEVICE_ID'},
+    }
+
+def test_idcode_pattern_to_mask():
+    assert idcode_pattern_to_mask('X'*4+'1'*4+'0'*24) == \
+        (0x0FFFFFFF, 0x0F000000)
+    with pytest.raises(ValueError):
+        idcode_pattern_to_mask('1234')
+
+def test_store_find_most_specific(tmpdir):
+    store = JTAGDescriptorStore(str(tmpdir.join("descr.db")))
+    store.add(_descr('XXXX0110110101001XXX000010010011', 'FAMILY'))
+    store.add(_descr('XXXX0110110101001010000010010011', 'EXACT'))
+    store.add(_descr('0001000111000010111000001001001X', 'NOPE'))
+    assert len(store) == 3
+
+    assert store.find(0x06D4A093)['name'] == 'EXACT'
+    assert store.find(0xF6D4A093)['name'] == 'EXACT'
+    assert store.find(0x06D4E093)['name'] == 'FAMILY'
+    assert store.find(0x06D5E093) is None
+
+    #Replacing a pattern keeps one entry.
+    store.add(_descr('XXXX0110110101001010000010010011', 'EXACT2'))
+    assert len(store) == 3
+    assert store.find(0x06D4A093)['name'] == 'EXACT2'
+
+def test_store_many_descriptors(tmpdir):
+    store = JTAGDescriptorStore(str(tmpdir.join("descr.db")))
+    store.add_many(_descr('XXXX'+bin(i)[2:].zfill(16)+'000000000001',
+                          'DEV%s'%i) for i in range(3000))
+    assert len(store) == 3000
+    assert store.find((1234<<12)|1)['name'] == 'DEV1234'
+    assert store.find((1234<<12)|3) is None
+
+def test_store_imports_legacy_dir(tmpdir):
+    legacy = tmpdir.mkdir("jtag_descr")
+    oldfile = legacy.join('XXXX0110110101001XXX000010010011.json')
+    oldfile.write(
+        json.dumps(_descr('XXXX0110110101001XXX000010010011', 'OLD')))
+    legacy.join('notes.txt').write('not a descriptor')
+    legacy.join('broken.json').write('{')
+    dbpath = str(tmpdir.join("descr.db"))
+
+    store = JTAGDescriptorStore(dbpath, legacy_dir=str(legacy))
+    assert len(store) == 1
+    assert store.find(0x06D4E093)['name'] == 'OLD'
+    #Nothing changed, nothing to import.
+    assert store.import_legacy_dir(str(legacy)) == 0
+    store.close()
+
+    newfile = legacy.join('XXXX0001110000101110000010010011.json')
+    newfile.write(json.dumps(
+        _descr('XXXX0001110000101110000010010011', 'NEW')))
+    store = JTAGDescriptorStore(dbpath, legacy_dir=str(legacy))
+    assert len(store) == 2
+    assert store.find(0x01C2E093)['name'] == 'NEW'
+    store.close()
+
+    #Editing a file in place leaves the directory mtime alone.
+    dirstat = os.stat(str(legacy))
+    oldfile.write(json.dumps(
+        _descr('XXXX0110110101001XXX000010010011', 'EDITED')))
+    filestat = os.stat(str(oldfile))
+    os.utime(str(oldfile), (filestat.st_atime, filestat.st_mtime+10))
+    os.utime(str(legacy), (dirstat.st_atime, dirstat.st_mtime))
+    store = JTAGDescriptorStore(dbpath, legacy_dir=str(legacy))
+    assert len(store) == 2
+    assert store.find(0x06D4E093)['name'] == 'EDITED'
+
+def test_get_descriptor_for_idcode_uses_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(jtagDeviceDescription, 'base_descr_dir',
+                        str(tmpdir.join("jtag_descr")))
+    monkeypatch.setattr(jtagDeviceDescription, 'base_descr_db',
+                        str(tmpdir.join("descr.db")))
+    store = jtagDeviceDescription.get_descriptor_store()
+    store.add(_descr('XXXX1010101010101010101010101011', 'STORED'))
+
+    desc = jtagDeviceDescription.get_descriptor_for_idcode(0x1AAAAAAB)
+    assert desc._device_name == 'STORED'
+    assert desc._ir_length == 2
+
+def test_descriptor_compact_round_trip():
+    JTAGDeviceDescription = jtagDeviceDescription.JTAGDeviceDescription
+    old = JTAGDeviceDescription._load(
+        _descr('XXXX0110110101001XXX000010010011', 'OLD'))
+    dat = old._dump()
+    assert dat['_file_version'] == JTAGDeviceDescription.version
+    assert dat['opcodes'] == '1101'
+    assert dat['boundary_register'] is None
+
+    desc = JTAGDeviceDescription._load(json.loads(json.dumps(dat)))
+    assert '_instructions' not in desc.__dict__
+    assert desc._instructions['IDCODE'].to01() == '01'
+    assert dict(desc._registers) == {'BYPASS': 1, 'DEVICE_ID': 32}
+    assert desc._registers.get('BOUNDARY') is None
+    assert dict(desc._instruction_register_map) == \
+        {'BYPASS': 'BYPASS', 'IDCODE': 'DEVICE_ID'}
+    assert desc.boundary_register is None
+    assert desc._dump() == dat
+
+    dat['_file_version'] = 99
+    assert JTAGDeviceDescription._load(dat) is None
@@ -0,0 +1,133 @@
+#-*- coding: utf-8 -*-
+import pytest
+
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.errors import JTAGControlError
+from proteusisc.flushPolicy import FlushPolicy, estimate_bytes
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.test_utils import FakeDevHandle, FakeUSBDev,\
+    MockPhysicalJTAGDevice, VirtualClock
+
+codes = (
+    bitarray('00000110110101001000000010010011'),
+    bitarray('01000110110101001000000010010011'),
+)
+
+def _chain(policy):
+    ctrl = FakeDevHandle(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                           for i, code in enumerate(codes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)),
+                          flush_policy=policy)
+    chain.init_chain()
+    chain.jtag_enable()
+    chain.transition_tap("RTI")
+    chain.flush()
+    return chain
+
+def test_flush_policy_prims():
+    policy = FlushPolicy(max_prims=3)
+    chain = _chain(policy)
+    queue = chain._command_queue
+    for _ in range(8):
+        chain.rw_dr(data=bitarray('10'))
+        assert len(queue) <= 3
+        assert policy.prims == len(queue)
+    assert policy.triggered == {'prims': 2, 'bits': 0, 'bytes': 0, 'age': 0}
+    assert policy.bits == 2*len(queue)
+
+    #Reading a promise flushes everything it needs as usual.
+    a = chain.rw_dr(data=bitarray('01'), read=True)
+    assert len(a()) == 2
+    assert policy.prims == len(queue) == 0
+
+def test_flush_policy_safe_cut_points():
+    policy = FlushPolicy(max_prims=1)
+    chain = _chain(policy)
+    queue = chain._command_queue
+    d0, d1 = chain._devices
+
+    #Device primitives staged together are aligned, so they are not
+    #flushed until something else is staged.
+    a, _ = d0.run_instruction("IDCODE", read=True)
+    b, _ = d1.run_instruction("IDCODE", read=True)
+    assert len(queue) == 2
+    assert policy.deferred == 1
+    chain.transition_tap("RTI")
+    assert a._value == codes[0] and b._value == codes[1]
+    assert len(queue) == 0
+
+    #Nor is an open register scan.
+    chain.rw_dr(data=bitarray('1'), lastbit=False)
+    chain.rw_dr(data=bitarray('1'), lastbit=False)
+    assert len(queue) == 2
+    assert policy.deferred == 2
+    chain.rw_dr(data=bitarray('0'))
+    assert len(queue) == 0
+    assert policy.triggered['prims'] == 2
+
+def test_flush_policy_device_prims():
+    policy = FlushPolicy(max_prims=10)
+    chain = _chain(policy)
+    queue = chain._command_queue
+    d0 = chain._devices[0]
+
+    #A run of device primitives is kept whole until the limit is
+    #passed twice over, then cut anyway.
+    for _ in range(300):
+        d0.run_instruction("IDCODE")
+        assert len(queue) <= 20
+    assert policy.triggered['prims'] == 14
+    assert policy.deferred == 14*10
+    a, _ = d0.run_instruction("IDCODE", read=True)
+    assert a() == codes[0]
+
+def test_flush_policy_bits_bytes_age():
+    policy = FlushPolicy(max_bits=64)
+    chain = _chain(policy)
+    for _ in range(3):
+        chain.rw_dr(data=bitarray('1'*30))
+    assert policy.triggered['bits'] == 1
+    assert policy.bits == 0
+
+    policy = FlushPolicy(max_bytes=3*estimate_bytes(
+        chain.get_prim('rw_dr')(data=bitarray('1'*800), _chain=chain)))
+    chain = _chain(policy)
+    for _ in range(4):
+        chain.rw_dr(data=bitarray('1'*800))
+    assert policy.triggered['bytes'] == 1
+    assert policy.prims == 0
+
+    clock = VirtualClock()
+    policy = FlushPolicy(max_age=1, clock=clock)
+    chain = _chain(policy)
+    chain.rw_dr(data=bitarray('1'))
+    clock.advance(0.5)
+    chain.rw_dr(data=bitarray('1'))
+    assert policy.prims == 2
+    clock.advance(0.6)
+    chain.rw_dr(data=bitarray('1'))
+    assert policy.triggered['age'] == 1
+    assert policy.prims == 0
+
+def test_flush_listeners_told_of_failed_flush(monkeypatch):
+    policy = FlushPolicy(max_prims=100)
+    chain = _chain(policy)
+    events = []
+    class Listener(object):
+        def flush_started(self, queue):
+            events.append('started')
+        def flush_finished(self, queue):
+            events.append('finished')
+    chain._command_queue.flush_listeners.append(Listener())
+
+    def unplugged(commands):
+        raise JTAGControlError("Unplugged")
+    monkeypatch.setattr(chain._controller, '_execute_primitives', unplugged)
+    chain.rw_dr(data=bitarray('1'*8))
+    chain.rw_dr(data=bitarray('1'*8))
+    with pytest.raises(JTAGControlError):
+        chain.flush()
+    assert events == ['started', 'finished']
+    assert policy.prims == len(chain._command_queue)
+
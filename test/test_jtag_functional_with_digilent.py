@@ -5,8 +5,12 @@ import pytest
 from proteusisc.controllerManager import getDriverInstanceForDevice
 from proteusisc.jtagScanChain import JTAGScanChain
 from proteusisc.test_utils import FakeUSBDev, FakeDevHandle,\
-    MockPhysicalJTAGDevice
+    MockPhysicalJTAGDevice, VirtualClock, LatencyHandle
 from proteusisc.bittypes import bitarray
+from proteusisc.command_queue import _collapse_transitions
+from proteusisc.errors import ProteusISCError, JTAGControlError
+from proteusisc.jtagDevice import BypassJTAGDevice
+from proteusisc.primitive_defaults import TransitionTAP
 
 def test_init_chain_single():
     idcode = bitarray('00000110110101001000000010010011')
@@ -43,6 +47,66 @@ def test_init_chain_triple():
         devid = struct.unpack("<L", codes[i].tobytes()[::-1])[0]
         assert dev._id == devid
 
+def test_init_chain_one_scan():
+    codes = [bitarray(bin(i)[2:].zfill(4)+'0110110101001000000010010011')
+             for i in range(16)]
+    devs = [MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+            for i, code in enumerate(codes)]
+    handle = LatencyHandle(FakeDevHandle(*devs), VirtualClock())
+    c = getDriverInstanceForDevice(FakeUSBDev(handle))
+    chain = JTAGScanChain(c)
+    count = handle.transfer_count
+    chain.init_chain()
+
+    assert [dev._id for dev in chain._devices] == \
+        [struct.unpack("<L", code.tobytes()[::-1])[0] for code in codes]
+    #Every device is found with one DR scan.
+    assert devs[0].event_history.count("CAPTUREDR") == 1
+    #Enable (2 transfers), the TAP reset (5), the scan, and disable (2).
+    #The Digilent cable reads at most 512 bits per command, so the
+    #scan is two reads of 5 transfers.
+    assert handle.transfer_count-count == 2+5+2*5+2
+
+def test_init_chain_bypass_device():
+    class NoIDCodeDevice(MockPhysicalJTAGDevice):
+        #Selects BYPASS after reset instead of an IDCODE.
+        def _TLR(self):
+            super(NoIDCodeDevice, self)._TLR()
+            self.current_instruction = "BYPASS"
+    codes = (bitarray('00000110110101001000000010010011'),
+             bitarray('01000110110101001000000010010011'))
+    ctrl = FakeDevHandle(
+        MockPhysicalJTAGDevice(name="D0", idcode=codes[0]),
+        NoIDCodeDevice(name="D1"),
+        MockPhysicalJTAGDevice(name="D2", idcode=codes[1]),
+    )
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.init_chain()
+
+    d0, d1, d2 = chain._devices
+    assert isinstance(d1, BypassJTAGDevice)
+    assert repr(d1) == "<D1: BYPASS>"
+    assert [d0._id, d2._id] == \
+        [struct.unpack("<L", code.tobytes()[::-1])[0] for code in codes]
+
+    #Chain level primitives still work.
+    chain.jtag_enable()
+    chain.transition_tap("TLR")
+    assert len(chain.rw_dr(bitcount=65, read=True)()) == 65
+    with pytest.raises(ProteusISCError):
+        d0.run_instruction("IDCODE", read=True)
+    chain.jtag_disable()
+
+def test_init_chain_long():
+    codes = [bitarray(bin(i%16)[2:].zfill(4)+'0110110101001000000010010011')
+             for i in range(40)]
+    ctrl = FakeDevHandle(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                           for i, code in enumerate(codes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.init_chain()
+    assert [dev._id for dev in chain._devices] == \
+        [struct.unpack("<L", code.tobytes()[::-1])[0] for code in codes]
+
 def test_set_desired_speed():
     ctrl = FakeDevHandle()
     usbdev = FakeUSBDev(ctrl)
@@ -58,6 +122,31 @@ def test_set_desired_speed():
     chain.jtag_enable()
     assert c.speed == 1000000
 
+def test_flush_times_follow_tck_speed():
+    def run(speed):
+        ctrl = FakeDevHandle(
+            MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100')))
+        handle = LatencyHandle(ctrl, VirtualClock(), tck=True)
+        chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(handle)))
+        chain.speed = speed
+        handle.watch(chain)
+        chain.init_chain()
+        chain.jtag_enable()
+        chain._devices[0].run_instruction("IDCODE", read=True)
+        chain.flush()
+        chain.jtag_disable()
+        return handle
+
+    fast, slow = run(4000000), run(1000000)
+    assert fast.tck_frequency == 4000000
+    assert slow.tck_frequency == 1000000
+    assert len(fast.flush_times) == len(slow.flush_times) > 1
+    assert fast.tck_count == slow.tck_count
+    for f, s in zip(fast.flush_times, slow.flush_times):
+        assert s > f
+    assert sum(slow.flush_times)-sum(fast.flush_times) == pytest.approx(
+        fast.tck_count*(1/1000000-1/4000000))
+
 def test_read_ir_1(chain_1dev):
     a = chain_1dev.rw_ir(bitcount=8, read=True)
     assert a() == bitarray('11111100')
@@ -144,6 +233,132 @@ def test_execute_single_instruction_on_1dev_chain(chain_1dev):
     assert a() == bitarray('00000110110101001000000010010011')
     assert stat() == bitarray('11111100')
 
+def test_promise_flushes_only_what_it_needs(chain_3dev):
+    d0, d1, d2 = chain_3dev._devices
+    queue = chain_3dev._command_queue
+    c = chain_3dev.rw_ir(bitcount=8, read=True, lastbit=False)
+    b = chain_3dev.rw_ir(bitcount=8, read=True, lastbit=False)
+    a = chain_3dev.rw_ir(bitcount=8, read=True)
+    chain_3dev.rw_dr(bitcount=3, data=bitarray('101'))
+    chain_3dev.sleep(delay=1)
+    #The scan c starts is finished before the flush stops.
+    assert c() == bitarray('11111110')
+    assert b._value is not None and a._value is not None
+    assert len(queue) == 2
+    assert chain_3dev._sm.state == 'UPDATEIR'
+
+    x, _ = d0.run_instruction("IDCODE", read=True)
+    y, _ = d1.run_instruction("IDCODE", read=True)
+    z, _ = d2.run_instruction("IDCODE", read=True)
+    chain_3dev.transition_tap("RTI")
+    #Device primitives aligned with each other run together.
+    assert y() == bitarray('01000110110101001000000010010011')
+    assert x._value is not None and z._value is not None
+    assert len(queue) == 1
+
+    #A promise no queued primitive owns runs the whole queue.
+    chain_3dev.flush(until=c)
+    assert len(queue) == 0
+    assert chain_3dev._sm.state == 'RTI'
+
+def test_promise_flushes_only_its_device_frame(chain_3dev):
+    d0 = chain_3dev._devices[0]
+    queue = chain_3dev._command_queue
+    x, _ = d0.run_instruction("IDCODE", read=True)
+    for _ in range(50):
+        d0.run_instruction("IDCODE")
+    #The later primitives of the same device are not aligned with x.
+    assert x() == bitarray('00000110110101001000000010010011')
+    assert len(queue) == 50
+
+def test_failed_partial_flush_keeps_rest(chain_3dev, monkeypatch):
+    queue = chain_3dev._command_queue
+    a = chain_3dev.rw_ir(bitcount=8, read=True)
+    chain_3dev.rw_dr(bitcount=3, data=bitarray('101'))
+    chain_3dev.sleep(delay=1)
+    rest = queue.queue[1:]
+
+    def unplugged(commands):
+        raise JTAGControlError("Unplugged")
+    monkeypatch.setattr(chain_3dev._controller, '_execute_primitives',
+                        unplugged)
+    with pytest.raises(JTAGControlError):
+        a()
+    assert queue.queue == rest
+
+def test_redundant_instruction_loads_skipped():
+    codes = (bitarray('00000110110101001000000010010011'),
+             bitarray('01000110110101001000000010010011'))
+    ctrl = FakeDevHandle(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                           for i, code in enumerate(codes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.init_chain()
+    chain.jtag_enable()
+    d0, d1 = chain._devices
+    m0 = ctrl.devices[0]
+
+    def idcodes(count=1):
+        updates = m0.event_history.count("UPDATEIR")
+        for _ in range(count):
+            a, _ = d0.run_instruction("IDCODE", read=True)
+            b, _ = d1.run_instruction("IDCODE", read=True)
+            chain.transition_tap("RTI")
+            assert (a(), b()) == codes
+        return m0.event_history.count("UPDATEIR")-updates
+
+    assert idcodes(3) == 1
+    #What was loaded is remembered between flushes.
+    assert idcodes() == 0
+
+    #Reading the status loads BYPASS.
+    d0.run_instruction("IDCODE", read_status=True)
+    chain.flush()
+    assert idcodes() == 1
+
+    for invalidate in (lambda: chain.transition_tap("TLR"),
+                       lambda: chain.rw_ir(data=bitarray('1'*16)),
+                       lambda: (chain.rw_dr(data=bitarray('11')),
+                                chain.compile_program()),
+                       lambda: (chain.jtag_disable(), chain.jtag_enable())):
+        invalidate()
+        chain.flush()
+        assert idcodes() == 1
+
+    d0.always_load_instruction = True
+    assert idcodes(3) == 3
+    chain.jtag_disable()
+
+def test_tap_transitions_collapsed(chain_3dev):
+    T = lambda state, **kw: TransitionTAP(state, _chain=chain_3dev, **kw)
+    states = lambda prims: [(p.state, p.loop) for p in prims]
+
+    #What is left between an IR scan and a DR scan.
+    prims = [T("UPDATEIR"), T("DRSCAN"), T("SHIFTDR")]
+    assert states(_collapse_transitions(prims, "EXIT1IR")) == \
+        [("SHIFTDR", None)]
+    prims = [T("UPDATEDR"), T("RTI", loop=2)]
+    assert states(_collapse_transitions(prims, "EXIT1DR")) == \
+        [("RTI", 2)]
+    #A path that differs from the direct one is kept.
+    prims = [T("UPDATEIR"), T("RTI"), T("SHIFTDR")]
+    assert states(_collapse_transitions(prims, "EXIT1IR")) == \
+        [("RTI", None), ("SHIFTDR", None)]
+    prims = [T("TLR"), T("RTI")]
+    assert len(_collapse_transitions(prims, "SHIFTDR")) == 2
+    #Nothing is collapsed from an unknown state.
+    prims = [T("TLR"), T("RTI")]
+    assert len(_collapse_transitions(prims, "_PRE5")) == 2
+
+    chain_3dev.transition_tap("RTI")
+    a = chain_3dev.rw_ir(data=bitarray('000000010000000100000001'))
+    b = chain_3dev.rw_dr(bitcount=96, read=True)
+    chain_3dev.transition_tap("RTI")
+    assert b() == bitarray('00000110110101001000000010010011'
+                           '01000110110101001000000010010011'
+                           '10000110110101001000000010010011')
+    chain_3dev.flush()
+    assert chain_3dev._sm.state == 'RTI'
+
 @pytest.fixture
 def chain_1dev():
     ctrl = FakeDevHandle(
@@ -1,7 +1,7 @@
 #-*- coding: utf-8 -*-
 import pytest
 
-from proteusisc.bittypes import bitarray
+from proteusisc.bittypes import bitarray, ConstantBitarray
 from proteusisc.jtagStateMachine import JTAGStateMachine
 
 def test_initialize_correct_defaults():
@@ -95,3 +95,36 @@ def test_calc_transition_to_state():
     assert path == bitarray('001111')
     do_bits(path)
     assert sm.state, "SHIFTIR"
+
+def test_calc_transition_all_pairs():
+    for start in JTAGStateMachine.states:
+        for end in JTAGStateMachine.states:
+            sm = JTAGStateMachine(start)
+            try:
+                path = sm.calc_transition_to_state(end)
+            except ValueError:
+                assert end.startswith("_PRE")
+                continue
+            if start == end:
+                assert path == bitarray()
+            sm.apply_tms(path)
+            assert sm.state == end
+
+def test_apply_tms():
+    bits = bitarray('1101001011110000101101')
+    for start in ("_PRE5", "RTI", "SHIFTDR", "EXIT2IR"):
+        for count in (len(bits), 16): #Unaligned and byte aligned
+            sm1 = JTAGStateMachine(start)
+            for bit in bits[-count:][::-1]:
+                sm1.transition_bit(bit)
+            sm2 = JTAGStateMachine(start)
+            sm2.apply_tms(bits[-count:])
+            assert sm1 == sm2
+
+    sm = JTAGStateMachine("SHIFTDR")
+    sm.apply_tms(ConstantBitarray(True, 1000))
+    assert sm.state == "TLR"
+    sm.apply_tms(ConstantBitarray(False, 3))
+    assert sm.state == "RTI"
+    sm.apply_tms(bitarray())
+    assert sm.state == "RTI"
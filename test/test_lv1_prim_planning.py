@@ -0,0 +1,118 @@
+#-*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from proteusisc.cabledriver import CableDriver
+from proteusisc.contracts import ARBITRARY, NOCARE
+from proteusisc.errors import ProteusISCError
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.primitive import Level1Primitive, Executable
+from proteusisc.bittypes import bitarray, NoCareBitarray
+from proteusisc.promise import TDOPromise
+
+class BigPrim(Level1Primitive, Executable):
+    _function_name = 'big'
+    _driver_function_name = 'big'
+    _max_send_bits = 1024
+    _max_recv_bits = 1024
+    _TMS, _TDI, _TDO = ARBITRARY, ARBITRARY, ARBITRARY
+    _COST_PRIM = 100
+    _args = ['count']
+    _kwargs = {'TMS': 'tms', 'TDI': 'tdi', 'TDO': 'tdo'}
+
+class SmallPrim(Level1Primitive, Executable):
+    _function_name = 'small'
+    _driver_function_name = 'small'
+    _max_send_bits = 16
+    _max_recv_bits = 16
+    _TMS, _TDI, _TDO = ARBITRARY, ARBITRARY, ARBITRARY
+    _COST_PRIM = 5
+    _args = ['count']
+    _kwargs = {'TMS': 'tms', 'TDI': 'tdi', 'TDO': 'tdo'}
+
+class MismatchPrim(Level1Primitive, Executable):
+    _function_name = 'mismatch'
+    _driver_function_name = 'mismatch'
+    _max_send_bits = 4096
+    _max_recv_bits = 64
+    _TMS, _TDI, _TDO = ARBITRARY, ARBITRARY, ARBITRARY
+    _args = ['count']
+    _kwargs = {'TMS': 'tms', 'TDI': 'tdi', 'TDO': 'tdo'}
+
+class PlanningController(CableDriver):
+    _primitives = [BigPrim, SmallPrim]
+    def __init__(self):
+        super(PlanningController, self).__init__(None)
+
+def test_plan_mixes_bulk_and_tail_prims():
+    chain = JTAGScanChain(PlanningController())
+    reqef = (ARBITRARY, ARBITRARY, NOCARE)
+    assert chain.plan_lv1_prims(reqef, 1030) == (BigPrim, SmallPrim)
+    assert chain.plan_lv1_prims(reqef, 10) == (SmallPrim, SmallPrim)
+
+    dispatcher = chain.get_fitted_lv1_prim(reqef, 1030)
+    prims = dispatcher(tms=bitarray('1'*1030), tdi=bitarray('0'*1030),
+                       tdo=NoCareBitarray(1030))
+    assert [(type(p), p.count) for p in prims] == \
+        [(BigPrim, 1024), (SmallPrim, 6)]
+
+def test_plan_cached_per_bitcount():
+    chain = JTAGScanChain(PlanningController())
+    reqef = (ARBITRARY, ARBITRARY, NOCARE)
+    assert chain.get_fitted_lv1_prim(reqef, 1030) is \
+        chain.get_fitted_lv1_prim(reqef, 1030)
+    #Counts in the same power of two get their own tail.
+    assert chain.get_fitted_lv1_prim(reqef, 1030).plan_chunks(1030) == \
+        [(BigPrim, 1024), (SmallPrim, 6)]
+    assert chain.get_fitted_lv1_prim(reqef, 1500).plan_chunks(1500) == \
+        [(BigPrim, 1024), (BigPrim, 476)]
+
+def test_plan_without_compatible_prims():
+    chain = JTAGScanChain(PlanningController())
+    chain._lv1_chain_primitives = []
+    reqef = (ARBITRARY, ARBITRARY, NOCARE)
+    with pytest.raises(ProteusISCError):
+        chain.plan_lv1_prims(reqef, 10)
+    with pytest.raises(ProteusISCError):
+        chain.get_fitted_lv1_prim(reqef, 10)
+
+def test_plan_chunks_tail_longer_than_tail_prim():
+    chain = JTAGScanChain(PlanningController())
+    reqef = (ARBITRARY, ARBITRARY, NOCARE)
+    dispatcher = chain.get_fitted_lv1_prim(reqef, 1030)
+    assert dispatcher.plan_chunks(1024+40) == \
+        [(BigPrim, 1024), (SmallPrim, 16), (SmallPrim, 16), (SmallPrim, 8)]
+
+def test_mismatched_send_recv_bitcount():
+    reqef = (ARBITRARY, ARBITRARY, ARBITRARY)
+    assert MismatchPrim.can_prim_handle_bitcount(reqef, 64)
+    assert not MismatchPrim.can_prim_handle_bitcount(reqef, 65)
+    assert MismatchPrim.can_prim_handle_bitcount(reqef, 4096, 10)
+    assert not MismatchPrim.can_prim_handle_bitcount(reqef, 4096, 65)
+    assert not MismatchPrim.can_prim_handle_bitcount(reqef, 4097, 0)
+    assert MismatchPrim._max_chunk_bits(reqef) == 64
+    assert MismatchPrim._max_chunk_bits(
+        (ARBITRARY, ARBITRARY, NOCARE)) == 4096
+
+def test_dispatcher_chunks_data_and_promise_in_order():
+    chain = JTAGScanChain(PlanningController())
+    reqef = (ARBITRARY, ARBITRARY, ARBITRARY)
+    count = 1024*3+40
+    tdi = bitarray(''.join(random.choice('01') for _ in range(count)))
+    promise = TDOPromise(chain, 0, count)
+
+    dispatcher = chain.get_fitted_lv1_prim(reqef, count)
+    prims = dispatcher(tms=bitarray('0'*count), tdi=tdi, tdo=True,
+                       _promise=promise)
+    assert [(type(p), p.count) for p in prims] == \
+        dispatcher.plan_chunks(count)
+
+    #Chunks run in order, taken from the right of the data.
+    chunks = [bitarray(list(prim.tdi)) for prim in prims]
+    assert sum(reversed(chunks), bitarray()) == tdi
+
+    #Echo each chunk's TDI back as its TDO.
+    for prim, chunk in zip(prims, chunks):
+        prim._promise._fulfill(chunk)
+    assert promise() == tdi
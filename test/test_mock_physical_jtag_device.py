@@ -1,9 +1,11 @@
 #-*- coding: utf-8 -*-
+import random
+
 import pytest
 
 from proteusisc.bittypes import bitarray
 from proteusisc.test_utils import MockPhysicalJTAGDevice
-from proteusisc.test_utils.device import MockXC2C256
+from proteusisc.test_utils.device import MockXC2C256, shift_device_chain
 
 def test_initialize_correct_defaults():
     dev = MockPhysicalJTAGDevice(name="D0")
@@ -161,3 +163,34 @@ def test_custom_device():
 def test_use_custom_device_class():
     dev = MockXC2C256()
     assert dev.idcode == bitarray('00000110110101001000000010010011')
+
+def test_shift_device_chain_matches_shift():
+    class AnyInstruction(dict):
+        def __missing__(self, key):
+            return ("BYPASS", "IDCODE", "EXTEST")[int(key, 2)%3]
+    def make_chain():
+        devs = [MockPhysicalJTAGDevice(name="D%s"%i) for i in range(3)]
+        for dev in devs:
+            dev.inscode_to_ins = AnyInstruction(dev.inscode_to_ins)
+        return devs
+    def state(devs):
+        return [(dev.tapstate, dev.event_history, dev.IR.dumpData(),
+                 dev.DR.dumpData(), dev.current_instruction)
+                for dev in devs]
+
+    rand = random.Random(1149)
+    for _ in range(50):
+        stepped, bulk = make_chain(), make_chain()
+        for _ in range(4):
+            count = rand.randint(0, 200)
+            onerate = rand.choice((0.02, 0.3, 0.7))
+            tms = bitarray([rand.random() < onerate for _ in range(count)])
+            tdi = bitarray([rand.random() < 0.5 for _ in range(count)])
+            tdo = bitarray()
+            for i in range(count):
+                bit = tdi[i]
+                for dev in stepped:
+                    bit = dev.shift(tms[i], bit)
+                tdo.append(bit)
+            assert shift_device_chain(bulk, tms, tdi) == tdo
+            assert state(bulk) == state(stepped)
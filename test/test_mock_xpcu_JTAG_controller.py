@@ -6,7 +6,7 @@ from proteusisc.bittypes import bitarray
 from proteusisc.jtagUtils import blen2Blen, buff2Blen,\
     build_byte_align_buff
 from proteusisc.test_utils import FakeUSBDev, FakeXPCU1Handle,\
-    MockPhysicalJTAGDevice
+    MockPhysicalJTAGDevice, VirtualClock, LatencyHandle
 
 def test_controller_control_messages():
     h = FakeXPCU1Handle()
@@ -72,6 +72,23 @@ def test_jtag_transfer_simple_tms():
     h.bulkWrite(2, b'\xF0\x0F\x50\x0F\x00\x01')
     assert d0.tapstate == "SHIFTDR"
 
+def test_jtag_transfer_timing_model():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'))
+    clock = VirtualClock()
+    h = LatencyHandle(FakeXPCU1Handle(d0), clock, control_latency=1,
+                      bulk_latency=10, bytes_per_second=100, tck=True)
+    h.controlWrite(0x40, 0xB0, 0x28, 0x14, b'')
+    h.controlWrite(0x40, 0xB0, 0x18, 0, b'')
+    assert h.tck_frequency == 750000
+    assert clock() == 2
+
+    h.controlWrite(0x40, 0xb0, 0xa6, 9-1, b'')
+    h.bulkWrite(2, b'\xF0\x0F\x50\x0F\x00\x01')
+    assert d0.tapstate == "SHIFTDR"
+    assert h.tck_count == 9
+    assert h.transfer_count == 4
+    assert clock() == pytest.approx(3+10+6/100+9/750000)
+
 def test_jtag_transfer_simple_read_tro():
     d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'))
     h = FakeXPCU1Handle(d0)
@@ -6,7 +6,7 @@ class FakeChain(object):
     def __init__(self):
         self.hasflushed = False
 
-    def flush(self):
+    def flush(self, until=None):
         self.hasflushed = True
 
 chain = FakeChain()
@@ -253,3 +253,44 @@ def test_promisecollection_double_split_right_fulfill():
             r._fulfill(cr)
             assert pro0() == correct[:8]
             assert pro1() == correct[8:]
+
+def test_promise_split_chunks_fulfill():
+    correct = bitarray('0011011111001')
+    lengths = [3, 1, 5, 4]
+    pro = TDOPromise(chain, 0, len(correct))
+    chunks = pro.split_chunks(lengths)
+    assert [len(c) for c in chunks] == lengths
+    assert all(c._parent is pro for c in chunks)
+
+    for i in reversed(range(len(chunks))):
+        assert pro._value is None
+        start = sum(lengths[:i])
+        chunks[i]._fulfill(correct[start:start+lengths[i]])
+    assert pro() == correct
+
+def test_promise_split_chunks_many():
+    correct = bitarray('1101'*5000)
+    pro = TDOPromise(chain, 0, len(correct))
+    chunks = pro.split_chunks([4]*5000)
+    for chunk in chunks:
+        chunk._fulfill(bitarray('1101'))
+    assert pro() == correct
+
+def test_promisecollection_split_chunks_fulfill():
+    indat = bitarray('111111100011001010')
+    correct = bitarray('1111111011001010')
+    for lengths in ([18], [5, 13], [8, 2, 8], [3, 4, 4, 7], [1]*18):
+        pro0 = TDOPromise(chain, 0, 8)
+        pro1 = TDOPromise(chain, 0, 8)
+        promises = TDOPromiseCollection(chain)
+        promises.add(pro0, 0)
+        promises.add(pro1, 10)
+
+        chunks = promises.split_chunks(lengths)
+        start = 0
+        for chunk, length in zip(chunks, lengths):
+            if chunk:
+                chunk._fulfill(indat[start:start+length])
+            start += length
+        assert pro0() == correct[:8]
+        assert pro1() == correct[8:]
@@ -51,3 +51,16 @@ def test_shift():
         assert i == reg.shift(True), "Wrong value shifted out"
     assert reg.dumpData() == bitarray('1'*8),\
         "Data not shifted in correctly"
+
+def test_shift_bits():
+    initval = bitarray('11001010')
+    bits = bitarray('0111001')
+    reg = ShiftRegister(8, initval=initval)
+    out = bitarray([reg.shift(b) for b in bits])
+    reg2 = ShiftRegister(8, initval=initval)
+    assert reg2.shift_bits(bits) == out
+    assert reg2.dumpData() == reg.dumpData()
+
+    assert reg2.shift_bits(bitarray('1'*20)) == \
+        bitarray(reversed(reg.dumpData()))+bitarray('1'*12)
+    assert reg2.dumpData() == bitarray('1'*8)
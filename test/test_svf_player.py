@@ -0,0 +1,189 @@
+#-*- coding: utf-8 -*-
+import io
+import struct
+
+import pytest
+
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.errors import SVFError, SVFCompareError
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.svfPlayer import SVFPlayer, iter_svf_statements
+from proteusisc.test_utils import FakeDevHandle, FakeUSBDev,\
+    MockPhysicalJTAGDevice
+
+codes = (
+    bitarray('00000110110101001000000010010011'),
+    bitarray('01000110110101001000000010010011'),
+    bitarray('10000110110101001000000010010011'),
+)
+
+#Read back closest to TDO (the last device) first.
+IDCODES_SVF = "06D48093 46D48093 86D48093"
+
+@pytest.fixture
+def chain():
+    ctrl = FakeDevHandle(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                           for i, code in enumerate(codes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.jtag_enable()
+    yield chain
+    chain.jtag_disable()
+
+def _svf(text):
+    return io.StringIO(text)
+
+def test_iter_svf_statements():
+    statements = list(iter_svf_statements(_svf(
+        "! A comment; with a semicolon\n"
+        "TRST OFF; ENDIR idle;\n"
+        "SDR 64 TDI (0000 // comment\n"
+        "            0001)\n"
+        "  TDO (FFFF FFFF FFFF FFFF);\n")))
+    assert statements == [
+        (2, ['TRST', 'OFF']),
+        (2, ['ENDIR', 'IDLE']),
+        (3, ['SDR', '64', 'TDI', '00000001', 'TDO', 'FFFFFFFFFFFFFFFF']),
+    ]
+    with pytest.raises(SVFError):
+        list(iter_svf_statements(_svf("SIR 8 TDI (01)")))
+
+def test_play_svf(chain):
+    player = SVFPlayer(chain)
+    player.play(_svf(
+        "TRST OFF;\nENDIR IDLE;\nENDDR IDLE;\nSTATE RESET;\nSTATE IDLE;\n"
+        "SIR 24 TDI (010101);\n"
+        "SDR 96 TDI (0) TDO (%s) MASK (FFFFFFFFFFFFFFFFFFFFFFFF);\n"
+        "RUNTEST 100 TCK;\nRUNTEST 50 TCK;\n"
+        "RUNTEST IDLE 1E-4 SEC ENDSTATE IDLE;\n"%IDCODES_SVF))
+    assert player.scans == 2
+    assert chain._sm.state == "RTI"
+
+    with pytest.raises(SVFCompareError) as e:
+        SVFPlayer(chain).play(_svf(
+            "SIR 24 TDI (010101);\n"
+            "SDR 96 TDI (0) TDO (%s);\n"%IDCODES_SVF.replace('4', '5')))
+    assert "Line 2" in str(e.value)
+
+    #Masked out bits are not compared.
+    SVFPlayer(chain).play(_svf(
+        "SIR 24 TDI (010101);\n"
+        "SDR 96 TDI (0) TDO (%s) MASK (FFFFFFFF 0FFFFFFF 0FFFFFFF);\n"%
+        IDCODES_SVF.replace('46', '56').replace('86', '96')))
+
+def test_play_svf_header_trailer(chain):
+    #Put the first and last devices in BYPASS and read the middle one.
+    SVFPlayer(chain).play(_svf(
+        "HIR 8 TDI (FF);\nTIR 8 TDI (FF);\nHDR 1 TDI (0);\nTDR 1 TDI (0);\n"
+        "SIR 8 TDI (01);\nSDR 32 TDI (0) TDO (46D48093);\n"))
+
+def test_play_svf_end_state(chain):
+    SVFPlayer(chain).play(_svf(
+        "ENDDR DRPAUSE;\nSIR 24 TDI (010101);\n"
+        "SDR 96 TDI (0) TDO (%s);\n"%IDCODES_SVF))
+    assert chain._sm.state == "PAUSEDR"
+
+    with pytest.raises(SVFError):
+        SVFPlayer(chain).play(_svf("ENDDR DRSHIFT;\n"))
+    with pytest.raises(SVFError):
+        SVFPlayer(chain).play(_svf("PIOMAP (IN A);\n"))
+
+def test_play_svf_scans_from_pause(chain):
+    #Each scan from a pause state updates the last one and captures
+    #again instead of resuming the shift.
+    dev = chain._controller._handle.devices[0]
+    SVFPlayer(chain).play(_svf("STATE IDLE;\n"))
+    start = len(dev.event_history)
+    SVFPlayer(chain).play(_svf(
+        "ENDDR DRPAUSE;\nSDR 8 TDI (AA);\nSDR 8 TDI (55);\n"
+        "ENDDR IDLE;\nSDR 8 TDI (00);\n"))
+    history = dev.event_history[start:]
+    assert history.count('CAPTUREDR') == 3
+    assert history.count('UPDATEDR') == 3
+
+    start = len(dev.event_history)
+    SVFPlayer(chain).play(_svf(
+        "ENDIR IRPAUSE;\nSIR 24 TDI (FFFFFF);\nSIR 24 TDI (FFFFFF);\n"
+        "ENDIR IDLE;\nSIR 24 TDI (FFFFFF);\n"))
+    history = dev.event_history[start:]
+    assert history.count('CAPTUREIR') == 3
+    assert history.count('UPDATEIR') == 3
+
+def test_play_svf_in_windows(chain):
+    class Counter(object):
+        flushes = 0
+        def flush_started(self, queue):
+            self.flushes += 1
+        def flush_finished(self, queue):
+            pass
+    counter = Counter()
+    chain._command_queue.flush_listeners.append(counter)
+
+    scan = "SDR 96 TDI (0) TDO (%s);\n"%IDCODES_SVF
+    player = SVFPlayer(chain, window_bits=200)
+    player.play(_svf("SIR 24 TDI (010101);\n" + scan*10))
+    assert player.scans == 11
+    assert counter.flushes == 4
+
+    #A mismatch is reported once its window runs.
+    with pytest.raises(SVFCompareError) as e:
+        SVFPlayer(chain, window_bits=200).play(_svf(
+            "SIR 24 TDI (010101);\n" + scan +
+            "SDR 96 TDI (0) TDO (0);\n" + scan*20))
+    assert "Line 3" in str(e.value)
+
+def test_play_svf_runtest_clocks(chain):
+    ctrl = chain._controller._handle
+    SVFPlayer(chain).play(_svf("STATE IDLE;\n"))
+    count = ctrl.tck_count
+    SVFPlayer(chain).play(_svf("RUNTEST 1000 TCK;\n"))
+    assert ctrl.tck_count-count == 1000
+
+def test_play_svf_runtest_unknown_speed(chain, monkeypatch):
+    SVFPlayer(chain).play(_svf("ENDDR DRPAUSE;\nSDR 8 TDI (0);\n"
+                               "RUNTEST DRPAUSE 100 TCK;\n"))
+    monkeypatch.setattr(type(chain._controller), 'speed',
+                        property(lambda self: None))
+    assert not chain.speed
+    with pytest.raises(SVFError):
+        SVFPlayer(chain).play(_svf("RUNTEST DRPAUSE 10000 TCK;\n"))
+
+def _xsvf(*cmds):
+    return io.BytesIO(b''.join(cmds)+b'\x00')
+
+def _xsvf_idcode_scan(tdo):
+    return (b'\x02\x18\x01\x01\x01' #XSIR 24 IDCODE
+            b'\x08'+struct.pack('>I', 96)+ #XSDRSIZE
+            b'\x01'+b'\xFF'*12+ #XTDOMASK
+            b'\x09'+b'\x00'*12+bytes.fromhex(tdo.replace(' ', '')))
+
+def test_play_xsvf(chain):
+    player = SVFPlayer(chain)
+    player.play_xsvf(_xsvf(b'\x16a comment\x00', b'\x12\x00', b'\x12\x01',
+                           b'\x07\x00', _xsvf_idcode_scan(IDCODES_SVF),
+                           b'\x04'+struct.pack('>I', 100),
+                           b'\x03'+b'\x00'*12))
+    assert player.scans == 3
+    assert chain._sm.state == "RTI"
+
+    with pytest.raises(SVFCompareError):
+        SVFPlayer(chain).play_xsvf(_xsvf(
+            b'\x07\x00', _xsvf_idcode_scan(IDCODES_SVF.replace('4', '5'))))
+
+def test_play_xsvf_repeat(chain):
+    dev = chain._controller._handle.devices[0]
+    player = SVFPlayer(chain)
+    with pytest.raises(SVFCompareError):
+        player.play_xsvf(_xsvf(
+            b'\x07\x02', _xsvf_idcode_scan(IDCODES_SVF.replace('4', '5'))))
+    #The IR scan, and the DR scan tried three times.
+    assert player.scans == 4
+    #Retries go back through PAUSEDR without capturing again, and
+    #every attempt updates the DR once.
+    update = ['UPDATEDR', '0'*32, 'RTI']
+    history = dev.event_history
+    assert history[history.index('CAPTUREDR'):] == \
+        (['CAPTUREDR', 'PAUSEDR']+update)*2 + ['CAPTUREDR']+update
+
+    with pytest.raises(SVFError):
+        SVFPlayer(chain).play_xsvf(_xsvf(b'\x0b'))
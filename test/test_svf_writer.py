@@ -0,0 +1,111 @@
+#-*- coding: utf-8 -*-
+import io
+
+import pytest
+
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.errors import SVFError
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.svfPlayer import SVFPlayer
+from proteusisc.svfWriter import SVFWriter
+from proteusisc.test_utils import FakeDevHandle, FakeUSBDev,\
+    MockPhysicalJTAGDevice
+
+codes = (
+    bitarray('00000110110101001000000010010011'),
+    bitarray('01000110110101001000000010010011'),
+    bitarray('10000110110101001000000010010011'),
+)
+
+@pytest.fixture
+def chain():
+    ctrl = FakeDevHandle(*(MockPhysicalJTAGDevice(name="D%s"%i, idcode=code)
+                           for i, code in enumerate(codes)))
+    chain = JTAGScanChain(getDriverInstanceForDevice(FakeUSBDev(ctrl)))
+    chain.init_chain()
+    return chain
+
+def _statements(text):
+    return [line for line in text.splitlines()
+            if line and not line.startswith('!')]
+
+def test_export_svf(chain, tmpdir):
+    chain.transition_tap("TLR")
+    chain.rw_ir(data=bitarray('000000010000000100000001'))
+    chain.transition_tap("RTI", loop=20)
+    chain.rw_dr(bitcount=96, read=True)
+    chain.rw_dr(bitcount=96, read=True)
+    chain.transition_tap("PAUSEDR")
+    chain.sleep(delay=1)
+    path = str(tmpdir.join("out.svf"))
+    #JTAG is not enabled, so nothing can be sent to the controller.
+    chain.export_svf(path)
+
+    with open(path) as f:
+        text = f.read()
+    assert _statements(text) == [
+        "STATE RESET;",
+        "STATE IDLE;",
+        "SIR 24 TDI (010101);",
+        "RUNTEST IDLE 20 TCK ENDSTATE IDLE;",
+        "SDR 96 TDI (000000000000000000000000);",
+        "ENDDR DRPAUSE;",
+        "SDR 96 TDI (000000000000000000000000);",
+        "RUNTEST DRPAUSE 1.000000E-03 SEC ENDSTATE DRPAUSE;",
+    ]
+    assert text.count("! TDO read") == 2
+    assert len(chain._command_queue) == 0
+    assert chain._sm.state == "PAUSEDR"
+
+    chain.jtag_enable()
+    player = SVFPlayer(chain)
+    player.play(path)
+    assert player.scans == 3
+    assert chain._sm.state == "PAUSEDR"
+    chain.jtag_disable()
+
+def test_export_svf_batches(chain):
+    out = io.StringIO()
+    writer = SVFWriter(out, state=chain._sm.state)
+    chain.transition_tap("RTI")
+    chain.rw_ir(data=bitarray('000000010000000100000001'))
+    chain.export_svf(writer)
+    chain.rw_dr(data=bitarray('1'*96))
+    chain.transition_tap("RTI", loop=5)
+    chain.transition_tap("DRSCAN")
+    chain.export_svf(writer)
+    writer.finish()
+
+    assert writer.scans == 2
+    assert writer.state == "RTI"
+    assert _statements(out.getvalue()) == [
+        "STATE RESET;",
+        "STATE IDLE;",
+        "SIR 24 TDI (010101);",
+        "SDR 96 TDI (FFFFFFFFFFFFFFFFFFFFFFFF);",
+        "RUNTEST IDLE 5 TCK ENDSTATE IDLE;",
+        "STATE IDLE;",
+    ]
+
+def test_export_svf_state_path(chain):
+    chain.transition_tap("RTI")
+    chain.export_svf(SVFWriter(io.StringIO()))
+    out = io.StringIO()
+    writer = SVFWriter(out, state=chain._sm.state)
+    #Capture and update DR without shifting it.
+    chain.transition_tap("EXIT1DR")
+    chain.transition_tap("RTI")
+    chain.export_svf(writer)
+    assert _statements(out.getvalue())[-1] == \
+        "STATE DRSELECT DRCAPTURE DREXIT1 DRUPDATE IDLE;"
+
+def test_export_svf_paused_scan(chain):
+    chain.transition_tap("SHIFTDR")
+    chain.rw_reg(data=bitarray('1010'))
+    chain.transition_tap("PAUSEDR")
+    chain.transition_tap("SHIFTDR")
+    chain.rw_reg(data=bitarray('1010'))
+    chain.transition_tap("RTI")
+    with pytest.raises(SVFError):
+        chain.export_svf(SVFWriter(io.StringIO()))
@@ -0,0 +1,84 @@
+#-*- coding: utf-8 -*-
+import pytest
+from usb1 import USBErrorPipe
+
+from proteusisc.bittypes import bitarray
+from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.jtagScanChain import JTAGScanChain
+from proteusisc.test_utils import FakeDevHandle, FakeXPCU1Handle,\
+    FakeUSBDev, MockPhysicalJTAGDevice, VirtualClock, RecordingUSBDev,\
+    ReplayUSBDev, TraceMismatchError, read_trace, summarize_trace
+from proteusisc.test_utils.trace import CONTROL_READ
+
+def _devices():
+    return (MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100')),
+            MockPhysicalJTAGDevice(name="D1", status=bitarray('11111101')))
+
+def _run(usbdev):
+    chain = JTAGScanChain(getDriverInstanceForDevice(usbdev))
+    chain.init_chain()
+    chain.jtag_enable()
+    d0, d1 = chain._devices
+    a, a_stat = d0.run_instruction("IDCODE", read=True, read_status=True)
+    b, b_stat = d1.run_instruction("IDCODE", read=True, read_status=True)
+    res = [a(), a_stat(), b(), b_stat()]
+    chain.jtag_disable()
+    return res
+
+@pytest.mark.parametrize("handle_class", [FakeDevHandle, FakeXPCU1Handle])
+def test_record_and_replay(tmpdir, handle_class):
+    path = str(tmpdir.join("chain.trace"))
+    with RecordingUSBDev(FakeUSBDev(handle_class(*_devices())),
+                         path) as dev:
+        recorded = _run(dev)
+
+    vid, pid, records = read_trace(path)
+    assert (vid, pid) == (handle_class.USB_VEND_ID,
+                          handle_class.USB_PROD_ID)
+    assert records
+    assert all(rec.duration >= 0 for rec in records)
+
+    clock = VirtualClock()
+    dev = ReplayUSBDev(path, clock=clock)
+    assert _run(dev) == recorded
+    dev.check_finished()
+    summary = summarize_trace(records)
+    assert summary['transfers'] == len(records)
+    assert clock() == pytest.approx(summary['usb_time'])
+
+def test_replay_detects_changed_traffic(tmpdir):
+    path = str(tmpdir.join("chain.trace"))
+    with RecordingUSBDev(FakeUSBDev(FakeDevHandle(*_devices())),
+                         path) as dev:
+        chain = JTAGScanChain(getDriverInstanceForDevice(dev))
+        chain.init_chain()
+
+    dev = ReplayUSBDev(path)
+    getDriverInstanceForDevice(dev)
+    #The recording enabled JTAG next, not disabled it.
+    with pytest.raises(TraceMismatchError):
+        dev.open().bulkWrite(1, b'\x03\x02\x01\x00')
+
+    dev = ReplayUSBDev(path)
+    JTAGScanChain(getDriverInstanceForDevice(dev))
+    with pytest.raises(TraceMismatchError):
+        dev.check_finished()
+
+def test_replay_usb_errors(tmpdir):
+    path = str(tmpdir.join("errors.trace"))
+    with RecordingUSBDev(FakeUSBDev(FakeXPCU1Handle()), path) as dev:
+        h = dev.open()
+        with pytest.raises(USBErrorPipe):
+            h.controlRead(0xC0, 0xB0, 0, 0, 1)
+        assert h.controlRead(0xC0, 0xB0, 0x40, 0, 2) == b'\xB5\x03'
+
+    _, _, records = read_trace(path)
+    assert [rec.kind for rec in records] == [CONTROL_READ]*2
+    assert records[0].status == USBErrorPipe.value
+
+    h = ReplayUSBDev(path).open()
+    with pytest.raises(USBErrorPipe):
+        h.controlRead(0xC0, 0xB0, 0, 0, 1)
+    assert h.controlRead(0xC0, 0xB0, 0x40, 0, 2) == b'\xB5\x03'
+    with pytest.raises(TraceMismatchError):
+        h.controlRead(0xC0, 0xB0, 0x40, 0, 2)
@@ -1,8 +1,13 @@
 #-*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
 from proteusisc.bittypes import bitarray
 from proteusisc.jtagUtils import bitfieldify, blen2Blen, buff2Blen,\
-    build_byte_align_buff
-from proteusisc.utils import memoized
+    build_byte_align_buff, parse_idcode_scan
+from proteusisc.utils import memoized, LRUCache
 
 def test_util_blen2Blen():
     assert blen2Blen(0) == 0
@@ -29,6 +34,18 @@ def test_util_build_byte_align_buff():
 def test_util_bitfieldify():
     assert bitfieldify(b'\x01\xFF', 9) == bitarray('1'*9)
 
+def test_util_parse_idcode_scan():
+    dev0 = bitarray('00000110110101001000000010010011')
+    dev2 = bitarray('01000110110101001000000010010011')
+    #Bits come out of the chain right to left: dev2, a BYPASS device,
+    #dev0, then the 1s shifted in.
+    bits = bitarray('1'*40)+dev0+bitarray('0')+dev2
+    assert parse_idcode_scan(bits) == [dev2, None, dev0]
+    assert parse_idcode_scan(bitarray('1'*64)) == []
+    assert parse_idcode_scan(bitarray('0'*64)) == []
+    #Scan too short to see the end of the chain.
+    assert parse_idcode_scan(dev0+dev2) is None
+
 def test_util_memoized():
     def some_func(num):
         return num*num
@@ -46,3 +63,112 @@ def test_util_memoized():
     def unit_function(data):
         return data
     assert unit_function([1,2,3]) == [1,2,3]
+    assert some_memoized_func.cache_info().maxsize is None
+
+class _FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+def test_util_memoized_lru():
+    calls = []
+    @memoized(maxsize=2)
+    def square(num):
+        calls.append(num)
+        return num*num
+
+    assert square(1) == 1
+    assert square(2) == 4
+    assert square(1) == 1
+    assert square(3) == 9 #Drops 2, the least recently used
+    assert square(1) == 1
+    assert square(2) == 4
+    assert calls == [1, 2, 3, 2]
+    info = square.cache_info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == \
+        (2, 4, 2, 2)
+    assert square.__name__ == "square"
+
+    square.cache_clear()
+    assert square(1) == 1
+    assert calls == [1, 2, 3, 2, 1]
+
+def test_util_memoized_ttl_and_errors():
+    timer = _FakeTimer()
+    calls = []
+    @memoized(ttl=10, negative_ttl=2, negative_errors=(KeyError,),
+              timer=timer)
+    def lookup(key):
+        calls.append(key)
+        if key == "bad":
+            raise KeyError(key)
+        if key == "worse":
+            raise ValueError(key)
+        return key.upper()
+
+    assert lookup("a") == "A"
+    timer.now = 9
+    assert lookup("a") == "A"
+    timer.now = 10
+    assert lookup("a") == "A"
+    assert calls == ["a", "a"]
+
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            lookup("bad")
+    assert calls.count("bad") == 1
+    assert lookup.cache_info().negative_hits == 1
+    timer.now = 12
+    with pytest.raises(KeyError):
+        lookup("bad")
+    assert calls.count("bad") == 2
+
+    #Cached errors are raised with a traceback of their own.
+    tracebacks = []
+    for _ in range(3):
+        with pytest.raises(KeyError) as e:
+            lookup("bad")
+        tracebacks.append(len(e.traceback))
+    assert calls.count("bad") == 2
+    assert tracebacks[1] == tracebacks[2]
+
+    #Errors not listed are never cached.
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            lookup("worse")
+    assert calls.count("worse") == 2
+
+def test_util_memoized_single_flight():
+    calls = []
+    started = threading.Event()
+    @memoized
+    def slow(num):
+        calls.append(num)
+        started.set()
+        time.sleep(0.05)
+        return num*2
+
+    results = []
+    def worker():
+        results.append(slow(21))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [42]*8
+    assert calls == [21]
+
+def test_util_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
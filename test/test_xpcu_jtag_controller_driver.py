@@ -1,10 +1,14 @@
 #-*- coding: utf-8 -*-
+import math
+import random
+
 import pytest
 
 from proteusisc.bittypes import bitarray
 from proteusisc.controllerManager import getDriverInstanceForDevice
+from proteusisc.jtagScanChain import JTAGScanChain
 from proteusisc.test_utils import FakeUSBDev, FakeXPCU1Handle,\
-    MockPhysicalJTAGDevice
+    MockPhysicalJTAGDevice, FakeUSBContext
 from proteusisc.primitive import ConstantBitarray
 
 def test_jtag_onoff():
@@ -158,3 +162,150 @@ def test_get_set_speed():
     c.speed = 10000000
     print()
     assert c.speed == 6000000
+
+def _reference_count_tdo_bits(data, bit_count):
+    return bin(sum([((ord(data[i*2+1:i*2+2])>>4) &
+                     (( 1<< min(4, bit_count-(i*4)) )-1) )<<4*i
+                    for i in range(int(len(data)/2))])).count('1')
+
+def _reference_decode_tdo_bits(ret, bit_return_count):
+    final_group_index = (bit_return_count-(bit_return_count%32))//8
+    retiter = iter(ret[:final_group_index])
+    fullgroups = [bytes(elem[::-1]) for elem in
+                  zip(retiter, retiter, retiter, retiter)][::-1]
+    other=ret[final_group_index:][::-1]
+    other_bits = bitarray()
+    other_bits.frombytes(other)
+    other_bits = other_bits[:bit_return_count-(8*final_group_index)]
+    raw_bits = bitarray()
+    raw_bits.frombytes(b"".join(fullgroups))
+    return other_bits + raw_bits
+
+def test_count_tdo_bits_matches_reference():
+    from proteusisc.drivers.xilinxPC1driver import XilinxPC1Driver
+    rng = random.Random(0x26)
+    for bit_count in list(range(1, 130))+[1023, 1024, 1025, 4099]:
+        data = bytes(rng.getrandbits(8)
+                     for _ in range(math.ceil(bit_count/4)*2))
+        assert XilinxPC1Driver._count_tdo_bits(data, bit_count) == \
+            _reference_count_tdo_bits(data, bit_count)
+
+def test_decode_tdo_bits_matches_reference():
+    from proteusisc.drivers.xilinxPC1driver import XilinxPC1Driver
+    rng = random.Random(0x26)
+    for bit_return_count in list(range(0, 200))+[1023, 1024, 1025, 4099]:
+        bytes_wanted = math.ceil(bit_return_count/8)
+        bytes_expected = bytes_wanted +(1 if bytes_wanted%2 else 0)
+        ret = bytes(rng.getrandbits(8) for _ in range(bytes_expected))
+        res = XilinxPC1Driver._decode_tdo_bits(
+            ret, bit_return_count=bit_return_count)
+        assert len(res) == bit_return_count
+        assert res == _reference_decode_tdo_bits(ret, bit_return_count)
+
+def test_transfer_bits_single():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'),
+                    idcode=bitarray('00000110110101001000000010010011'))
+    ctrl = FakeXPCU1Handle(d0)
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl))
+    c.jtag_enable()
+
+    c.transfer_bits_single(9, bitarray('001011111'), False)
+    assert d0.tapstate == "SHIFTDR"
+
+    res = c.transfer_bits_single(32, False, False, TDO=True)
+    assert d0.tapstate == "SHIFTDR"
+    assert res == d0._idcode
+
+def test_transfer_bits_batched_uses_bulk_transfer():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'),
+                    idcode=bitarray('00000110110101001000000010010011'))
+    ctrl = FakeXPCU1Handle(d0)
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl))
+    c.jtag_enable()
+
+    ctrl.control_transfer_count = 0
+    res = c.transfer_bits_batched(32+9,
+                                  TMS=bitarray('0'*32 + '001011111'),
+                                  TDO=ConstantBitarray(True, 32)+
+                                  ConstantBitarray(False, 9))
+    assert ctrl.control_transfer_count == 1
+    assert d0.tapstate == "SHIFTDR"
+    assert res == d0._idcode
+
+def test_transfer_bits_batched_cpld_upgrade_mode():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'),
+                    idcode=bitarray('00000110110101001000000010010011'))
+    ctrl = FakeXPCU1Handle(d0)
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl))
+    c.jtag_enable()
+    c.xpcu_enable_cpld_upgrade_mode(True)
+    assert ctrl.cpld_upgrade
+
+    ctrl.control_transfer_count = 0
+    res = c.transfer_bits_batched(32+9,
+                                  TMS=bitarray('0'*32 + '001011111'),
+                                  TDO=ConstantBitarray(True, 32)+
+                                  ConstantBitarray(False, 9))
+    #Two writes per bit, one read per returned bit.
+    assert ctrl.control_transfer_count == (32+9)*2+32
+    assert d0.tapstate == "SHIFTDR"
+    assert res == d0._idcode
+
+def test_single_step_primitive_costs_more_than_bulk():
+    from proteusisc.drivers.xilinxPC1driver import XPC1TransferPrimitive,\
+        XPC1SingleStepTransferPrimitive
+    from proteusisc.contracts import ARBITRARY
+    reqef = (ARBITRARY, ARBITRARY, ARBITRARY)
+    for count in (1, 8, 1000):
+        assert XPC1SingleStepTransferPrimitive._calc_score(
+            count, reqef, count) > \
+            XPC1TransferPrimitive._calc_score(count, reqef, count)
+
+def test_single_step_batch_uses_async_transfers():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'),
+                    idcode=bitarray('00000110110101001000000010010011'))
+    ctrl = FakeXPCU1Handle(d0)
+    transfers = []
+    def getTransfer():
+        transfers.append(FakeXPCU1Handle.getTransfer(ctrl))
+        return transfers[-1]
+    ctrl.getTransfer = getTransfer
+
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl))
+    c.jtag_enable()
+    c.transfer_bits_single(9, bitarray('001011111'), False)
+    assert not transfers
+
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl), FakeUSBContext())
+    c.jtag_enable()
+    res = c.transfer_bits_single(32, False, False, TDO=True)
+    assert transfers
+    assert res == d0._idcode
+
+def test_compiler_picks_single_step_in_cpld_upgrade_mode():
+    d0 = MockPhysicalJTAGDevice(name="D0", status=bitarray('11111100'),
+                    idcode=bitarray('00000110110101001000000010010011'))
+    ctrl = FakeXPCU1Handle(d0)
+    c = getDriverInstanceForDevice(FakeUSBDev(ctrl))
+    chain = JTAGScanChain(c)
+    chain.jtag_enable()
+    chain.transition_tap("TLR")
+    chain.flush()
+
+    def read_idcode():
+        chain.transition_tap("SHIFTDR")
+        res = chain.rw_reg(bitcount=32, read=True)
+        chain.transition_tap("TLR")
+        prims = chain._command_queue._compile(dryrun=True)
+        chain.flush()
+        assert res() == d0._idcode
+        return {type(p).__name__ for p in prims}
+
+    assert read_idcode() == {'XPC1TransferPrimitive'}
+    c.xpcu_enable_cpld_upgrade_mode(True)
+    ctrl.control_transfer_count = 0
+    assert read_idcode() == {'XPC1SingleStepTransferPrimitive'}
+    assert ctrl.control_transfer_count > 2*32
+    c.xpcu_enable_cpld_upgrade_mode(False)
+    assert read_idcode() == {'XPC1TransferPrimitive'}
+